@@ -0,0 +1,5 @@
+"""Code shared by the scripts of both sections.
+
+The section folders are not packages: scripts importing damage_core add the
+repository root to sys.path.
+"""
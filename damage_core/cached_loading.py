@@ -0,0 +1,113 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+
+def file_signature(filename, validation="mtime"):
+    """Computes the signature used to detect changes of a source file
+
+    Args:
+        filename (str): the source file
+        validation (str, optional): "mtime" (modification time and size) or
+            "hash" (sha256 of the content, robust to copies and touches).
+            Defaults to "mtime".
+
+    Returns:
+        str: the signature
+    """
+    if validation == "mtime":
+        stat = os.stat(filename)
+        return "{}-{}".format(stat.st_mtime_ns, stat.st_size)
+    elif validation == "hash":
+        sha = hashlib.sha256()
+        with open(filename, "rb") as source:
+            for block in iter(lambda: source.read(2**20), b""):
+                sha.update(block)
+        return sha.hexdigest()
+    else:
+        raise ValueError("Unknown validation {}".format(validation))
+
+
+def cached_array(
+    filename,
+    loader,
+    cache_folder=None,
+    validation="mtime",
+    mmap_mode="r",
+    **loader_kwargs
+):
+    """Loads an array from a text file, converting it once into a binary .npy
+    cache which is then memory-mapped. The cache is rebuilt when the source
+    file or the loader arguments change.
+
+    Args:
+        filename (str): the source file
+        loader (callable): the function reading the source file, called as
+            loader(filename, **loader_kwargs) and returning a numpy array
+        cache_folder (str, optional): the folder of the cache files. Defaults
+            to a .cache folder next to the source file.
+        validation (str, optional): the invalidation method, "mtime" or
+            "hash" (see file_signature). Defaults to "mtime".
+        mmap_mode (str, optional): the memory-map mode of np.load, None to
+            load the array in memory. Defaults to "r".
+        **loader_kwargs: the arguments of the loader
+
+    Returns:
+        numpy.ndarray or numpy.memmap: the array
+    """
+    if cache_folder is None:
+        cache_folder = os.path.join(
+            os.path.dirname(os.path.abspath(filename)), ".cache"
+        )
+    description = json.dumps(
+        {
+            "source": os.path.abspath(filename),
+            "loader": "{}.{}".format(loader.__module__, loader.__name__),
+            "kwargs": loader_kwargs,
+        },
+        sort_keys=True,
+        default=repr,
+    )
+    name = "{}.{}".format(
+        os.path.basename(filename), hashlib.sha1(description.encode()).hexdigest()[:12]
+    )
+    cache_file = os.path.join(cache_folder, name + ".npy")
+    signature_file = os.path.join(cache_folder, name + ".json")
+    signature = file_signature(filename, validation)
+
+    if os.path.exists(cache_file) and os.path.exists(signature_file):
+        with open(signature_file, "r") as f:
+            if json.load(f) == {"validation": validation, "signature": signature}:
+                return np.load(cache_file, mmap_mode=mmap_mode)
+
+    array = np.asarray(loader(filename, **loader_kwargs))
+    os.makedirs(cache_folder, exist_ok=True)
+    # write to temporary files first so that concurrent readers never see a
+    # partially written cache
+    pid = os.getpid()
+    np.save(cache_file + ".{}.tmp.npy".format(pid), array)
+    os.replace(cache_file + ".{}.tmp.npy".format(pid), cache_file)
+    with open(signature_file + ".{}.tmp".format(pid), "w") as f:
+        json.dump({"validation": validation, "signature": signature}, f)
+    os.replace(signature_file + ".{}.tmp".format(pid), signature_file)
+    return np.load(cache_file, mmap_mode=mmap_mode)
+
+
+def genfromtxt(filename, validation="mtime", mmap_mode="r", **kwargs):
+    """Cached equivalent of np.genfromtxt
+
+    Args:
+        filename (str): the text file
+        validation (str, optional): the invalidation method. Defaults to
+            "mtime".
+        mmap_mode (str, optional): the memory-map mode. Defaults to "r".
+        **kwargs: the arguments of np.genfromtxt
+
+    Returns:
+        numpy.ndarray or numpy.memmap: the data
+    """
+    return cached_array(
+        filename, np.genfromtxt, validation=validation, mmap_mode=mmap_mode, **kwargs
+    )
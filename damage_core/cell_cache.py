@@ -0,0 +1,90 @@
+import fcntl
+import json
+import os
+
+import numpy as np
+
+
+class CellCache:
+    """JSON cache of the number of cells found by mesh convergence studies,
+    looked up by (T, dpa) region so that sweeps start from a known-good and
+    minimal mesh.
+
+    Args:
+        filename (str): the JSON file
+        T_radius (float, optional): the half width of a region in
+            temperature (K). Defaults to 50.
+        log_dpa_radius (float, optional): the half width of a region in
+            log10(dpa). Defaults to 0.5.
+        dpa_floor (float, optional): the damage rate used in place of 0 on the
+            log10(dpa) axis. Defaults to 1e-6.
+    """
+
+    def __init__(self, filename, T_radius=50, log_dpa_radius=0.5, dpa_floor=1e-6):
+        self.filename = filename
+        self.T_radius = T_radius
+        self.log_dpa_radius = log_dpa_radius
+        self.dpa_floor = dpa_floor
+
+    def description(self):
+        return {
+            "filename": self.filename,
+            "T_radius": self.T_radius,
+            "log_dpa_radius": self.log_dpa_radius,
+            "dpa_floor": self.dpa_floor,
+        }
+
+    def entries(self):
+        if not os.path.exists(self.filename):
+            return []
+        with open(self.filename, "r") as f:
+            return json.load(f)
+
+    def lookup(self, T, dpa):
+        """Finds the number of cells for a case from the cached cases of its
+        region, taking the largest one to be on the safe side
+
+        Args:
+            T (float): the temperature (K)
+            dpa (float): the damage rate (dpa/fpy)
+
+        Returns:
+            int: the number of cells, None if no case of the region is cached
+        """
+        log_dpa = np.log10(max(dpa, self.dpa_floor))
+        cells = [
+            entry["cells"]
+            for entry in self.entries()
+            if abs(entry["T"] - T) <= self.T_radius
+            and abs(np.log10(max(entry["dpa"], self.dpa_floor)) - log_dpa)
+            <= self.log_dpa_radius
+        ]
+        if len(cells) == 0:
+            return None
+        return max(cells)
+
+    def add(self, T, dpa, cells):
+        """Caches the number of cells of a case, replacing the previous entry
+        of the same case
+
+        Args:
+            T (float): the temperature (K)
+            dpa (float): the damage rate (dpa/fpy)
+            cells (int): the number of cells
+        """
+        folder = os.path.dirname(os.path.abspath(self.filename))
+        os.makedirs(folder, exist_ok=True)
+        with open(self.filename + ".lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                entries = [
+                    entry
+                    for entry in self.entries()
+                    if (entry["T"], entry["dpa"]) != (float(T), float(dpa))
+                ]
+                entries.append({"T": float(T), "dpa": float(dpa), "cells": int(cells)})
+                with open(self.filename + ".tmp", "w") as f:
+                    json.dump(entries, f, indent=1)
+                os.replace(self.filename + ".tmp", self.filename)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
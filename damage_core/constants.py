@@ -0,0 +1,3 @@
+# Boltzmann constant (eV K-1), same value as festim.k_B so that the results do
+# not depend on where it is imported from
+k_B = 8.6173303e-5
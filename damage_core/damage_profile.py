@@ -0,0 +1,118 @@
+import hashlib
+import os
+
+import numpy as np
+
+
+class DamageProfile:
+    """Tabulated depth profile of the damage (eg. dpa or vacancies from SRIM)
+    normalised to a maximum of 1, so that the damaged trap densities are
+    n * profile(x).
+
+    The profile is linearly interpolated in the table and takes its end
+    values outside of it. It is meant to be evaluated at once on arrays of
+    points, eg. the DOF coordinates of a mesh.
+
+    Args:
+        x (array_like): the depths of the table (m)
+        values (array_like): the damage at these depths (any unit)
+        name (str, optional): the name of the profile (eg. the file name).
+            Defaults to "tabulated".
+    """
+
+    def __init__(self, x, values, name="tabulated"):
+        x = np.asarray(x, dtype=float)
+        values = np.asarray(values, dtype=float)
+        order = np.argsort(x)
+        self.x = x[order]
+        self.values = values[order] / np.max(np.abs(values))
+        self.name = name
+
+    @classmethod
+    def from_file(cls, filename, depth_unit=1, column=1, delimiter=None, **kwargs):
+        """Reads a profile from a text file with the depth in the first column,
+        eg. the VACANCY.txt output of SRIM (depth in angstrom, depth_unit=1e-10,
+        its header lines being skipped with skip_header)
+
+        Args:
+            filename (str): the file
+            depth_unit (float, optional): the unit of the depth column (m).
+                Defaults to 1.
+            column (int, optional): the index of the damage column. Defaults
+                to 1.
+            delimiter (str, optional): the delimiter, eg. "," for csv files.
+                Defaults to None (whitespace).
+            **kwargs: other arguments of np.genfromtxt (eg. skip_header)
+
+        Returns:
+            DamageProfile: the profile
+        """
+        data = np.genfromtxt(filename, delimiter=delimiter, **kwargs)
+        return cls(
+            data[:, 0] * depth_unit, data[:, column], name=os.path.basename(filename)
+        )
+
+    @classmethod
+    def sigmoid(cls, depth=2.3e-06, width=1e-07, nb_points=2001):
+        """Tabulates the sigmoid profile 1 / (1 + exp((x - depth) / width))
+        of the original TDS simulations
+
+        Args:
+            depth (float, optional): the depth of the damaged zone (m).
+                Defaults to 2.3e-06.
+            width (float, optional): the width of the transition (m).
+                Defaults to 1e-07.
+            nb_points (int, optional): the number of points of the table.
+                Defaults to 2001.
+
+        Returns:
+            DamageProfile: the profile
+        """
+        # the sigmoid is below 1e-13 at the end of the table
+        x = np.linspace(0, depth + 30 * width, num=nb_points)
+        values = 1 / (1 + np.exp((x - depth) / width))
+        return cls(x, values, name="sigmoid({:.3e}, {:.3e})".format(depth, width))
+
+    def __call__(self, x):
+        return np.interp(x, self.x, self.values)
+
+    def description(self):
+        sha = hashlib.sha256()
+        sha.update(self.x.tobytes())
+        sha.update(self.values.tobytes())
+        return {"name": self.name, "hash": sha.hexdigest()}
+
+    def refine(self, vertices, tolerance=0.05):
+        """Adds vertices in the cells of a mesh over which the profile varies
+        by more than tolerance, so that the mesh follows the damaged zone. In
+        each of these cells the new vertices equidistribute the variation of
+        the profile plus the length of the cell, ie. they gather where the
+        profile is steep (existing vertices are kept).
+
+        Args:
+            vertices (array_like): the sorted vertices of the mesh (m)
+            tolerance (float, optional): the maximum variation of the
+                normalised profile over a cell (total variation in the
+                table). Defaults to 0.05.
+
+        Returns:
+            numpy.array: the vertices of the refined mesh
+        """
+        vertices = np.asarray(vertices, dtype=float)
+        # cumulated total variation of the profile, in tolerance units
+        variation = np.concatenate([[0], np.cumsum(np.abs(np.diff(self.values)))])
+        levels = np.interp(vertices, self.x, variation) / tolerance
+        new_vertices = [vertices]
+        for i in np.where(np.diff(levels) > 1)[0]:
+            a, b = vertices[i], vertices[i + 1]
+            x = np.union1d(self.x[(self.x > a) & (self.x < b)], [a, b])
+            # strictly increasing monitor function of the cell
+            monitor = (
+                np.interp(x, self.x, variation) / tolerance
+                - levels[i]
+                + (x - a) / (b - a)
+            )
+            pieces = int(np.ceil(monitor[-1]))
+            targets = np.linspace(0, monitor[-1], num=pieces + 1)[1:-1]
+            new_vertices.append(np.interp(targets, monitor, x))
+        return np.unique(np.concatenate(new_vertices))
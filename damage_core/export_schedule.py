@@ -0,0 +1,103 @@
+import numpy as np
+
+
+class ExportSchedule:
+    """Decides at which time steps derived quantities are recorded, so that
+    the output size does not depend on the number of time steps.
+
+    A row is recorded at the first step reaching each of the scheduled times,
+    at the final time and, if rtol is given, when any quantity has changed by
+    more than rtol relative to the last recorded row.
+
+    Args:
+        final_time (float): the final time of the simulation (s)
+        times (list of float, optional): the scheduled times (s). Defaults to
+            None.
+        rtol (float, optional): the relative change triggering a record. If
+            None, quantities are only computed at the scheduled times.
+            Defaults to None.
+    """
+
+    def __init__(self, final_time, times=None, rtol=None):
+        if times is None:
+            times = []
+        self.final_time = final_time
+        self.times = np.sort(times)
+        self.rtol = rtol
+        self.reset()
+
+    def reset(self):
+        """Forgets the recorded rows so that the schedule can be reused"""
+        self.next_index = 0
+        self.last_values = None
+
+    @classmethod
+    def log_spaced(cls, final_time, first_time=1e-1, nb_times=200, rtol=None):
+        """Creates a schedule with times logarithmically spaced between
+        first_time and final_time
+
+        Args:
+            final_time (float): the final time of the simulation (s)
+            first_time (float, optional): the first scheduled time (s).
+                Defaults to 1e-1.
+            nb_times (int, optional): the number of scheduled times. Defaults
+                to 200.
+            rtol (float, optional): see ExportSchedule. Defaults to None.
+
+        Returns:
+            ExportSchedule: the schedule
+        """
+        times = np.geomspace(first_time, final_time, num=nb_times)
+        return cls(final_time, times=times, rtol=rtol)
+
+    def is_scheduled(self, t, final_time=None):
+        """Checks if t reaches the next scheduled times (or the final time)
+        and marks them as done
+
+        Args:
+            t (float): the current time (s)
+            final_time (float, optional): the final time of the simulation
+                (s). Defaults to the final time of the schedule.
+
+        Returns:
+            bool: True if a row has to be recorded at t
+        """
+        due = False
+        while self.next_index < len(self.times) and (
+            t >= self.times[self.next_index]
+            or np.isclose(t, self.times[self.next_index], atol=0)
+        ):
+            self.next_index += 1
+            due = True
+        if final_time is None:
+            final_time = self.final_time
+        final = t >= final_time or np.isclose(t, final_time, atol=0)
+        return due or final
+
+    def has_changed(self, values):
+        """Checks if any value has changed by more than rtol since the last
+        recorded row
+
+        Args:
+            values (list of float): the current values
+
+        Returns:
+            bool: True if the values have changed
+        """
+        if self.rtol is None:
+            return False
+        if self.last_values is None:
+            return True
+        values = np.asarray(values, dtype=float)
+        change = np.abs(values - self.last_values)
+        return np.any(change > self.rtol * np.abs(self.last_values))
+
+    def description(self):
+        return {
+            "final_time": self.final_time,
+            "times": self.times.tolist(),
+            "rtol": self.rtol,
+        }
+
+    def record(self, values):
+        self.last_values = np.asarray(values, dtype=float)
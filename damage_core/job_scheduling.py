@@ -0,0 +1,209 @@
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+
+
+class CostModel:
+    """Predicts the wall time of the sweep jobs from the recorded history.
+
+    log(wall time) is fitted by least squares as a linear function of the
+    features T, log10(dpa), log(cells) and log(total_time) of the jobs, cells
+    being the number of cells the job starts from (see starting_cells). Until
+    enough jobs have been recorded, the cost is assumed proportional to
+    cells x total_time. The jobs recorded without total_time (older
+    histories) are not used.
+
+    Args:
+        filename (str, optional): the JSON file where the history is kept
+            between campaigns. If None, the history is not saved. Defaults to
+            None.
+        dpa_floor (float, optional): the damage rate used in place of 0 in
+            log10(dpa). Defaults to 1e-6.
+    """
+
+    def __init__(self, filename=None, dpa_floor=1e-6):
+        self.filename = filename
+        self.dpa_floor = dpa_floor
+        self.history = []
+        if filename is not None and os.path.exists(filename):
+            with open(filename, "r") as f:
+                self.history = json.load(f)
+        self.coefficients = None
+        self.fit()
+
+    def features(self, T, dpa, cells, total_time):
+        T, dpa, cells, total_time = np.broadcast_arrays(
+            np.asarray(T, dtype=float),
+            np.asarray(dpa, dtype=float),
+            np.asarray(cells, dtype=float),
+            np.asarray(total_time, dtype=float),
+        )
+        return np.column_stack(
+            [
+                np.ones(T.size),
+                T.ravel() / 1000,
+                np.log10(np.maximum(dpa.ravel(), self.dpa_floor)),
+                np.log(cells.ravel()),
+                np.log(total_time.ravel()),
+            ]
+        )
+
+    def fit(self):
+        """Fits the model to the history (needs at least 5 jobs)"""
+        history = [job for job in self.history if "total_time" in job]
+        if len(history) < 5:
+            self.coefficients = None
+            return
+        X = self.features(
+            [job["T"] for job in history],
+            [job["dpa"] for job in history],
+            [job["cells"] for job in history],
+            [job["total_time"] for job in history],
+        )
+        y = np.log([job["wall_time"] for job in history])
+        self.coefficients = np.linalg.lstsq(X, y, rcond=None)[0]
+
+    def predict(self, T, dpa, cells, total_time):
+        """Predicts the wall time of jobs
+
+        Args:
+            T (float or array_like): the temperatures (K)
+            dpa (float or array_like): the damage rates (dpa/fpy)
+            cells (int or array_like): the initial numbers of cells
+            total_time (float or array_like): the simulated times (s)
+
+        Returns:
+            numpy.array: the predicted wall times (s)
+        """
+        if self.coefficients is None:
+            cost = np.asarray(cells, dtype=float) * np.asarray(total_time, dtype=float)
+            return np.broadcast_to(cost, np.shape(T)) * 1e-9
+        return np.exp(self.features(T, dpa, cells, total_time) @ self.coefficients)
+
+    def record(self, T, dpa, cells, total_time, wall_time):
+        """Adds a finished job to the history and refits the model
+
+        Args:
+            T (float): the temperature (K)
+            dpa (float): the damage rate (dpa/fpy)
+            cells (int): the initial number of cells
+            total_time (float): the simulated time (s)
+            wall_time (float): the measured wall time (s)
+        """
+        self.history.append(
+            {
+                "T": float(T),
+                "dpa": float(dpa),
+                "cells": int(cells),
+                "total_time": float(total_time),
+                "wall_time": float(wall_time),
+            }
+        )
+        self.fit()
+
+    def save(self):
+        if self.filename is None:
+            return
+        folder = os.path.dirname(os.path.abspath(self.filename))
+        os.makedirs(folder, exist_ok=True)
+        with open(self.filename + ".tmp", "w") as f:
+            json.dump(self.history, f, indent=1)
+        os.replace(self.filename + ".tmp", self.filename)
+
+
+def starting_cells(job):
+    """Finds the number of cells a job starts from: as in run_case, the
+    converged mesh of its cell_cache around (T, dpa) if any, else
+    job["cells"]
+
+    Args:
+        job (dict): the arguments of the job
+
+    Returns:
+        int: the number of cells
+    """
+    cell_cache = job.get("cell_cache")
+    if cell_cache is not None:
+        cells = cell_cache.lookup(job["T"], job["dpa"])
+        if cells is not None:
+            return cells
+    return job["cells"]
+
+
+def _failed(result):
+    """True if a job returned None or nan (eg. run_case, final_inventory)"""
+    if result is None:
+        return True
+    return isinstance(result, (float, np.floating)) and np.isnan(result)
+
+
+def _timed_call(function, kwargs):
+    start = time.perf_counter()
+    result = function(**kwargs)
+    return result, time.perf_counter() - start
+
+
+def run_jobs(function, jobs, cost_model=None, max_workers=None, callback=None):
+    """Runs jobs on a process pool, longest predicted first. The predictions
+    of the pending jobs are updated each time a job finishes. The failed jobs
+    (returning None or nan) are not added to the cost model.
+
+    Args:
+        function (callable): the (picklable) function called as
+            function(**job)
+        jobs (list of dict): the arguments of the jobs, with at least the keys
+            "T", "dpa", "cells" and "total_time"
+        cost_model (CostModel, optional): the cost model, updated and saved
+            as jobs finish. Defaults to a CostModel without history.
+        max_workers (int, optional): the number of processes. Defaults to the
+            number of CPUs.
+        callback (callable, optional): called as callback(i, result) as soon
+            as job i has finished. Defaults to None.
+
+    Returns:
+        list: the results of the jobs, in the order of jobs
+    """
+    if cost_model is None:
+        cost_model = CostModel()
+    if max_workers is None:
+        max_workers = os.cpu_count()
+    results = [None] * len(jobs)
+    pending = list(range(len(jobs)))
+    running = {}
+    cells = [starting_cells(job) for job in jobs]
+
+    def predicted_costs(indexes):
+        return cost_model.predict(
+            [jobs[i]["T"] for i in indexes],
+            [jobs[i]["dpa"] for i in indexes],
+            [cells[i] for i in indexes],
+            [jobs[i]["total_time"] for i in indexes],
+        )
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            if pending:
+                # longest processing time first
+                order = np.argsort(predicted_costs(pending))[::-1]
+                pending = [pending[i] for i in order]
+            while pending and len(running) < max_workers:
+                i = pending.pop(0)
+                # the cell cache may have changed since the predictions
+                cells[i] = starting_cells(jobs[i])
+                running[executor.submit(_timed_call, function, jobs[i])] = i
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                i = running.pop(future)
+                results[i], wall_time = future.result()
+                job = jobs[i]
+                if not _failed(results[i]):
+                    cost_model.record(
+                        job["T"], job["dpa"], cells[i], job["total_time"], wall_time
+                    )
+                if callback is not None:
+                    callback(i, results[i])
+            cost_model.save()
+    return results
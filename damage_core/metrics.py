@@ -0,0 +1,55 @@
+import numpy as np
+
+
+def mean_absolute_error(y1, y2, x=None, bounds=None, weight=None):
+    """computes the mean absolute error between y1 and y2
+
+    Args:
+        y1 (array_like): the first y data
+        y2 (array_like): the second y data
+        x (list, optional): the x data with same shape as y1, y2. Defaults to
+            None.
+        bounds (list, optional): x bounds for weighing the error based on
+            weight. Defaults to None.
+        weight (float or list of floats, optional): weight applied to the mean
+            value for x values in bounds. Defaults to None.
+
+    Returns:
+        float: the mean absolute error between y1 and y2
+    """
+    # Check parameters
+    if y1.shape != y2.shape:
+        raise ValueError("y1 and y2 don't have the same shape")
+    if x is not None:
+        if x.shape != y1.shape:
+            raise ValueError("x doesn't have the same shape as y1 and y2")
+
+    # if (bounds, weight) != (None, None):
+    #     if None in [bounds, weights]:
+    #         raise ValueError("bounds was set without weight (or the opposite)")
+    #     if x is None:
+    #         raise ValueError("if bounds are set, x array is needed")
+
+    if bounds is None:
+        bounds = []
+    if weight is None:
+        weight = []
+
+    # create weights
+    coefficients = np.ones(y1.shape)
+
+    if isinstance(weight, list):
+        weights = weight
+    else:
+        weights = [weight]
+
+    for bound, w in zip(bounds, weights):
+        indexes = np.where((x > bound[0]) & (x <= bound[1]))
+        coefficients[indexes] = w
+
+    # compute difference
+    diff = np.abs(y1 - y2)
+    diff = diff * coefficients
+    err = diff.mean()
+
+    return err
@@ -0,0 +1,43 @@
+import numpy as np
+
+
+def r_trap(c, k, p):
+    """Computes the filling rate of a trap for a given mobile concentration
+
+    Args:
+        c (float): the concentration in H/m3/s
+        k (float): the trapping rate in m3/s
+        p (float): the detrapping rate(s) in s-1
+
+    Returns:
+        float: the filling rate
+    """
+    val = 1 + p / (k * c)
+    val = 1 / val
+    return val
+
+
+def r_d(c_max, t, D, n, k, p):
+    """Computes the maximum R_d based on trap parameters and time.
+    See Equation 3.31 of Etienne Hodille's phd thesis
+
+    The traps are summed over the last axis of n, k and p. To compute R_d for
+    grids of cases with broadcasting, c_max, t and D are given a trailing axis
+    of length 1, which is kept in the result.
+
+    Args:
+        c_max (float): the maximum concentration in H/m3/s
+        t (float): the time in s
+        D (float): the diffusion coefficient in m2/s
+        n (array_like): the trap(s) density(ies) in trap/m3
+        k (array_like): the trapping rate(s) in m3/s
+        p (array_like): the detrapping rate(s) in s-1
+
+    Returns:
+        float: the penetration depth in m
+    """
+    R_d = 2 * D * c_max * t
+    R_d = R_d / (r_trap(c_max, k, p) * n).sum(axis=-1, keepdims=np.ndim(R_d) > 0)
+    R_d = R_d**0.5
+
+    return R_d
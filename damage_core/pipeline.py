@@ -0,0 +1,397 @@
+import hashlib
+import inspect
+import json
+import os
+
+import numpy as np
+
+from damage_core.cached_loading import file_signature
+from damage_core.job_scheduling import run_jobs
+
+
+def canonical(value, digits=12):
+    """Converts a value to a JSON serialisable form which does not depend on
+    round-off errors, so that equal inputs give equal hashes. Numbers are
+    converted to floats rounded to a number of significant digits (eg. the
+    700 K of np.linspace(600, 1300, 50) and 700 are the same).
+
+    Objects with a description() method (eg. Scenario, ExportSchedule) are
+    replaced by their description.
+
+    Args:
+        value: the value (None, bool, int, float, str, list, tuple, dict,
+            numpy array or scalar, or object with a description() method)
+        digits (int, optional): the number of significant digits of numbers.
+            Defaults to 12.
+
+    Returns:
+        the canonical value
+    """
+    if value is None or isinstance(value, (bool, np.bool_, str)):
+        return value.item() if isinstance(value, np.bool_) else value
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        # ints are converted too so that 700 and 700.0 are the same, and
+        # + 0.0 turns -0.0 into 0.0
+        return float("{:.{}g}".format(value, digits)) + 0.0
+    if isinstance(value, dict):
+        return {str(k): canonical(v, digits) for k, v in value.items()}
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return [canonical(v, digits) for v in value]
+    if hasattr(value, "description"):
+        return {
+            "class": type(value).__name__,
+            "description": canonical(value.description(), digits),
+        }
+    raise TypeError("Cannot hash {} of type {}".format(value, type(value)))
+
+
+class Pipeline:
+    """Incremental pipeline of simulations and derived datasets.
+
+    Each node is a function call keyed by a hash of its arguments, of the
+    source of the function, of the content of the code files it depends on
+    and of the hashes of the nodes it depends on. The hashes of the nodes
+    computed successfully are recorded in a JSON file, and running the
+    pipeline only recomputes the nodes whose hash is not recorded or whose
+    outputs are missing (and the nodes depending on them). Identical nodes
+    added several times (eg. a case shared by two figures) are computed once.
+
+    A node whose function returns without writing its outputs (eg. a
+    simulation which failed with every mesh) is recorded as failed and is not
+    recomputed until its hash changes: delete its entry from the record to
+    retry it.
+
+    Args:
+        filename (str): the JSON record of the computed nodes
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.nodes = {}
+
+    def add(
+        self,
+        function,
+        kwargs=None,
+        outputs=(),
+        code=(),
+        depends=(),
+        parallel=False,
+        name=None,
+    ):
+        """Adds a node to the pipeline
+
+        Args:
+            function (callable): the function of the node, called as
+                function(**kwargs). For parallel nodes it has to be picklable.
+            kwargs (dict, optional): the arguments of the function (see
+                canonical). Defaults to None.
+            outputs (list of str, optional): the files written by the node.
+                They are removed before the node is recomputed and the node
+                is stale if any of them is missing. Defaults to ().
+            code (list of str, optional): the source files the node depends on
+                besides the function itself (eg. the model). Defaults to ().
+            depends (list of str, optional): the hashes of the nodes the node
+                depends on. Defaults to ().
+            parallel (bool, optional): if True, the node is run with run_jobs
+                and kwargs needs the keys "T", "dpa", "cells" and
+                "total_time". Defaults to False.
+            name (str, optional): the name of the node in the logs. Defaults
+                to the name of the function.
+
+        Returns:
+            str: the hash of the node
+        """
+        if kwargs is None:
+            kwargs = {}
+        for key in depends:
+            if key not in self.nodes:
+                raise ValueError("Unknown dependency {}".format(key))
+        description = {
+            "function": function.__qualname__,
+            "source": inspect.getsource(function),
+            "code": {
+                os.path.basename(filename): file_signature(filename, "hash")
+                for filename in code
+            },
+            "kwargs": canonical(kwargs),
+            "depends": sorted(depends),
+        }
+        key = hashlib.sha256(
+            json.dumps(description, sort_keys=True).encode()
+        ).hexdigest()
+        if key in self.nodes:
+            return key
+        for node in self.nodes.values():
+            if set(outputs) & set(node["outputs"]):
+                raise ValueError(
+                    "{} and {} write the same outputs with different "
+                    "inputs".format(name or function.__name__, node["name"])
+                )
+        self.nodes[key] = {
+            "function": function,
+            "kwargs": kwargs,
+            "outputs": list(outputs),
+            "depends": list(depends),
+            "parallel": parallel,
+            "name": name or function.__name__,
+        }
+        return key
+
+    def record(self):
+        if not os.path.exists(self.filename):
+            return {}
+        with open(self.filename, "r") as f:
+            return json.load(f)
+
+    def write_record(self, record):
+        folder = os.path.dirname(os.path.abspath(self.filename))
+        os.makedirs(folder, exist_ok=True)
+        with open(self.filename + ".tmp", "w") as f:
+            json.dump(record, f, indent=1)
+        os.replace(self.filename + ".tmp", self.filename)
+
+    def record_node(self, key):
+        """Records a node as computed if all its outputs exist
+
+        Args:
+            key (str): the hash of the node
+
+        Returns:
+            bool: True if the node has been recorded
+        """
+        node = self.nodes[key]
+        if not all(os.path.exists(output) for output in node["outputs"]):
+            return False
+        record = self.record()
+        # forget the previous versions of the node
+        for other_key in list(record):
+            if set(record[other_key]["outputs"]) & set(node["outputs"]):
+                del record[other_key]
+        record[key] = {"name": node["name"], "outputs": node["outputs"]}
+        self.write_record(record)
+        return True
+
+    def record_failure(self, key):
+        """Records a node as failed, so that it is not recomputed with the
+        same inputs
+
+        Args:
+            key (str): the hash of the node
+        """
+        node = self.nodes[key]
+        record = self.record()
+        for other_key in list(record):
+            if set(record[other_key]["outputs"]) & set(node["outputs"]):
+                del record[other_key]
+        record[key] = {
+            "name": node["name"],
+            "outputs": node["outputs"],
+            "failed": True,
+        }
+        self.write_record(record)
+
+    def failures(self):
+        """Finds the nodes recorded as failed
+
+        Returns:
+            list of str: the hashes of the failed nodes
+        """
+        record = self.record()
+        return [
+            key for key in self.nodes if key in record and record[key].get("failed")
+        ]
+
+    def stale(self):
+        """Finds the nodes to recompute
+
+        Returns:
+            list of str: the hashes of the stale nodes
+        """
+        record = self.record()
+        stale = set()
+        for key, node in self.nodes.items():
+            if record.get(key, {}).get("failed"):
+                continue
+            if key not in record or not all(
+                os.path.exists(output) for output in node["outputs"]
+            ):
+                stale.add(key)
+        # nodes depending on stale nodes are stale (the hashes already differ
+        # if a dependency has changed, this catches deleted outputs)
+        changed = True
+        while changed:
+            changed = False
+            for key, node in self.nodes.items():
+                if key not in stale and stale.intersection(node["depends"]):
+                    stale.add(key)
+                    changed = True
+        return [key for key in self.nodes if key in stale]
+
+    def run(self, cost_model=None, max_workers=None):
+        """Recomputes the stale nodes, dependencies first. A node fails if
+        its function raises an exception or does not write all its outputs,
+        in which case the nodes depending on it are skipped. Only the latter
+        failures are recorded (see Pipeline.record_failure), an exception
+        being possibly transient.
+
+        Args:
+            cost_model (CostModel, optional): the cost model of run_jobs for
+                the parallel nodes. Defaults to None.
+            max_workers (int, optional): the number of processes for the
+                parallel nodes. Defaults to the number of CPUs.
+
+        Returns:
+            list of str: the hashes of the nodes which failed or were skipped
+        """
+        pending = self.stale()
+        failed = self.failures()
+        print(
+            "pipeline: {} nodes, {} up to date, {} failed, {} to compute".format(
+                len(self.nodes),
+                len(self.nodes) - len(pending) - len(failed),
+                len(failed),
+                len(pending),
+            )
+        )
+        while pending:
+            skipped = [
+                key
+                for key in pending
+                if set(self.nodes[key]["depends"]).intersection(failed)
+            ]
+            for key in skipped:
+                print("pipeline: {} skipped".format(self.nodes[key]["name"]))
+            failed += skipped
+            pending = [key for key in pending if key not in skipped]
+            ready = [
+                key
+                for key in pending
+                if not set(self.nodes[key]["depends"]).intersection(pending)
+            ]
+            for key in ready:
+                for output in self.nodes[key]["outputs"]:
+                    if os.path.exists(output):
+                        os.remove(output)
+
+            def done(key):
+                if not self.record_node(key):
+                    print("pipeline: {} failed".format(self.nodes[key]["name"]))
+                    self.record_failure(key)
+                    failed.append(key)
+
+            serial = [key for key in ready if not self.nodes[key]["parallel"]]
+            for key in serial:
+                node = self.nodes[key]
+                print("pipeline: running {}".format(node["name"]))
+                try:
+                    node["function"](**node["kwargs"])
+                except Exception as e:
+                    print("pipeline: {} raised {}".format(node["name"], e))
+                    failed.append(key)
+                    continue
+                done(key)
+
+            # parallel nodes are run with one pool per function
+            parallel = [key for key in ready if self.nodes[key]["parallel"]]
+            functions = []
+            for key in parallel:
+                if self.nodes[key]["function"] not in functions:
+                    functions.append(self.nodes[key]["function"])
+            for function in functions:
+                keys = [k for k in parallel if self.nodes[k]["function"] is function]
+                run_jobs(
+                    function,
+                    [self.nodes[k]["kwargs"] for k in keys],
+                    cost_model=cost_model,
+                    max_workers=max_workers,
+                    callback=lambda i, result: done(keys[i]),
+                )
+
+            pending = [key for key in pending if key not in ready]
+        return failed
+
+    def submit(self, queue):
+        """Submits the stale nodes to a WorkQueue instead of running them, so
+        that workers on several hosts can compute them. Nodes depending on
+        stale nodes are submitted by a later call, once collect has recorded
+        their dependencies.
+
+        Args:
+            queue (WorkQueue): the queue
+
+        Returns:
+            int: the number of nodes submitted
+        """
+        pending = self.stale()
+        collected = self.collect(queue)
+        pending = [key for key in pending if key not in collected]
+        # the nodes depending on failed nodes are not submitted
+        failed = self.failures()
+        skipped = None
+        while skipped != []:
+            skipped = [
+                key
+                for key in pending
+                if set(self.nodes[key]["depends"]).intersection(failed)
+            ]
+            failed += skipped
+            pending = [key for key in pending if key not in skipped]
+        queued = {job["key"]: job["status"] for job in queue.jobs()}
+        ready = [
+            key
+            for key in pending
+            if not set(self.nodes[key]["depends"]).intersection(pending)
+            and queued.get(key) in (None, "failed", "done")
+        ]
+        for key in ready:
+            for output in self.nodes[key]["outputs"]:
+                if os.path.exists(output):
+                    os.remove(output)
+        # one submission per function
+        nb_submitted = 0
+        functions = []
+        for key in ready:
+            if self.nodes[key]["function"] not in functions:
+                functions.append(self.nodes[key]["function"])
+        for function in functions:
+            keys = [k for k in ready if self.nodes[k]["function"] is function]
+            nb_submitted += queue.submit(
+                function,
+                [self.nodes[k]["kwargs"] for k in keys],
+                keys=keys,
+                names=[self.nodes[k]["name"] for k in keys],
+                reset_done=True,
+            )
+        print(
+            "pipeline: {} nodes to compute, {} submitted, {} waiting for "
+            "dependencies".format(
+                len(pending),
+                nb_submitted,
+                len([key for key in pending if key not in ready]),
+            )
+        )
+        return nb_submitted
+
+    def collect(self, queue):
+        """Records the nodes completed by the workers of a WorkQueue. The
+        nodes done without writing their outputs are recorded as failed (see
+        Pipeline.record_failure).
+
+        Args:
+            queue (WorkQueue): the queue
+
+        Returns:
+            list of str: the hashes of the recorded nodes, failed or not
+        """
+        record = self.record()
+        collected = []
+        for job in queue.jobs("done"):
+            key = job["key"]
+            if key not in self.nodes or key in record:
+                continue
+            if not self.record_node(key):
+                print("pipeline: {} failed".format(self.nodes[key]["name"]))
+                self.record_failure(key)
+            collected.append(key)
+        return collected
@@ -0,0 +1,360 @@
+import fcntl
+import os
+from contextlib import contextmanager
+
+import numpy as np
+
+
+class ResultsStore:
+    """Columnar HDF5 store of the results of a sweep of simulations
+
+    Each case is identified by the exact values of its key parameters (eg.
+    dpa, T and total time) and can carry extra metadata (eg. number of
+    cells). The time series of all cases are concatenated column by column so
+    that reading one quantity for all the cases is a single dataset read.
+
+    File layout:
+        /cases/<name>: one value per case for each key parameter and
+            metadata, plus "offset" and "length" locating the case in /series
+            and "valid" (False for cases superseded by a later append)
+        /final/<column>: the last value of each series column, per case
+        /series/<column>: the time series of all the cases, concatenated
+
+    Appends are protected by a lock file so that several processes can write
+    to the same store.
+
+    Args:
+        filename (str): the HDF5 file
+        key (list of str, optional): the parameters identifying a case.
+            Defaults to ["dpa", "T", "total_time"].
+    """
+
+    def __init__(self, filename, key=None):
+        if key is None:
+            key = ["dpa", "T", "total_time"]
+        self.filename = filename
+        self.key = list(key)
+
+    @contextmanager
+    def open(self, mode="r"):
+        """Opens the HDF5 file while holding the store lock (shared for
+        reading, exclusive for writing)
+
+        Args:
+            mode (str, optional): the h5py file mode. Defaults to "r".
+
+        Yields:
+            h5py.File: the opened file
+        """
+        import h5py
+
+        folder = os.path.dirname(os.path.abspath(self.filename))
+        os.makedirs(folder, exist_ok=True)
+        with open(self.filename + ".lock", "a") as lock_file:
+            lock = fcntl.LOCK_SH if mode == "r" else fcntl.LOCK_EX
+            fcntl.flock(lock_file, lock)
+            try:
+                with h5py.File(self.filename, mode) as h5_file:
+                    yield h5_file
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def description(self):
+        return {"filename": self.filename, "key": self.key}
+
+    def exists(self):
+        return os.path.exists(self.filename)
+
+    def append(self, cases):
+        """Appends a batch of cases to the store. Cases with the same key as an
+        existing case supersede it.
+
+        The metadata may differ from one batch to the next (eg. cases ingested
+        without the number of cells): a metadata missing from the store or
+        from a case is filled with NaN ("" for strings). The series columns
+        have to be the same for all the cases. Nothing is written if the
+        batch is rejected.
+
+        Args:
+            cases (list of dict): the cases. Each case maps the key parameters
+                and metadata names to their values and "series" to a dict
+                mapping column names to 1D arrays of the same length.
+
+        Raises:
+            ValueError: if a case misses a key parameter or if the series
+                columns differ from the ones of the store
+        """
+        import h5py
+
+        if len(cases) == 0:
+            return
+        names = []
+        for case in cases:
+            names += [name for name in case if name != "series" and name not in names]
+        for case in cases:
+            for name in self.key:
+                if name not in case:
+                    raise ValueError("case is missing key parameter {}".format(name))
+        columns = list(cases[0]["series"])
+        for case in cases:
+            if set(case["series"]) != set(columns):
+                raise ValueError("the cases do not have the same series columns")
+
+        with self.open("a") as h5_file:
+            cases_group = h5_file.require_group("cases")
+            final_group = h5_file.require_group("final")
+            series_group = h5_file.require_group("series")
+            nb_existing = len(cases_group["offset"]) if "offset" in cases_group else 0
+            offset = len(series_group[columns[0]]) if columns[0] in series_group else 0
+
+            # check the batch against the store before writing anything
+            if nb_existing > 0:
+                if set(series_group) != set(columns):
+                    raise ValueError(
+                        "series columns {} differ from the columns {} of the "
+                        "store".format(sorted(columns), sorted(series_group))
+                    )
+                for name in cases_group:
+                    if name not in names + ["offset", "length", "valid"]:
+                        names.append(name)
+            metadata = {}
+            for name in names:
+                values = [case.get(name) for case in cases]
+                present = [value for value in values if value is not None]
+                if all(isinstance(value, str) for value in present) and (
+                    name not in cases_group or cases_group[name].dtype.kind == "O"
+                ):
+                    values = [value if value is not None else "" for value in values]
+                    values = np.array(values, dtype=h5py.string_dtype())
+                elif None in values:
+                    values = np.array(
+                        [np.nan if value is None else value for value in values],
+                        dtype=float,
+                    )
+                else:
+                    values = np.asarray(values)
+                if nb_existing > 0 and name not in cases_group:
+                    # column new to the store, NaN for the existing cases
+                    if values.dtype.kind == "O":
+                        filler = np.full(nb_existing, "", dtype=values.dtype)
+                    else:
+                        filler = np.full(nb_existing, np.nan)
+                    _append_dataset(cases_group, name, filler, 0)
+                elif (
+                    nb_existing > 0
+                    and values.dtype.kind == "f"
+                    and cases_group[name].dtype.kind in "iub"
+                ):
+                    # eg. cells stored as integers, NaN for some new cases
+                    existing = cases_group[name][:].astype(float)
+                    del cases_group[name]
+                    _append_dataset(cases_group, name, existing, 0)
+                metadata[name] = values
+
+            # supersede existing cases with the same key
+            if nb_existing > 0:
+                existing_keys = np.column_stack(
+                    [cases_group[name][:] for name in self.key]
+                )
+                valid = cases_group["valid"][:]
+                for case in cases:
+                    new_key = np.array([case[name] for name in self.key], dtype=float)
+                    valid[np.all(existing_keys == new_key, axis=1)] = False
+                cases_group["valid"][:] = valid
+
+            lengths = [len(case["series"][columns[0]]) for case in cases]
+            offsets = offset + np.concatenate([[0], np.cumsum(lengths)[:-1]])
+
+            new_values = dict(metadata)
+            new_values["offset"] = offsets
+            new_values["length"] = np.asarray(lengths)
+            new_values["valid"] = np.ones(len(cases), dtype=bool)
+            for name, values in new_values.items():
+                _append_dataset(cases_group, name, values, nb_existing)
+
+            for column in columns:
+                values = np.concatenate(
+                    [np.asarray(case["series"][column], dtype=float) for case in cases]
+                )
+                _append_dataset(series_group, column, values, offset)
+                finals = [case["series"][column][-1] for case in cases]
+                _append_dataset(final_group, column, np.asarray(finals), nb_existing)
+
+    def cases(self):
+        """Reads the key parameters and metadata of all the valid cases
+
+        Returns:
+            dict: maps each parameter name to a numpy array (one value per
+                valid case)
+        """
+        with self.open() as h5_file:
+            return _read_cases(h5_file)
+
+    def final(self, column):
+        """Reads the last value of a quantity for all the valid cases in one
+        go, without reading the time series
+
+        Args:
+            column (str): the quantity (eg. "Total_retention_volume_1")
+
+        Returns:
+            dict, numpy.array: the cases (see ResultsStore.cases()) and the
+                final values
+        """
+        # a single read so that an append cannot come in between
+        with self.open() as h5_file:
+            cases = _read_cases(h5_file)
+            valid = h5_file["cases/valid"][:]
+            values = h5_file["final"][column][:][valid]
+        return cases, values
+
+    def find(self, rtol=0, **key):
+        """Finds the index of a valid case from its key parameters
+
+        Args:
+            rtol (float, optional): the relative tolerance on the parameters,
+                eg. for cases ingested from rounded folder names. Defaults to
+                0 (exact match).
+            **key: the key parameters of the case
+
+        Returns:
+            int: the index of the case in ResultsStore.cases()
+
+        Raises:
+            KeyError: if there is no such case
+        """
+        return _find(self.cases(), rtol, key)
+
+    def series(self, columns=None, rtol=0, **key):
+        """Reads the time series of a case
+
+        Args:
+            columns (list of str, optional): the columns to read. If None, all
+                the columns are read. Defaults to None.
+            rtol (float, optional): the relative tolerance on the parameters.
+                Defaults to 0.
+            **key: the key parameters of the case
+
+        Returns:
+            dict: maps column names to numpy arrays
+        """
+        with self.open() as h5_file:
+            cases = _read_cases(h5_file)
+            index = _find(cases, rtol, key)
+            start = cases["offset"][index]
+            stop = start + cases["length"][index]
+            if columns is None:
+                columns = list(h5_file["series"])
+            return {column: h5_file["series"][column][start:stop] for column in columns}
+
+
+def _read_cases(h5_file):
+    """Reads the key parameters and metadata of the valid cases of an opened
+    store"""
+    valid = h5_file["cases/valid"][:]
+    return {
+        name: _decode(dataset[:])[valid]
+        for name, dataset in h5_file["cases"].items()
+        if name != "valid"
+    }
+
+
+def _find(cases, rtol, key):
+    """Finds the index of the last case matching key (see ResultsStore.find)"""
+    match = np.ones(len(cases["offset"]), dtype=bool)
+    for name, value in key.items():
+        match &= np.isclose(cases[name], value, rtol=rtol, atol=0)
+    indexes = np.where(match)[0]
+    if len(indexes) == 0:
+        raise KeyError("no case with {}".format(key))
+    return indexes[-1]
+
+
+def _append_dataset(group, name, values, nb_existing):
+    """Appends values to a resizable 1D dataset of group, creating it if
+    needed"""
+    if name not in group:
+        if nb_existing > 0:
+            raise ValueError("{} is not a column of the store".format(name))
+        group.create_dataset(
+            name,
+            data=values,
+            maxshape=(None,),
+            chunks=True,
+            compression="gzip",
+        )
+        return
+    dataset = group[name]
+    if len(dataset) != nb_existing:
+        raise ValueError("inconsistent length of dataset {}".format(name))
+    dataset.resize((nb_existing + len(values),))
+    dataset[nb_existing:] = values
+
+
+def _decode(values):
+    if values.dtype.kind == "O":
+        return np.array([value.decode() for value in values])
+    return values
+
+
+def read_derived_quantities(filename):
+    """Reads a FESTIM derived quantities csv file
+
+    Args:
+        filename (str): the csv file
+
+    Returns:
+        dict: maps column names (as given by np.genfromtxt, eg. "ts",
+            "Total_retention_volume_1") to numpy arrays
+    """
+    data = np.genfromtxt(filename, delimiter=",", names=True)
+    return {name: np.atleast_1d(data[name]) for name in data.dtype.names}
+
+
+def ingest_results_folder(store, results_folder, total_time, **metadata):
+    """Adds to the store the cases of a results folder organised as
+    results_folder/dpa={:.1e}/T={:.0f}/derived_quantities.csv
+
+    The key parameters are parsed from the folder names and are therefore
+    rounded as in the names.
+
+    Args:
+        store (ResultsStore): the store
+        results_folder (str): the results folder
+        total_time (float): the simulated time (s)
+        **metadata: extra metadata stored with every case
+
+    Returns:
+        int: the number of cases added
+    """
+    cases = []
+    for dpa_folder in sorted(os.listdir(results_folder)):
+        if not dpa_folder.startswith("dpa="):
+            continue
+        for T_folder in sorted(os.listdir(os.path.join(results_folder, dpa_folder))):
+            filename = os.path.join(
+                results_folder, dpa_folder, T_folder, "derived_quantities.csv"
+            )
+            if not T_folder.startswith("T=") or not os.path.exists(filename):
+                continue
+            case = {
+                "dpa": float(dpa_folder[len("dpa=") :]),
+                "T": float(T_folder[len("T=") :]),
+                "total_time": total_time,
+                "series": read_derived_quantities(filename),
+            }
+            case.update(metadata)
+            cases.append(case)
+    store.append(cases)
+    return len(cases)
+
+
+if __name__ == "__main__":
+    import sys
+
+    # usage: python -m damage_core.results_store results_folder store.h5 total_time
+    results_folder, filename, total_time = sys.argv[1:4]
+    nb_cases = ingest_results_folder(
+        ResultsStore(filename), results_folder, float(total_time)
+    )
+    print("{} cases added to {}".format(nb_cases, filename))
@@ -0,0 +1,240 @@
+import json
+import os
+import platform
+import resource
+import time
+from datetime import datetime
+from importlib.metadata import PackageNotFoundError, version
+
+import numpy as np
+
+
+class RunManifest:
+    """Context manager writing a JSON manifest of a simulation run: inputs,
+    wall and CPU time, number of time steps, non converged solves, peak
+    memory, outcome and library versions.
+
+    If the manifest file already exists and records a failed run (eg. the
+    previous attempt of a retry ladder), the retries are counted and the
+    previous failures are carried over.
+
+    Args:
+        filename (str): the JSON manifest file
+        inputs (dict): the inputs of the run (JSON serialisable values)
+    """
+
+    def __init__(self, filename, inputs):
+        self.filename = filename
+        self.data = {
+            "inputs": inputs,
+            "status": "running",
+            "retries": 0,
+            "failures": [],
+            "nb_steps": 0,
+            "solver_failures": 0,
+            "versions": library_versions(),
+            "host": platform.node(),
+        }
+        self.watched = []
+
+    def __enter__(self):
+        previous = read_manifest(self.filename)
+        if previous is not None and previous["status"] != "success":
+            self.data["retries"] = previous["retries"] + 1
+            self.data["failures"] = previous["failures"] + [
+                {
+                    "inputs": previous["inputs"],
+                    "error": previous.get("error"),
+                    "wall_time": previous.get("wall_time"),
+                }
+            ]
+        self.data["start"] = datetime.now().isoformat(timespec="seconds")
+        self.wall_start = time.perf_counter()
+        self.cpu_start = time.process_time()
+        self.write()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for obj, name in self.watched:
+            # removes the instance attribute hiding the method
+            delattr(obj, name)
+        self.watched = []
+        self.data["wall_time"] = time.perf_counter() - self.wall_start
+        self.data["cpu_time"] = time.process_time() - self.cpu_start
+        # peak resident memory of the process since it started (kB on Linux)
+        self.data["peak_memory_MB"] = (
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        )
+        if exc_type is None:
+            self.data["status"] = "success"
+        else:
+            self.data["status"] = "failed"
+            self.data["error"] = "{}: {}".format(exc_type.__name__, exc_value)
+        self.write()
+        return False
+
+    def watch_simulation(self, simulation):
+        """Counts the time steps of a FESTIM simulation and the non converged
+        solves reported to its stepsize
+
+        Args:
+            simulation (F.Simulation): the simulation (with its dt attribute
+                defined)
+        """
+        iterate = simulation.iterate
+        adapt = simulation.dt.adapt
+
+        def counting_iterate(*args, **kwargs):
+            self.data["nb_steps"] += 1
+            return iterate(*args, **kwargs)
+
+        def counting_adapt(t, nb_it, converged, *args, **kwargs):
+            if not converged:
+                self.data["solver_failures"] += 1
+            return adapt(t, nb_it, converged, *args, **kwargs)
+
+        simulation.iterate = counting_iterate
+        simulation.dt.adapt = counting_adapt
+        self.watched += [(simulation, "iterate"), (simulation.dt, "adapt")]
+
+    def write(self):
+        folder = os.path.dirname(os.path.abspath(self.filename))
+        os.makedirs(folder, exist_ok=True)
+        with open(self.filename + ".tmp", "w") as f:
+            json.dump(self.data, f, indent=1, default=_to_json)
+        os.replace(self.filename + ".tmp", self.filename)
+
+
+def _to_json(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    return repr(value)
+
+
+def library_versions():
+    versions = {}
+    for name in ["festim", "fenics-dolfin", "numpy", "scipy"]:
+        try:
+            versions[name] = version(name)
+        except PackageNotFoundError:
+            versions[name] = None
+    return versions
+
+
+def read_manifest(filename):
+    """Reads a manifest
+
+    Args:
+        filename (str): the JSON manifest file
+
+    Returns:
+        dict: the manifest, None if the file does not exist
+    """
+    if not os.path.exists(filename):
+        return None
+    with open(filename, "r") as f:
+        return json.load(f)
+
+
+def collect_manifests(folder, filename="manifest.json"):
+    """Finds and reads all the manifests of a campaign
+
+    Args:
+        folder (str): the campaign folder, searched recursively
+        filename (str, optional): the name of the manifest files. Defaults to
+            "manifest.json".
+
+    Returns:
+        list of dict: the manifests, with their folder under "folder"
+    """
+    manifests = []
+    for root, _, files in sorted(os.walk(folder)):
+        if filename in files:
+            manifest = read_manifest(os.path.join(root, filename))
+            manifest["folder"] = root
+            manifests.append(manifest)
+    return manifests
+
+
+def report(manifests, parameters=("T", "dpa")):
+    """Aggregates manifests into a table of cost and failures per case and a
+    summary of the campaign
+
+    Args:
+        manifests (list of dict): the manifests
+        parameters (tuple of str, optional): the inputs identifying a case.
+            Defaults to ("T", "dpa").
+
+    Returns:
+        str: the report
+    """
+    header = list(parameters) + [
+        "status",
+        "cells",
+        "retries",
+        "steps",
+        "solver failures",
+        "wall (s)",
+        "cpu (s)",
+        "memory (MB)",
+    ]
+    rows = []
+    for manifest in manifests:
+        inputs = manifest["inputs"]
+        cells = inputs.get("cells", inputs.get("initial_number_cells"))
+        rows.append(
+            [inputs.get(name) for name in parameters]
+            + [
+                manifest["status"],
+                cells,
+                manifest["retries"],
+                manifest["nb_steps"],
+                manifest["solver_failures"],
+                manifest.get("wall_time"),
+                manifest.get("cpu_time"),
+                manifest.get("peak_memory_MB"),
+            ]
+        )
+    rows.sort(
+        key=lambda row: [np.inf if v is None else v for v in row[: len(parameters)]]
+    )
+
+    def cell(value):
+        if isinstance(value, float):
+            return "{:.3g}".format(value)
+        return str(value)
+
+    table = [header] + [[cell(value) for value in row] for row in rows]
+    widths = [max(len(row[i]) for row in table) for i in range(len(header))]
+    lines = ["  ".join(v.rjust(w) for v, w in zip(row, widths)) for row in table]
+
+    nb_runs = len(manifests)
+    nb_failed = sum(manifest["status"] != "success" for manifest in manifests)
+    nb_retried = sum(manifest["retries"] > 0 for manifest in manifests)
+    nb_attempts = sum(manifest["retries"] + 1 for manifest in manifests)
+    wall_times = [m["wall_time"] for m in manifests if m.get("wall_time") is not None]
+    lines += [
+        "",
+        "cases: {}, failed: {} ({:.1%}), retried: {} ({:.1%})".format(
+            nb_runs,
+            nb_failed,
+            nb_failed / max(nb_runs, 1),
+            nb_retried,
+            nb_retried / max(nb_runs, 1),
+        ),
+        "attempts: {}, failure rate per attempt: {:.1%}".format(
+            nb_attempts,
+            (nb_attempts - nb_runs + nb_failed) / max(nb_attempts, 1),
+        ),
+        "total wall time of the last attempts: {:.3g} s".format(sum(wall_times)),
+    ]
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    import sys
+
+    # usage: python -m damage_core.run_manifest campaign_folder
+    print(report(collect_manifests(sys.argv[1])))
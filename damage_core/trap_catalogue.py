@@ -0,0 +1,207 @@
+import numpy as np
+
+from damage_core.constants import k_B
+from damage_core.penetration_depth import r_d, r_trap
+from damage_core.trap_creation import annealing_rate, trap_density
+from damage_core.trap_density_map import trap_density_map
+
+
+class TrapCatalogue:
+    """Properties of a set of traps stored as arrays (one value per trap), so
+    that the calculations over all the traps are array operations.
+
+    The rate methods broadcast their arguments against a trailing trap axis:
+    for T of shape S, they return arrays of shape S + (len(catalogue),).
+
+    Args:
+        names (list of str): the names of the traps
+        k_0 (array_like): the trapping pre-exponential factors (m3 s-1)
+        E_k (array_like): the trapping activation energies (eV)
+        p_0 (array_like): the detrapping pre-exponential factors (s-1)
+        E_p (array_like): the detrapping activation energies (eV)
+        density (array_like, optional): the intrinsic (undamaged) trap
+            densities (m-3). Defaults to 0.
+        A_0 (array_like, optional): the trap annealing factors (s-1).
+            Defaults to 0.
+        E_A (array_like, optional): the annealing activation energies (eV).
+            Defaults to 1.
+        K (array_like, optional): the trap creation factors (traps dpa-1).
+            Defaults to 0.
+        n_max (array_like, optional): the maximum trap densities created by
+            damage (m-3). Defaults to 1.
+    """
+
+    properties = ["k_0", "E_k", "p_0", "E_p", "density", "A_0", "E_A", "K", "n_max"]
+
+    def __init__(
+        self, names, k_0, E_k, p_0, E_p, density=0, A_0=0, E_A=1, K=0, n_max=1
+    ):
+        self.names = list(names)
+        values = [k_0, E_k, p_0, E_p, density, A_0, E_A, K, n_max]
+        for name, value in zip(self.properties, values):
+            value = np.broadcast_to(np.asarray(value, dtype=float), len(self.names))
+            setattr(self, name, value.copy())
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, index):
+        """Selects traps by name, list of names, index, slice or mask
+
+        Returns:
+            TrapCatalogue: the selected traps
+        """
+        if isinstance(index, str):
+            index = [index]
+        if isinstance(index, list) and all(isinstance(i, str) for i in index):
+            index = [self.names.index(name) for name in index]
+        indexes = np.arange(len(self))[index]
+        return TrapCatalogue(
+            np.array(self.names)[indexes].tolist(),
+            **{name: getattr(self, name)[indexes] for name in self.properties}
+        )
+
+    def replace(self, **values):
+        """Creates a copy of the catalogue with some properties replaced
+
+        Args:
+            **values: the new values of the properties (array_like)
+
+        Returns:
+            TrapCatalogue: the new catalogue
+        """
+        properties = {name: getattr(self, name) for name in self.properties}
+        properties.update(values)
+        return TrapCatalogue(self.names, **properties)
+
+    def description(self):
+        description = {"names": self.names}
+        for name in self.properties:
+            description[name] = getattr(self, name).tolist()
+        return description
+
+    def trapping_rate(self, T):
+        T = np.asarray(T, dtype=float)[..., np.newaxis]
+        return self.k_0 * np.exp(-self.E_k / k_B / T)
+
+    def detrapping_rate(self, T):
+        T = np.asarray(T, dtype=float)[..., np.newaxis]
+        return self.p_0 * np.exp(-self.E_p / k_B / T)
+
+    def annealing_rate(self, T):
+        T = np.asarray(T, dtype=float)[..., np.newaxis]
+        return annealing_rate(T, self.A_0, self.E_A, k_B=k_B)
+
+    def densities(self, t, damage_rate, T, n_0=None):
+        """Computes the trap densities with the analytical solution of the
+        trap creation model (constant damage rate and temperature)
+
+        Args:
+            t (float or array_like): the time (s)
+            damage_rate (float or array_like): the damage rate (dpa s-1)
+            T (float or array_like): the temperature (K)
+            n_0 (array_like, optional): the initial densities of the traps
+                created by damage (m-3). Defaults to 0.
+
+        Returns:
+            numpy.array: the densities (m-3), intrinsic densities included,
+                with a trailing trap axis
+        """
+        if n_0 is None:
+            n_0 = 0
+        t = np.asarray(t, dtype=float)[..., np.newaxis]
+        damage_rate = np.asarray(damage_rate, dtype=float)[..., np.newaxis]
+        created = trap_density(
+            t, damage_rate, self.K, self.n_max, self.annealing_rate(T), n_0=n_0
+        )
+        return self.density + created
+
+    def occupancy(self, c, T):
+        """Computes the equilibrium filling ratio of the traps
+
+        Args:
+            c (float or array_like): the mobile concentration (m-3)
+            T (float or array_like): the temperature (K)
+
+        Returns:
+            numpy.array: the filling ratios, with a trailing trap axis
+        """
+        c = np.asarray(c, dtype=float)[..., np.newaxis]
+        return r_trap(c, self.trapping_rate(T), self.detrapping_rate(T))
+
+    def penetration_depth(self, c_max, t, D, T, n=None):
+        """Computes the penetration depth of the mobile particles (see r_d)
+
+        Args:
+            c_max (float or array_like): the surface concentration (m-3)
+            t (float or array_like): the time (s)
+            D (float or array_like): the diffusion coefficient (m2 s-1)
+            T (float or array_like): the temperature (K)
+            n (array_like, optional): the trap densities, with a trailing trap
+                axis. Defaults to the intrinsic densities.
+
+        Returns:
+            numpy.array: the penetration depth (m)
+        """
+        if n is None:
+            n = self.density
+        c_max, t, D = (
+            np.asarray(value, dtype=float)[..., np.newaxis] for value in (c_max, t, D)
+        )
+        return r_d(
+            c_max, t, D, n, self.trapping_rate(T), self.detrapping_rate(T)
+        )[..., 0]
+
+    def density_map(self, filename, T, damage_rate, t, **kwargs):
+        """Writes the densities of the traps created by damage over a
+        (T, damage rate, time) grid (see trap_density_map)
+
+        Args:
+            filename (str): the .npy file
+            T (array_like): the temperatures of the grid (K)
+            damage_rate (array_like): the damage rates of the grid (dpa s-1)
+            t (array_like): the times of the grid (s)
+            **kwargs: the other arguments of trap_density_map
+
+        Returns:
+            numpy.memmap: the densities (m-3)
+        """
+        return trap_density_map(
+            filename,
+            T,
+            damage_rate,
+            t,
+            self.A_0,
+            self.E_A,
+            self.K,
+            self.n_max,
+            k_B=k_B,
+            **kwargs
+        )
+
+
+# traps of the section 4 model: intrinsic trap followed by the damage-induced
+# traps D1 to D5 (defect type I: D1, D2, type II: D3, D4, type III: D5) with
+# the trap creation parameters fitted in section 3 (figure 5)
+tungsten_traps = TrapCatalogue(
+    names=["intrinsic", "D1", "D2", "D3", "D4", "D5"],
+    k_0=5.22e-17,
+    E_k=0.28,
+    p_0=1e13,
+    E_p=[1.0, 1.15, 1.35, 1.65, 1.85, 2.05],
+    density=[2e22, 0, 0, 0, 0, 0],
+    A_0=[0, 6.1838e-03, 6.1838e-03, 6.1838e-03, 6.1838e-03, 0],
+    E_A=[1, 0.24, 0.24, 0.30, 0.30, 1],
+    K=[0, 9.0e26, 4.2e26, 2.5e26, 5.0e26, 1.0e26],
+    n_max=[1, 6.9e25, 7.0e25, 6.0e25, 4.7e25, 2.0e25],
+)
+
+# traps of the section 3 TDS simulations (trapping rates with the lattice
+# parameter and atom density of tungsten), the damaged densities being fitted
+# per sample
+tds_atom_density_W = 6.3222e28
+tds_traps = tungsten_traps.replace(
+    k_0=np.array([4.1e-7, 4.1e-7, 4.1e-7, 4.1e-7, 2.4e-7, 2.4e-7])
+    / (1.1e-10**2 * 6 * tds_atom_density_W),
+    E_k=0.39,
+)
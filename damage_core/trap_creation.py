@@ -0,0 +1,42 @@
+import numpy as np
+
+
+def annealing_rate(T, A_0, E_A, k_B=8.617333e-05):
+    """Computes the trap annealing rate
+
+    Args:
+        T (float or array_like): the temperature (K)
+        A_0 (float or array_like): the trap annealing factor (s-1)
+        E_A (float or array_like): the annealing activation energy (eV)
+        k_B (float, optional): the Boltzmann constant (eV K-1). Defaults to
+            8.617333e-05.
+
+    Returns:
+        float or numpy.array: the annealing rate (s-1)
+    """
+    return A_0 * np.exp(-E_A / k_B / T)
+
+
+def trap_density(t, damage_rate, K, n_max, A, n_0=0):
+    """Analytical solution of the trap creation model
+    dn/dt = phi K (1 - n/n_max) - A n with constant damage rate and
+    temperature. All the arguments are broadcast together.
+
+    Args:
+        t (float or array_like): the time (s)
+        damage_rate (float or array_like): the damage rate phi (dpa s-1)
+        K (float or array_like): the trap creation factor (traps dpa-1)
+        n_max (float or array_like): the maximum trap density (m-3)
+        A (float or array_like): the annealing rate (s-1)
+        n_0 (float or array_like, optional): the initial trap density (m-3).
+            Defaults to 0.
+
+    Returns:
+        float or numpy.array: the trap density (m-3)
+    """
+    creation = damage_rate * K
+    # inverse of the characteristic time for trap creation/annealing
+    rate = creation / n_max + A
+    with np.errstate(divide="ignore", invalid="ignore"):
+        n_infinity = np.where(rate > 0, creation / rate, n_0)
+    return n_infinity + (n_0 - n_infinity) * np.exp(-rate * t)
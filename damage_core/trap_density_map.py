@@ -0,0 +1,86 @@
+import numpy as np
+
+from damage_core.trap_creation import annealing_rate, trap_density
+
+
+def trap_density_map(
+    filename,
+    T,
+    damage_rate,
+    t,
+    A_0,
+    E_A,
+    K,
+    n_max,
+    per_defect=False,
+    max_chunk_size=2**24,
+    k_B=8.617333e-05,
+):
+    """Computes the trap densities over a (T, damage rate, time) grid and
+    writes them to a .npy file, chunk by chunk along the temperature, damage
+    rate and time axes so that the memory used does not depend on the grid
+    size.
+
+    Args:
+        filename (str): the .npy file
+        T (array_like): the temperatures of the grid (K)
+        damage_rate (array_like): the damage rates of the grid (dpa s-1)
+        t (array_like): the times of the grid (s)
+        A_0 (array_like): the annealing factor of each defect (s-1)
+        E_A (array_like): the annealing activation energy of each defect (eV)
+        K (array_like): the trap creation factor of each defect (traps dpa-1)
+        n_max (array_like): the maximum density of each defect (m-3)
+        per_defect (bool, optional): if True, the density of each defect is
+            written instead of the total density. Defaults to False.
+        max_chunk_size (int, optional): the maximum number of densities
+            computed at once, all the defects included. A chunk has at least
+            one time, ie. len(K) densities. Defaults to 2**24.
+        k_B (float, optional): the Boltzmann constant (eV K-1). Defaults to
+            8.617333e-05.
+
+    Returns:
+        numpy.memmap: the densities (m-3), of shape (len(T), len(damage_rate),
+            len(t)), or (len(T), len(damage_rate), len(t), nb_defects) if
+            per_defect is True
+    """
+    T = np.asarray(T, dtype=float)
+    damage_rate = np.asarray(damage_rate, dtype=float)
+    t = np.asarray(t, dtype=float)
+    A_0, E_A, K, n_max = np.broadcast_arrays(
+        *(
+            np.atleast_1d(np.asarray(value, dtype=float))
+            for value in (A_0, E_A, K, n_max)
+        )
+    )
+    shape = (len(T), len(damage_rate), len(t))
+    if per_defect:
+        shape += (len(K),)
+    densities = np.lib.format.open_memmap(
+        filename, mode="w+", dtype=np.float64, shape=shape
+    )
+
+    # chunks made of whole (damage rate, time) planes when they fit, of lines
+    # of times otherwise, and of parts of a line of times if a line does not
+    # fit
+    times_per_chunk = min(len(t), max(1, max_chunk_size // len(K)))
+    rows_per_chunk = max(1, max_chunk_size // (times_per_chunk * len(K)))
+    nb_rows = len(T) * len(damage_rate)
+    for start in range(0, nb_rows, rows_per_chunk):
+        stop = min(start + rows_per_chunk, nb_rows)
+        i, j = np.unravel_index(np.arange(start, stop), shape[:2])
+        # axes: (grid point, time, defect)
+        A = annealing_rate(T[i, np.newaxis, np.newaxis], A_0, E_A, k_B=k_B)
+        for time_start in range(0, len(t), times_per_chunk):
+            times = slice(time_start, time_start + times_per_chunk)
+            n = trap_density(
+                t[np.newaxis, times, np.newaxis],
+                damage_rate[j, np.newaxis, np.newaxis],
+                K,
+                n_max,
+                A,
+            )
+            if not per_defect:
+                n = n.sum(axis=-1)
+            densities[i, j, times] = n
+    densities.flush()
+    return densities
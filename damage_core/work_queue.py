@@ -0,0 +1,437 @@
+import fcntl
+import importlib
+import inspect
+import os
+import pickle
+import socket
+import sqlite3
+import sys
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+
+schema = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    key TEXT UNIQUE,
+    name TEXT,
+    folder TEXT,
+    path TEXT,
+    module TEXT,
+    function TEXT,
+    kwargs BLOB,
+    status TEXT,
+    worker TEXT,
+    heartbeat REAL,
+    attempts INTEGER,
+    result BLOB,
+    error TEXT
+)
+"""
+
+
+def function_reference(function):
+    """Finds how a worker process can import a function
+
+    Args:
+        function (callable): a module level function
+
+    Returns:
+        str, str, str: the folder of its module, the module name and the
+            function name
+    """
+    filename = os.path.abspath(inspect.getfile(function))
+    module = function.__module__
+    if module == "__main__":
+        # the script run by the submitting process is imported by its name
+        module = os.path.splitext(os.path.basename(filename))[0]
+    # the folder added to sys.path, eg. the repository root for damage_core
+    path = os.path.dirname(filename)
+    for _ in range(module.count(".")):
+        path = os.path.dirname(path)
+    return path, module, function.__qualname__
+
+
+class WorkQueue:
+    """Queue of jobs in a SQLite file, so that worker processes on one or
+    several hosts sharing a filesystem can drain the same sweep without any
+    network service.
+
+    Every transaction holds an exclusive lock on a lock file next to the
+    database (as ResultsStore), so claims are atomic even where the SQLite
+    locks are unreliable (eg. NFS). A claimed job is "running" until its
+    worker completes it; the worker writes a heartbeat meanwhile and the
+    claims whose heartbeat is older than timeout (crashed or killed workers)
+    are released for another worker. A job is retried up to max_attempts
+    times after raising an exception.
+
+    Jobs are run with the working directory of the process which submitted
+    them, so the relative paths of their arguments are unchanged.
+
+    Args:
+        filename (str): the SQLite file
+        timeout (float, optional): the age of the heartbeat after which a
+            claim is stale (s). Defaults to 600.
+        max_attempts (int, optional): the number of runs of a failing job.
+            Defaults to 3.
+    """
+
+    def __init__(self, filename, timeout=600, max_attempts=3):
+        # the workers change directory to run the jobs
+        self.filename = os.path.abspath(filename)
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+
+    @contextmanager
+    def transaction(self):
+        """Opens a connection to the database and starts a transaction while
+        holding the queue lock. The transaction is committed on exit, or
+        rolled back if an exception is raised.
+
+        Yields:
+            sqlite3.Connection: the connection
+        """
+        folder = os.path.dirname(os.path.abspath(self.filename))
+        os.makedirs(folder, exist_ok=True)
+        with open(self.filename + ".lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            connection = sqlite3.connect(
+                self.filename, timeout=60, isolation_level=None
+            )
+            try:
+                connection.execute("BEGIN IMMEDIATE")
+                connection.execute(schema)
+                yield connection
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            finally:
+                connection.close()
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def submit(self, function, jobs, keys=None, names=None, reset_done=False):
+        """Adds jobs to the queue. A job whose key is already in the queue is
+        not added again, unless it has failed in which case it is reset.
+
+        Args:
+            function (callable): the module level function called as
+                function(**job)
+            jobs (list of dict): the arguments of the jobs (picklable)
+            keys (list of str, optional): the unique keys of the jobs (eg.
+                pipeline hashes). Defaults to the pickled arguments.
+            names (list of str, optional): the names of the jobs in the logs.
+                Defaults to the function name.
+            reset_done (bool, optional): if True, the jobs already done are
+                reset too (eg. their outputs have been deleted). Defaults to
+                False.
+
+        Returns:
+            int: the number of jobs added or reset
+        """
+        path, module, function_name = function_reference(function)
+        folder = os.getcwd()
+        rows = []
+        for i, job in enumerate(jobs):
+            kwargs = pickle.dumps(job)
+            key = keys[i] if keys is not None else kwargs.hex()
+            name = names[i] if names is not None else function_name
+            rows.append((key, name, folder, path, module, function_name, kwargs))
+        reset = "('failed', 'done')" if reset_done else "('failed')"
+        with self.transaction() as connection:
+            before = connection.total_changes
+            connection.executemany(
+                "INSERT INTO jobs (key, name, folder, path, module, function, "
+                "kwargs, status, attempts) VALUES (?, ?, ?, ?, ?, ?, ?, "
+                "'pending', 0) ON CONFLICT(key) DO UPDATE SET status = 'pending', "
+                "kwargs = excluded.kwargs, attempts = 0, error = NULL "
+                "WHERE status IN " + reset,
+                rows,
+            )
+            return connection.total_changes - before
+
+    def release_stale(self, connection=None):
+        """Puts back the running jobs whose heartbeat is older than timeout,
+        or marks them as failed after max_attempts runs (eg. a job killing
+        its worker every time)
+
+        Returns:
+            int: the number of released jobs
+        """
+        if connection is None:
+            with self.transaction() as connection:
+                return self.release_stale(connection)
+        cursor = connection.execute(
+            "UPDATE jobs SET status = CASE WHEN attempts >= ? THEN 'failed' "
+            "ELSE 'pending' END, worker = NULL, error = 'worker lost' "
+            "WHERE status = 'running' AND heartbeat < ?",
+            (self.max_attempts, time.time() - self.timeout),
+        )
+        return cursor.rowcount
+
+    def claim(self, worker):
+        """Claims the oldest pending job, after releasing the stale claims
+
+        Args:
+            worker (str): the identifier of the worker
+
+        Returns:
+            dict: the job ("id", "key", "name", "folder", "path", "module",
+                "function", "kwargs" (pickled, see run_job) and "attempts"),
+                None if no job is pending
+        """
+        with self.transaction() as connection:
+            released = self.release_stale(connection)
+            if released > 0:
+                print("work queue: released {} stale claims".format(released))
+            row = connection.execute(
+                "SELECT id, key, name, folder, path, module, function, kwargs, "
+                "attempts FROM jobs WHERE status = 'pending' ORDER BY id LIMIT 1"
+            ).fetchone()
+            if row is None:
+                return None
+            connection.execute(
+                "UPDATE jobs SET status = 'running', worker = ?, heartbeat = ?, "
+                "attempts = attempts + 1 WHERE id = ?",
+                (worker, time.time(), row[0]),
+            )
+        names = ["id", "key", "name", "folder", "path", "module", "function", "kwargs"]
+        job = dict(zip(names, row[:8]))
+        job["attempts"] = row[8] + 1
+        return job
+
+    def heartbeat(self, job_id, worker):
+        """Records that a worker is still running a job
+
+        Returns:
+            bool: False if the claim has been released in the meantime
+        """
+        with self.transaction() as connection:
+            cursor = connection.execute(
+                "UPDATE jobs SET heartbeat = ? WHERE id = ? AND worker = ? "
+                "AND status = 'running'",
+                (time.time(), job_id, worker),
+            )
+            return cursor.rowcount == 1
+
+    def complete(self, job_id, worker, result=None):
+        """Marks a job as done and stores its (picklable) result
+
+        Returns:
+            bool: False if the claim has been released in the meantime (the
+                job being run by another worker)
+        """
+        with self.transaction() as connection:
+            cursor = connection.execute(
+                "UPDATE jobs SET status = 'done', result = ?, error = NULL "
+                "WHERE id = ? AND worker = ? AND status = 'running'",
+                (pickle.dumps(result), job_id, worker),
+            )
+            return cursor.rowcount == 1
+
+    def fail(self, job_id, worker, error):
+        """Puts a job back in the queue after an exception, or marks it as
+        failed after max_attempts runs
+
+        Returns:
+            bool: False if the claim has been released in the meantime
+        """
+        with self.transaction() as connection:
+            cursor = connection.execute(
+                "UPDATE jobs SET status = CASE WHEN attempts >= ? THEN 'failed' "
+                "ELSE 'pending' END, worker = NULL, error = ? "
+                "WHERE id = ? AND worker = ? AND status = 'running'",
+                (self.max_attempts, error, job_id, worker),
+            )
+            return cursor.rowcount == 1
+
+    def status(self):
+        """Counts the jobs per status
+
+        Returns:
+            dict: maps the statuses ("pending", "running", "done", "failed")
+                to the number of jobs
+        """
+        with self.transaction() as connection:
+            rows = connection.execute(
+                "SELECT status, COUNT(*) FROM jobs GROUP BY status"
+            ).fetchall()
+        counts = {"pending": 0, "running": 0, "done": 0, "failed": 0}
+        counts.update(dict(rows))
+        return counts
+
+    def jobs(self, status=None):
+        """Lists the jobs
+
+        Args:
+            status (str, optional): if given, only the jobs with this status
+                are listed. Defaults to None.
+
+        Returns:
+            list of dict: the "key", "name", "status", "worker", "attempts",
+                "result" and "error" of the jobs
+        """
+        query = "SELECT key, name, status, worker, attempts, result, error FROM jobs"
+        parameters = ()
+        if status is not None:
+            query += " WHERE status = ?"
+            parameters = (status,)
+        with self.transaction() as connection:
+            rows = connection.execute(query + " ORDER BY id", parameters).fetchall()
+        names = ["key", "name", "status", "worker", "attempts", "result", "error"]
+        jobs = []
+        for row in rows:
+            job = dict(zip(names, row))
+            if job["result"] is not None:
+                job["result"] = pickle.loads(job["result"])
+            jobs.append(job)
+        return jobs
+
+
+def run_job(job):
+    """Imports the function of a job and runs it in the folder of the
+    submitting process
+
+    Args:
+        job (dict): the job returned by WorkQueue.claim
+
+    Returns:
+        the result of the function
+    """
+    # the folder of the job first, the scripts of both sections having the
+    # same names (eg. generate_data)
+    if job["path"] in sys.path:
+        sys.path.remove(job["path"])
+    sys.path.insert(0, job["path"])
+    loaded = sys.modules.get(job["module"])
+    if loaded is not None and not os.path.abspath(loaded.__file__).startswith(
+        job["path"]
+    ):
+        del sys.modules[job["module"]]
+    os.chdir(job["folder"])
+    function = importlib.import_module(job["module"])
+    for name in job["function"].split("."):
+        function = getattr(function, name)
+    # the arguments are unpickled once the module (and its imports) is loaded
+    return function(**pickle.loads(job["kwargs"]))
+
+
+def work(queue, worker=None, wait=False, poll_interval=30, heartbeat_interval=None):
+    """Claims and runs jobs until the queue is drained. A thread writes the
+    heartbeat of the running job.
+
+    Args:
+        queue (WorkQueue): the queue
+        worker (str, optional): the identifier of the worker. Defaults to
+            <host>:<pid>.
+        wait (bool, optional): if True, the worker keeps polling the queue
+            while jobs are running elsewhere (they may be released). Defaults
+            to False.
+        poll_interval (float, optional): the time between polls (s). Defaults
+            to 30.
+        heartbeat_interval (float, optional): the time between heartbeats
+            (s). Defaults to a tenth of the queue timeout.
+
+    Returns:
+        int: the number of jobs completed by the worker
+    """
+    if worker is None:
+        worker = "{}:{}".format(socket.gethostname(), os.getpid())
+    if heartbeat_interval is None:
+        heartbeat_interval = queue.timeout / 10
+    nb_completed = 0
+    while True:
+        job = queue.claim(worker)
+        if job is None:
+            if wait and queue.status()["running"] > 0:
+                time.sleep(poll_interval)
+                continue
+            return nb_completed
+
+        print("work queue: {} running {}".format(worker, job["name"]))
+        stop = threading.Event()
+
+        def beat():
+            while not stop.wait(heartbeat_interval):
+                if not queue.heartbeat(job["id"], worker):
+                    print("work queue: {} lost {}".format(worker, job["name"]))
+                    return
+
+        heartbeat_thread = threading.Thread(target=beat, daemon=True)
+        heartbeat_thread.start()
+        try:
+            result = run_job(job)
+        except Exception:
+            stop.set()
+            heartbeat_thread.join()
+            print(
+                "work queue: {} failed\n{}".format(job["name"], traceback.format_exc())
+            )
+            queue.fail(job["id"], worker, traceback.format_exc())
+            continue
+        stop.set()
+        heartbeat_thread.join()
+        if queue.complete(job["id"], worker, result):
+            nb_completed += 1
+        else:
+            print(
+                "work queue: {} completed {} after losing it".format(
+                    worker, job["name"]
+                )
+            )
+
+
+def _work(filename, timeout, max_attempts, kwargs):
+    work(WorkQueue(filename, timeout, max_attempts), **kwargs)
+
+
+def run_workers(filename, nb_workers=None, timeout=600, max_attempts=3, **kwargs):
+    """Runs worker processes on this host until the queue is drained. The
+    workers are independent processes, a worker killed (eg. out of memory)
+    leaving its claim to be released by the others.
+
+    Args:
+        filename (str): the SQLite file of the queue
+        nb_workers (int, optional): the number of processes. Defaults to the
+            number of CPUs.
+        timeout (float, optional): see WorkQueue. Defaults to 600.
+        max_attempts (int, optional): see WorkQueue. Defaults to 3.
+        **kwargs: other arguments of work
+
+    Returns:
+        dict: the number of jobs per status once the workers have stopped
+    """
+    import multiprocessing
+
+    if nb_workers is None:
+        nb_workers = os.cpu_count()
+    workers = [
+        multiprocessing.Process(
+            target=_work, args=(filename, timeout, max_attempts, kwargs)
+        )
+        for _ in range(nb_workers)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return WorkQueue(filename, timeout, max_attempts).status()
+
+
+if __name__ == "__main__":
+    # usage: python -m damage_core.work_queue work queue.sqlite [nb_workers]
+    #        python -m damage_core.work_queue status queue.sqlite
+    #        python -m damage_core.work_queue release queue.sqlite
+    command, filename = sys.argv[1:3]
+    if command == "work":
+        nb_workers = int(sys.argv[3]) if len(sys.argv) > 3 else None
+        print(run_workers(filename, nb_workers))
+    elif command == "status":
+        print(WorkQueue(filename).status())
+        for job in WorkQueue(filename).jobs("failed"):
+            print("failed: {}: {}".format(job["name"], job["error"].splitlines()[-1]))
+    elif command == "release":
+        print("{} claims released".format(WorkQueue(filename).release_stale()))
+    else:
+        raise ValueError("Unknown command {}".format(command))
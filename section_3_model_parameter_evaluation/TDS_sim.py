@@ -1,7 +1,15 @@
 import sympy as sp
 from compute_profile_depth import automatic_vertices
 import festim as F
+import fenics as f
 import numpy as np
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from damage_core.damage_profile import DamageProfile
+from damage_core.run_manifest import RunManifest
+from damage_core.trap_catalogue import tds_atom_density_W, tds_traps
 
 fluence = 1.5e25
 implantation_time = 72 * 3600
@@ -12,12 +20,33 @@ resting_temp = 295
 ramp = 3 / 60
 tds_time = (1000 - 300) / ramp
 size = 8e-04
-atom_density_W = 6.3222e28
+atom_density_W = tds_atom_density_W
+
+# damage distribution of the samples
+default_damage_profile = DamageProfile.sigmoid(depth=2.3e-06, width=1e-07)
 
 # diffusion properties holtzner D
 D_0 = 1.6e-07
 E_D = 0.28
 
+
+def profile_function(damage_profile, mesh):
+    """Interpolates a damage profile on the P1 space of a mesh, the table
+    being evaluated once at all the DOFs
+
+    Args:
+        damage_profile (DamageProfile): the damage profile
+        mesh (F.Mesh): the mesh of the simulation
+
+    Returns:
+        fenics.Function: the normalised damage
+    """
+    V = f.FunctionSpace(mesh.mesh, "CG", 1)
+    profile = f.Function(V)
+    profile.vector()[:] = damage_profile(V.tabulate_dof_coordinates()[:, 0])
+    return profile
+
+
 def festim_sim(
     n1=1,
     n2=1,
@@ -26,6 +55,10 @@ def festim_sim(
     n5=1,
     initial_number_cells=100,
     results_foldername="Results/",
+    stepsize_change_ratio=1.1,
+    export_retention=True,
+    traps=None,
+    damage_profile=None,
 ):
     """Runs a FESTIM simulation with a custom mesh generator created with the 
     automatic vertices function.
@@ -38,7 +71,20 @@ def festim_sim(
         n4 (float): trap_density in m-3
         initial_number_of_cells (float): initial number of cells in the mesh
         results_foldername (str) results folder location
+        stepsize_change_ratio (float, optional): the growth factor of the
+            stepsize. Defaults to 1.1.
+        export_retention (bool, optional): if True, the retention field is
+            exported to XDMF. Defaults to True.
+        traps (TrapCatalogue, optional): the trap properties (eg. with
+            modified detrapping energies). Defaults to tds_traps.
+        damage_profile (DamageProfile, optional): the depth profile of the
+            damaged trap densities (eg. a SRIM profile). The mesh is refined
+            where it varies. Defaults to default_damage_profile.
     """
+    if traps is None:
+        traps = tds_traps
+    if damage_profile is None:
+        damage_profile = default_damage_profile
     r = 0
     center = 0.7e-9
     width = 0.5e-9
@@ -57,74 +103,56 @@ def festim_sim(
     )
     my_model.materials = F.Materials([tungsten])
 
-    # define traps
-    damage_dist = 1 / (1 + sp.exp((F.x - 2.3e-06) / 1e-07))
-    my_model.traps = F.Traps(
-        [
-            F.Trap(
-                k_0=4.1e-7 / (1.1e-10**2 * 6 * atom_density_W),
-                E_k=0.39,
-                p_0=1e13,
-                E_p=1.0,
-                density=2e22,
-                materials=tungsten,
-            ),
-            F.Trap(
-                k_0=4.1e-7 / (1.1e-10**2 * 6 * atom_density_W),
-                E_k=0.39,
-                p_0=1e13,
-                E_p=1.15,
-                density=n1 * damage_dist,
-                materials=tungsten,
-            ),
-            F.Trap(
-                k_0=4.1e-7 / (1.1e-10**2 * 6 * atom_density_W),
-                E_k=0.39,
-                p_0=1e13,
-                E_p=1.35,
-                density=n2 * damage_dist,
-                materials=tungsten,
-            ),
-            F.Trap(
-                k_0=4.1e-7 / (1.1e-10**2 * 6 * atom_density_W),
-                E_k=0.39,
-                p_0=1e13,
-                E_p=1.65,
-                density=n3 * damage_dist,
-                materials=tungsten,
-            ),
-            F.Trap(
-                k_0=2.4e-7 / (1.1e-10**2 * 6 * atom_density_W),
-                E_k=0.39,
-                p_0=1e13,
-                E_p=1.85,
-                density=n4 * damage_dist,
-                materials=tungsten,
-            ),
-            F.Trap(
-                k_0=2.4e-7 / (1.1e-10**2 * 6 * atom_density_W),
-                E_k=0.39,
-                p_0=1e13,
-                E_p=2.05,
-                density=n5 * damage_dist,
-                materials=tungsten,
-            ),
-        ]
-    )
-
     # define mesh
+    damaged_densities = np.array([0, n1, n2, n3, n4, n5])
     vertices = automatic_vertices(
         r_p=center,
         size=size,
         mat=tungsten,
-        traps=my_model.traps.traps,
+        traps=traps.replace(
+            density=traps.density + damaged_densities * damage_profile(center)
+        ),
         nb_cells=initial_number_cells,
         T=exposure_temp,
         implantation_time=implantation_time,
         flux=flux,
+        damage_profile=damage_profile,
     )
     my_model.mesh = F.MeshFromVertices(vertices)
 
+    # define traps
+    # the damaged densities are compiled expressions of the profile
+    # interpolated on the mesh, not evaluated in python at each point
+    profile = profile_function(damage_profile, my_model.mesh)
+    densities = []
+    for i in range(len(traps)):
+        if damaged_densities[i] == 0:
+            densities.append(traps.density[i])
+        else:
+            densities.append(
+                f.Expression(
+                    "n_0 + n * profile",
+                    profile=profile,
+                    n_0=traps.density[i],
+                    n=damaged_densities[i],
+                    t=0,
+                    degree=1,
+                )
+            )
+    my_model.traps = F.Traps(
+        [
+            F.Trap(
+                k_0=traps.k_0[i],
+                E_k=traps.E_k[i],
+                p_0=traps.p_0[i],
+                E_p=traps.E_p[i],
+                density=densities[i],
+                materials=tungsten,
+            )
+            for i in range(len(traps))
+        ]
+    )
+
     # define temperature
     my_model.T = F.Temperature(
         value=exposure_temp * (F.t < implantation_time)
@@ -181,21 +209,23 @@ def festim_sim(
         trap_6,
     ]
     
-    my_model.exports = F.Exports([
-        my_derived_quantities, 
-        F.XDMFExport(
-            "retention",
-            label="retention",
-            folder=folder_results,
-            checkpoint=False,
-            mode=1,
-        ),
-        ])
+    exports = [my_derived_quantities]
+    if export_retention:
+        exports.append(
+            F.XDMFExport(
+                "retention",
+                label="retention",
+                folder=folder_results,
+                checkpoint=False,
+                mode=1,
+            )
+        )
+    my_model.exports = F.Exports(exports)
 
     # define settings
     my_model.dt = F.Stepsize(
         1,
-        stepsize_change_ratio=1.1,
+        stepsize_change_ratio=stepsize_change_ratio,
         t_stop=implantation_time + resting_time * 0.5,
         dt_min=1e-1,
         stepsize_stop_max=50,
@@ -210,8 +240,23 @@ def festim_sim(
         # linear_solver="mumps",
     )
 
-    my_model.initialise()
-    my_model.run()
+    # run simulation, described in manifest.json
+    inputs = dict(
+        n1=n1,
+        n2=n2,
+        n3=n3,
+        n4=n4,
+        n5=n5,
+        initial_number_cells=initial_number_cells,
+        stepsize_change_ratio=stepsize_change_ratio,
+        E_p=traps.E_p.tolist(),
+        damage_profile=damage_profile.description(),
+    )
+    with RunManifest(folder_results + "manifest.json", inputs) as manifest:
+        manifest.data["cells"] = len(vertices) - 1
+        my_model.initialise()
+        manifest.watch_simulation(my_model)
+        my_model.run()
     return my_derived_quantities.data
 
 
@@ -0,0 +1,477 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import hashlib
+import inspect
+import json
+import numpy as np
+import os
+import sys
+import time
+from scipy.interpolate import RBFInterpolator
+from scipy.stats import qmc
+
+from tds_basis import basis_code_files
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from damage_core.cached_loading import file_signature
+from damage_core.trap_catalogue import tds_traps
+
+# calibrated parameters: log10 of the damaged trap densities (m-3) and
+# detrapping energies (eV) of D1 to D5, with uniform priors around the
+# Nelder-Mead fits of optimisation_TDS
+parameter_names = ["log10_n{}".format(i) for i in range(1, 6)] + [
+    "E_p{}".format(i) for i in range(1, 6)
+]
+lower_bounds = np.concatenate([np.full(5, 24.0), tds_traps.E_p[1:] - 0.15])
+upper_bounds = np.concatenate([np.full(5, 26.0), tds_traps.E_p[1:] + 0.15])
+# the forward runs are only reused with the same model
+forward_code_files = basis_code_files + [
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "optimisation_TDS.py")
+]
+
+
+def forward_run(theta, T_ref, results_foldername, level=-1):
+    """Runs the TDS simulation of a point of the parameter space
+
+    Args:
+        theta (numpy.array): the parameters (see parameter_names)
+        T_ref (numpy.array): the temperatures of the reference data (K)
+        results_foldername (str): the results folder
+        level (int, optional): the fidelity level of optimisation_TDS.
+            Defaults to -1 (full fidelity).
+
+    Returns:
+        numpy.array: the desorption flux at T_ref (m-2 s-1)
+    """
+    # FESTIM is only imported by the processes running simulations
+    from optimisation_TDS import fidelity_levels, tds_desorption
+    from TDS_sim import festim_sim
+
+    n = 10 ** np.asarray(theta[:5])
+    traps = tds_traps.replace(E_p=np.concatenate([tds_traps.E_p[:1], theta[5:]]))
+    res = festim_sim(
+        *n,
+        results_foldername=results_foldername,
+        export_retention=False,
+        traps=traps,
+        **fidelity_levels[level]
+    )
+    return tds_desorption(res, T_ref)
+
+
+def forward_key(T_ref, level):
+    description = {
+        "T_ref": hashlib.sha256(
+            np.ascontiguousarray(T_ref, dtype=float).tobytes()
+        ).hexdigest(),
+        "level": level,
+        "parameters": parameter_names,
+        "forward_run": inspect.getsource(forward_run),
+        "code": {
+            os.path.basename(filename): file_signature(filename, "hash")
+            for filename in forward_code_files
+        },
+    }
+    return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+
+class ForwardCache:
+    """Cache of the forward runs (parameters and simulated spectra) in a .npz
+    file, so that the emulator is built from all the previous runs. The runs
+    are dropped if the temperatures, the fidelity level or the model have
+    changed (see forward_key).
+
+    Args:
+        filename (str): the .npz file
+        T_ref (numpy.array): the temperatures of the spectra (K)
+        level (int, optional): the fidelity level of the runs. Defaults to -1.
+    """
+
+    def __init__(self, filename, T_ref, level=-1):
+        self.filename = filename
+        self.T_ref = np.asarray(T_ref, dtype=float)
+        self.key = forward_key(self.T_ref, level)
+        self.thetas = np.empty((0, len(parameter_names)))
+        self.spectra = np.empty((0, len(self.T_ref)))
+        if os.path.exists(filename):
+            with np.load(filename) as data:
+                if "key" in data and str(data["key"]) == self.key:
+                    self.thetas = data["thetas"]
+                    self.spectra = data["spectra"]
+                else:
+                    print("forward runs of {} out of date, dropped".format(filename))
+
+    def __len__(self):
+        return len(self.thetas)
+
+    def contains(self, theta):
+        return np.any(np.all(np.isclose(self.thetas, theta, rtol=0, atol=1e-9), axis=1))
+
+    def add(self, theta, spectrum):
+        self.thetas = np.vstack([self.thetas, theta])
+        self.spectra = np.vstack([self.spectra, spectrum])
+        folder = os.path.dirname(os.path.abspath(self.filename))
+        os.makedirs(folder, exist_ok=True)
+        with open(self.filename + ".tmp", "wb") as f:
+            np.savez(
+                f,
+                key=self.key,
+                T_ref=self.T_ref,
+                thetas=self.thetas,
+                spectra=self.spectra,
+            )
+        os.replace(self.filename + ".tmp", self.filename)
+
+
+def run_forward(thetas, cache, results_folder, level=-1, max_workers=None):
+    """Runs the forward model at the points not in the cache, in parallel,
+    adding the spectra to the cache as the runs finish. Failed runs are
+    skipped.
+
+    Args:
+        thetas (numpy.array): the points, one per row
+        cache (ForwardCache): the cache
+        results_folder (str): the folder of the results folders of the runs
+        level (int, optional): the fidelity level. Defaults to -1.
+        max_workers (int, optional): the number of processes. Defaults to the
+            number of CPUs.
+    """
+    thetas = [theta for theta in thetas if not cache.contains(theta)]
+    if len(thetas) == 0:
+        return
+    print("running {} forward simulations".format(len(thetas)))
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+        for theta in thetas:
+            folder = results_folder + "run_{}/".format(len(cache) + len(futures))
+            future = executor.submit(forward_run, theta, cache.T_ref, folder, level)
+            futures[future] = theta
+        for future in as_completed(futures):
+            try:
+                cache.add(futures[future], future.result())
+            except Exception as e:
+                print("forward run failed: {}".format(e))
+
+
+class SpectrumEmulator:
+    """Radial basis function interpolation of the simulated spectra over the
+    (normalised) parameter space, used in place of the TDS simulation in the
+    likelihood.
+
+    The interpolation error is estimated by fitting the emulator without 10%
+    of the runs and comparing to them.
+
+    Args:
+        thetas (numpy.array): the parameters of the runs, one per row
+        spectra (numpy.array): the spectra of the runs, one per row, divided
+            by the maximum of the reference spectrum
+        seed (int, optional): the seed of the validation split. Defaults to 0.
+    """
+
+    def __init__(self, thetas, spectra, seed=0):
+        self.scale = upper_bounds - lower_bounds
+        points = (thetas - lower_bounds) / self.scale
+        rng = np.random.default_rng(seed)
+        validation = rng.permutation(len(points))[: max(1, len(points) // 10)]
+        training = np.setdiff1d(np.arange(len(points)), validation)
+        partial = RBFInterpolator(
+            points[training], spectra[training], kernel="thin_plate_spline"
+        )
+        self.validation_error = np.abs(
+            partial(points[validation]) - spectra[validation]
+        ).mean()
+        self.interpolator = RBFInterpolator(
+            points, spectra, kernel="thin_plate_spline"
+        )
+
+    def __call__(self, thetas):
+        return self.interpolator((np.atleast_2d(thetas) - lower_bounds) / self.scale)
+
+
+class Posterior:
+    """Log posterior of the parameters given a TDS spectrum, with uniform
+    priors and a Laplace likelihood of the normalised residuals, consistent
+    with the mean absolute error of optimisation_TDS.
+
+    Args:
+        emulator (SpectrumEmulator): the emulator of the normalised spectra
+        reference (numpy.array): the reference spectrum divided by its
+            maximum
+        noise_scale (float): the scale of the Laplace likelihood (in units of
+            the normalised spectrum)
+    """
+
+    def __init__(self, emulator, reference, noise_scale):
+        self.emulator = emulator
+        self.reference = reference
+        self.noise_scale = noise_scale
+
+    def __call__(self, thetas):
+        thetas = np.atleast_2d(thetas)
+        log_probability = np.full(len(thetas), -np.inf)
+        inside = np.all((thetas >= lower_bounds) & (thetas <= upper_bounds), axis=1)
+        if inside.any():
+            residuals = self.emulator(thetas[inside]) - self.reference
+            log_probability[inside] = (
+                -np.abs(residuals).sum(axis=1) / self.noise_scale
+                - len(self.reference) * np.log(2 * self.noise_scale)
+            )
+        return log_probability
+
+
+def ensemble_sampler(log_probability, walkers, nb_steps, a=2.0, seed=None):
+    """Affine invariant ensemble sampler (Goodman and Weare stretch move), the
+    two halves of the ensemble being updated in turn so that the log
+    probabilities of a half are computed in one call
+
+    Args:
+        log_probability (callable): the log probability of an array of points
+        walkers (numpy.array): the initial positions of the walkers, one per
+            row (an even number, at least twice the number of parameters)
+        nb_steps (int): the number of steps
+        a (float, optional): the stretch scale. Defaults to 2.0.
+        seed (int, optional): the random seed. Defaults to None.
+
+    Returns:
+        numpy.array, numpy.array, float: the chain (nb_steps, nb_walkers,
+            nb_parameters), its log probabilities (nb_steps, nb_walkers) and
+            the acceptance fraction
+    """
+    rng = np.random.default_rng(seed)
+    walkers = np.array(walkers, dtype=float)
+    nb_walkers, nb_parameters = walkers.shape
+    log_probs = log_probability(walkers)
+    chain = np.empty((nb_steps, nb_walkers, nb_parameters))
+    chain_log_probs = np.empty((nb_steps, nb_walkers))
+    halves = [np.arange(nb_walkers // 2), np.arange(nb_walkers // 2, nb_walkers)]
+    nb_accepted = 0
+    for step in range(nb_steps):
+        for active, complement in [halves, halves[::-1]]:
+            z = ((a - 1) * rng.random(len(active)) + 1) ** 2 / a
+            partners = walkers[rng.choice(complement, size=len(active))]
+            proposals = partners + z[:, np.newaxis] * (walkers[active] - partners)
+            new_log_probs = log_probability(proposals)
+            with np.errstate(invalid="ignore"):
+                log_acceptance = (
+                    (nb_parameters - 1) * np.log(z)
+                    + new_log_probs
+                    - log_probs[active]
+                )
+            accepted = np.log(rng.random(len(active))) < log_acceptance
+            walkers[active[accepted]] = proposals[accepted]
+            log_probs[active[accepted]] = new_log_probs[accepted]
+            nb_accepted += accepted.sum()
+        chain[step] = walkers
+        chain_log_probs[step] = log_probs
+    return chain, chain_log_probs, nb_accepted / (nb_steps * nb_walkers)
+
+
+def _run_chain(posterior, walkers, nb_steps, seed):
+    return ensemble_sampler(posterior, walkers, nb_steps, seed=seed)
+
+
+def gelman_rubin(chains):
+    """Computes the potential scale reduction factor of each parameter
+
+    Args:
+        chains (numpy.array): the samples of each chain (nb_chains,
+            nb_samples, nb_parameters)
+
+    Returns:
+        numpy.array: R-hat of each parameter
+    """
+    nb_samples = chains.shape[1]
+    within = chains.var(axis=1, ddof=1).mean(axis=0)
+    between = nb_samples * chains.mean(axis=1).var(axis=0, ddof=1)
+    variance = (nb_samples - 1) / nb_samples * within + between / nb_samples
+    return np.sqrt(variance / within)
+
+
+def calibrate(
+    reference_data,
+    cache_file="data/bayesian_calibration/forward_runs.npz",
+    results_folder="data/bayesian_calibration/",
+    nb_design_runs=100,
+    nb_chains=4,
+    nb_walkers=32,
+    nb_steps=2000,
+    nb_refinements=1,
+    nb_refinement_runs=20,
+    noise_scale=None,
+    level=-1,
+    max_workers=None,
+    seed=0,
+):
+    """Samples the posterior of the trap densities and detrapping energies
+    given a TDS spectrum.
+
+    The TDS simulation is run on a Latin hypercube design of the prior box
+    (and the runs of previous calibrations found in the cache) and replaced
+    by a SpectrumEmulator in the likelihood. Independent ensembles of walkers
+    are run in parallel processes, each from its own Latin hypercube over the
+    prior box, so that the R-hat of the ensembles can detect chains stuck in
+    different modes. Each refinement runs the TDS simulation at posterior
+    samples, adds them to the emulator and samples again.
+
+    Args:
+        reference_data (numpy.array): the reference TDS, temperatures (K) in
+            the first column and desorption (D s-1) in the second
+        cache_file (str, optional): the .npz cache of the forward runs.
+            Defaults to "data/bayesian_calibration/forward_runs.npz".
+        results_folder (str, optional): the folder of the forward runs.
+            Defaults to "data/bayesian_calibration/".
+        nb_design_runs (int, optional): the size of the initial design.
+            Defaults to 100.
+        nb_chains (int, optional): the number of ensembles (and processes).
+            Defaults to 4.
+        nb_walkers (int, optional): the number of walkers per ensemble.
+            Defaults to 32.
+        nb_steps (int, optional): the number of steps per ensemble, the first
+            half being discarded as burn-in. Defaults to 2000.
+        nb_refinements (int, optional): the number of refinements of the
+            emulator. Defaults to 1.
+        nb_refinement_runs (int, optional): the number of forward runs per
+            refinement. Defaults to 20.
+        noise_scale (float, optional): the scale of the Laplace likelihood.
+            Defaults to the smallest mean absolute error of the forward runs
+            (the maximum likelihood estimate near the best fit). The
+            validation error of the emulator is added to it.
+        level (int, optional): the fidelity level of the forward runs.
+            Defaults to -1.
+        max_workers (int, optional): the number of processes of the forward
+            runs. Defaults to the number of CPUs.
+        seed (int, optional): the random seed. Defaults to 0.
+
+    Returns:
+        dict: the posterior summary, with the samples under "samples"
+    """
+    T_ref = reference_data[:, 0]
+    # data in D/s, needs to convert to D/(m2 s)
+    desorption_ref = reference_data[:, 1] / (12e-03 * 15e-03)
+    reference = desorption_ref / desorption_ref.max()
+    rng = np.random.default_rng(seed)
+
+    cache = ForwardCache(cache_file, T_ref, level)
+    design = qmc.LatinHypercube(d=len(parameter_names), seed=seed).random(
+        nb_design_runs
+    )
+    design = qmc.scale(design, lower_bounds, upper_bounds)
+    run_forward(design, cache, results_folder, level, max_workers)
+
+    for refinement in range(nb_refinements + 1):
+        spectra = cache.spectra / desorption_ref.max()
+        errors = np.abs(spectra - reference).mean(axis=1)
+        scale = noise_scale if noise_scale is not None else errors.min()
+        emulator = SpectrumEmulator(cache.thetas, spectra)
+        # the emulator error widens the likelihood so that the posterior is not
+        # narrower than what the emulator can resolve
+        posterior = Posterior(emulator, reference, scale + emulator.validation_error)
+        print(
+            "{} forward runs, emulator error {:.2e}, noise scale {:.2e}".format(
+                len(cache), emulator.validation_error, scale
+            )
+        )
+
+        # the ensembles start overdispersed, from different points spread
+        # over the prior box
+        start = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=nb_chains) as executor:
+            futures = []
+            for chain in range(nb_chains):
+                walkers = qmc.LatinHypercube(
+                    d=len(parameter_names), seed=seed + 1000 * refinement + chain + 1
+                ).random(nb_walkers)
+                walkers = qmc.scale(walkers, lower_bounds, upper_bounds)
+                futures.append(
+                    executor.submit(
+                        _run_chain,
+                        posterior,
+                        walkers,
+                        nb_steps,
+                        seed + 1000 * refinement + chain,
+                    )
+                )
+            results = [future.result() for future in futures]
+        wall_time = time.perf_counter() - start
+        nb_evaluations = nb_chains * nb_walkers * (nb_steps + 1)
+        print(
+            "{} likelihood evaluations in {:.1f} s".format(nb_evaluations, wall_time)
+        )
+
+        # burn-in
+        chains = np.array([chain[nb_steps // 2 :] for chain, _, _ in results])
+        samples = chains.reshape(-1, len(parameter_names))
+        if refinement < nb_refinements:
+            new_thetas = samples[rng.choice(len(samples), nb_refinement_runs)]
+            run_forward(new_thetas, cache, results_folder, level, max_workers)
+
+    summary = {
+        "parameters": parameter_names,
+        "mean": samples.mean(axis=0).tolist(),
+        "std": samples.std(axis=0).tolist(),
+        "quantiles": {
+            str(q): np.quantile(samples, q, axis=0).tolist()
+            for q in [0.05, 0.5, 0.95]
+        },
+        # each ensemble as a chain, its walkers pooled
+        "r_hat": gelman_rubin(
+            chains.reshape(nb_chains, -1, len(parameter_names))
+        ).tolist(),
+        "acceptance_fraction": [float(acceptance) for _, _, acceptance in results],
+        "nb_forward_runs": len(cache),
+        "emulator_error": float(emulator.validation_error),
+        "noise_scale": float(scale),
+        "nb_likelihood_evaluations": nb_evaluations,
+        "samples": samples,
+    }
+    return summary
+
+
+def export_posterior(summary, filename):
+    """Writes the posterior summary to a JSON file and the samples to a .npz
+    file next to it
+
+    Args:
+        summary (dict): the summary returned by calibrate
+        filename (str): the JSON file
+    """
+    folder = os.path.dirname(os.path.abspath(filename))
+    os.makedirs(folder, exist_ok=True)
+    samples = summary["samples"]
+    np.savez_compressed(
+        os.path.splitext(filename)[0] + "_samples.npz",
+        samples=samples,
+        parameters=np.array(parameter_names),
+    )
+    with open(filename, "w") as f:
+        json.dump(
+            {key: value for key, value in summary.items() if key != "samples"},
+            f,
+            indent=1,
+        )
+
+
+def read_posterior_samples(filename):
+    """Reads the posterior samples exported with export_posterior, eg. to
+    propagate the trap parameters uncertainty to inventories
+
+    Args:
+        filename (str): the JSON file
+
+    Returns:
+        list of str, numpy.array: the parameter names and the samples, one
+            per row
+    """
+    data = np.load(os.path.splitext(filename)[0] + "_samples.npz")
+    return data["parameters"].tolist(), data["samples"]
+
+
+if __name__ == "__main__":
+    reference_data = np.genfromtxt(
+        "data/tds_data_schwartz_selinger/0.5_dpa.csv", delimiter=","
+    )
+    summary = calibrate(reference_data)
+    export_posterior(summary, "data/bayesian_calibration/posterior_0.5_dpa.json")
+    for name, mean, std, r_hat in zip(
+        parameter_names, summary["mean"], summary["std"], summary["r_hat"]
+    ):
+        print("{}: {:.3f} +/- {:.3f} (R-hat {:.3f})".format(name, mean, std, r_hat))
@@ -1,34 +1,37 @@
 import numpy as np
+import os
 import sys
-from festim import k_B
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from damage_core.constants import k_B
 
-def automatic_vertices(r_p, size, mat, traps, nb_cells, T, implantation_time, flux):
+
+def automatic_vertices(
+    r_p, size, mat, traps, nb_cells, T, implantation_time, flux, damage_profile=None
+):
     """Generates an array of vertices for the TDS simulation
 
     Args:
         r_p (float): the implantation depth
         size (float): the size of the sample
         mat (FESTIM.Material): the material of the TDS
-        traps (list of FESTIM.Traps): the traps
+        traps (TrapCatalogue): the traps, with their densities at r_p
         nb_cells (int): number of cells x > r_p + r_d
         T (float): implantation temperature
         implantation_time (float): implantation time
         flux (float): implantation flux
+        damage_profile (DamageProfile, optional): if given, the cells over
+            which the damage profile varies by more than 5% are refined.
+            Defaults to None.
 
     Returns:
         numpy.array: the mesh vertices
     """
     D = mat.D_0 * np.exp(-mat.E_D / k_B / T)
-    ns = np.array([trap.density[0](r_p) for trap in traps])
-    E_ps = np.array([trap.E_p for trap in traps])
-    E_ks = np.array([trap.E_k for trap in traps])
-    k_0s = np.array([trap.k_0 for trap in traps])
-    p_0s = np.array([trap.p_0 for trap in traps])
-    ps = p_0s * np.exp(-E_ps / k_B / T)
-    ks = k_0s * np.exp(-E_ks / k_B / T)
     cmax = r_p * flux / D
-    max_penetration_depth = r_p + r_d(cmax, implantation_time, D, ns, ks, ps)
+    max_penetration_depth = r_p + traps.penetration_depth(
+        cmax, implantation_time, D, T, traps.density
+    )
     dx = 3e-6 / 300
     tolerance = 0.8
 
@@ -83,43 +86,8 @@ def automatic_vertices(r_p, size, mat, traps, nb_cells, T, implantation_time, fl
         )
         vertices = np.sort(np.unique(vertices))
 
+    if damage_profile is not None:
+        vertices = damage_profile.refine(vertices)
+
     print("The mesh size is: {}".format(len(vertices)))
     return vertices
-
-
-def r_trap(c, k, p):
-    """Computes the filling rate of a trap for a given mobile concentration
-
-    Args:
-        c (float): the concentration in H/m3/s
-        k (float): the trapping rate in m3/s
-        p (float): the detrapping rate(s) in s-1
-
-    Returns:
-        float: the filling rate
-    """
-    val = 1 + p / (k * c)
-    val = 1 / val
-    return val
-
-
-def r_d(c_max, t, D, n, k, p):
-    """Computes the maximum R_d based on trap parameters and time.
-    See Equation 3.31 of Etienne Hodille's phd thesis
-
-    Args:
-        c_max (float): the maximum concentration in H/m3/s
-        t (float): the time in s
-        D (float): the diffusion coefficient in m2/s
-        n (array_like): the trap(s) density(ies) in trap/m3
-        k (array_like): the trapping rate(s) in m3/s
-        p (array_like): the detrapping rate(s) in s-1
-
-    Returns:
-        float: the penetration depth in m
-    """
-    R_d = 2 * D * c_max * t
-    R_d /= (r_trap(c_max, k, p) * n).sum()
-    R_d = R_d**0.5
-
-    return R_d
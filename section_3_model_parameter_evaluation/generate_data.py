@@ -1,7 +1,19 @@
 import numpy as np
+import os
+import sys
 from scipy.integrate import odeint
 from neutron_trap_creation_models import neutron_trap_creation_numerical
-from TDS_sim import festim_sim
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from damage_core.pipeline import Pipeline
+from damage_core.trap_catalogue import tungsten_traps
+from damage_core.work_queue import WorkQueue
+
+folder = os.path.dirname(os.path.abspath(__file__))
+models_file = os.path.join(folder, "neutron_trap_creation_models.py")
+TDS_sim_file = os.path.join(folder, "TDS_sim.py")
+catalogue_file = os.path.join(folder, "..", "damage_core", "trap_catalogue.py")
+profile_file = os.path.join(folder, "..", "damage_core", "damage_profile.py")
 
 
 
@@ -22,13 +34,9 @@ def generate_fig_2_annealed_trap_fitting_data():
     t_annealing = np.linspace(0, annealing_time, num=1000)
     T_values = np.linspace(1, 800, num=1000)
 
-    A_0_1 = 6.1834e-03
-    E_A_1 = 0.24
-    E_A_2 = 0.30
-
-    # dummy values for no annealing
-    A_0_2 = 0
-    E_A_3 = 1
+    # annealing of the defect types I (D1), II (D3) and III (D5, no annealing)
+    A_0_1, _, A_0_2 = tungsten_traps[["D1", "D3", "D5"]].A_0
+    E_A_1, E_A_2, E_A_3 = tungsten_traps[["D1", "D3", "D5"]].E_A
 
     # dummy values for damage parameters
     phi = 0
@@ -85,116 +93,117 @@ def generate_fig_2_annealed_trap_fitting_data():
     np.savetxt("data/annealed_defect_3_densities.txt", annealed_defect_3_densities)
 
 
-def generate_fig_4_TDS_fitting_data():
-    # 0 dpa values
-    festim_sim(
-        n1=0,
-        n2=0,
-        n3=0,
-        n4=0,
-        n5=0,
-        results_foldername="data/damaged_sample_tds_fittings/dpa_0/",
-    )
-    
-    # 0.001 dpa values
-    festim_sim(
-        n1=4.5e24,
-        n2=1e24,
-        n3=5e23,
-        n4=1e24,
-        n5=2e23,
-        results_foldername="data/damaged_sample_tds_fittings/dpa_0.001/",
-    )
-    
-    # 0.005 dpa values
-    festim_sim(
-        n1=7e24,
-        n2=2.5e24,
-        n3=1e24,
-        n4=1.9e24,
-        n5=1.6e24,
-        results_foldername="data/damaged_sample_tds_fittings/dpa_0.005/",
-    )
-    
-    # 0.023 dpa values
-    festim_sim(
-        n1=2.4e25,
-        n2=1.4e25,
-        n3=6e24,
-        n4=2.1e25,
-        n5=6e24,
-        results_foldername="data/damaged_sample_tds_fittings/dpa_0.023/",
-    )
-    
-    # 0.1 dpa values
-    festim_sim(
-        n1=5.4e25,
-        n2=3.8e25,
-        n3=2.8e25,
-        n4=3.6e25,
-        n5=1.1e25,
-        results_foldername="data/damaged_sample_tds_fittings/dpa_0.1/",
-    )
-    
-    # 0.23 dpa values
-    festim_sim(
-        n1=5.8e25,
-        n2=4.4e25,
-        n3=3.5e25,
-        n4=4.0e25,
-        n5=1.4e25,
-        results_foldername="data/damaged_sample_tds_fittings/dpa_0.23/",
-    )
-    
-    # 0.5 dpa values
-    festim_sim(
-        n1=6.0e25,
-        n2=4.8e25,
-        n3=4.3e25,
-        n4=4.3e25,
-        n5=1.75e25,
-        results_foldername="data/damaged_sample_tds_fittings/dpa_0.5/",
-    )
-    
-    # 2.5 dpa values
-    festim_sim(
-        n1=6.8e25,
-        n2=6.1e25,
-        n3=5e25,
-        n4=5e25,
-        n5=2e25,
-        results_foldername="data/damaged_sample_tds_fittings/dpa_2.5/",
-    )
-    
+def run_TDS_case(**kwargs):
+    """Runs TDS_sim.festim_sim, FESTIM being only imported here"""
+    from TDS_sim import festim_sim
 
-def generate_fig_5_damaged_trap_fitting_data():
-    """
-    TDS data from T.Swartz-Selinger, currently unpublished
+    festim_sim(**kwargs)
+
+
+def fig_4_jobs():
+    """Arguments of festim_sim for the TDS fittings of figure 4
+
+    Returns:
+        list of dict: the arguments of festim_sim
     """
-    # defect type I
-    A_0_1 = 6.1838e-03
-    E_A_1 = 0.24
+    return [
+        # 0 dpa values
+        dict(
+            n1=0,
+            n2=0,
+            n3=0,
+            n4=0,
+            n5=0,
+            results_foldername="data/damaged_sample_tds_fittings/dpa_0/",
+        ),
+        # 0.001 dpa values
+        dict(
+            n1=4.5e24,
+            n2=1e24,
+            n3=5e23,
+            n4=1e24,
+            n5=2e23,
+            results_foldername="data/damaged_sample_tds_fittings/dpa_0.001/",
+        ),
+        # 0.005 dpa values
+        dict(
+            n1=7e24,
+            n2=2.5e24,
+            n3=1e24,
+            n4=1.9e24,
+            n5=1.6e24,
+            results_foldername="data/damaged_sample_tds_fittings/dpa_0.005/",
+        ),
+        # 0.023 dpa values
+        dict(
+            n1=2.4e25,
+            n2=1.4e25,
+            n3=6e24,
+            n4=2.1e25,
+            n5=6e24,
+            results_foldername="data/damaged_sample_tds_fittings/dpa_0.023/",
+        ),
+        # 0.1 dpa values
+        dict(
+            n1=5.4e25,
+            n2=3.8e25,
+            n3=2.8e25,
+            n4=3.6e25,
+            n5=1.1e25,
+            results_foldername="data/damaged_sample_tds_fittings/dpa_0.1/",
+        ),
+        # 0.23 dpa values
+        dict(
+            n1=5.8e25,
+            n2=4.4e25,
+            n3=3.5e25,
+            n4=4.0e25,
+            n5=1.4e25,
+            results_foldername="data/damaged_sample_tds_fittings/dpa_0.23/",
+        ),
+        # 0.5 dpa values
+        dict(
+            n1=6.0e25,
+            n2=4.8e25,
+            n3=4.3e25,
+            n4=4.3e25,
+            n5=1.75e25,
+            results_foldername="data/damaged_sample_tds_fittings/dpa_0.5/",
+        ),
+        # 2.5 dpa values
+        dict(
+            n1=6.8e25,
+            n2=6.1e25,
+            n3=5e25,
+            n4=5e25,
+            n5=2e25,
+            results_foldername="data/damaged_sample_tds_fittings/dpa_2.5/",
+        ),
+    ]
 
-    trap_D1_K = 9.0e26
-    trap_D1_n_max = 6.9e25
-    trap_D2_K = 4.2e26
-    trap_D2_n_max = 7.0e25
 
-    # defect type II
-    A_0_2 = 6.1838e-03
-    E_A_2 = 0.30
+def generate_fig_4_TDS_fitting_data(queue=None):
+    """Runs the TDS fittings of figure 4
 
-    trap_D3_K = 2.5e26
-    trap_D3_n_max = 6.0e25
-    trap_D4_K = 5.0e26
-    trap_D4_n_max = 4.7e25
+    Args:
+        queue (WorkQueue, optional): if given, the simulations are submitted
+            to the queue instead, to be run by its workers. Defaults to None.
+    """
+    if queue is not None:
+        jobs = fig_4_jobs()
+        queue.submit(
+            run_TDS_case, jobs, keys=[job["results_foldername"] for job in jobs]
+        )
+        return
+    for job in fig_4_jobs():
+        run_TDS_case(**job)
 
-    # defect type III
-    A_0_3 = 0
-    E_A_3 = 1
 
-    trap_D5_K = 1.0e26
-    trap_D5_n_max = 2.0e25
+def generate_fig_5_damaged_trap_fitting_data():
+    """
+    TDS data from T.Swartz-Selinger, currently unpublished
+    """
+    damage_traps = tungsten_traps[tungsten_traps.K > 0]
 
     phi = 8.9e-05
     t_damage = int(3/phi)
@@ -202,41 +211,54 @@ def generate_fig_5_damaged_trap_fitting_data():
     n_0 = 0
     T_damage = 800  # K
 
-    # trap 1
-    trap1_extra_args = (phi, trap_D1_K, trap_D1_n_max, A_0_1, E_A_1, T_damage)
-    n_trap1_damaged = odeint(
-        neutron_trap_creation_numerical, n_0, t, args=trap1_extra_args
-    )
-    # trap 2
-    trap2_extra_args = (phi, trap_D2_K, trap_D2_n_max, A_0_1, E_A_1, T_damage)
-    n_trap2_damaged = odeint(
-        neutron_trap_creation_numerical, n_0, t, args=trap2_extra_args
-    )
-    # trap 3
-    trap3_extra_args = (phi, trap_D3_K, trap_D3_n_max, A_0_2, E_A_2, T_damage)
-    n_trap3_damaged = odeint(
-        neutron_trap_creation_numerical, n_0, t, args=trap3_extra_args
-    )
-    # trap 4
-    trap4_extra_args = (phi, trap_D4_K, trap_D4_n_max, A_0_2, E_A_2, T_damage)
-    n_trap4_damaged = odeint(
-        neutron_trap_creation_numerical, n_0, t, args=trap4_extra_args
-    )
-    # trap 5
-    trap5_extra_args = (phi, trap_D5_K, trap_D5_n_max, A_0_3, E_A_3, T_damage)
-    n_trap5_damaged = odeint(
-        neutron_trap_creation_numerical, n_0, t, args=trap5_extra_args
-    )
+    for i, name in enumerate(damage_traps.names):
+        trap_extra_args = (
+            phi,
+            damage_traps.K[i],
+            damage_traps.n_max[i],
+            damage_traps.A_0[i],
+            damage_traps.E_A[i],
+            T_damage,
+        )
+        n_trap_damaged = odeint(
+            neutron_trap_creation_numerical, n_0, t, args=trap_extra_args
+        )
 
-    # exporting
-    np.savetxt("data/damage_trap_D1_fitting.txt", n_trap1_damaged)
-    np.savetxt("data/damage_trap_D2_fitting.txt", n_trap2_damaged)
-    np.savetxt("data/damage_trap_D3_fitting.txt", n_trap3_damaged)
-    np.savetxt("data/damage_trap_D4_fitting.txt", n_trap4_damaged)
-    np.savetxt("data/damage_trap_D5_fitting.txt", n_trap5_damaged)
+        # exporting
+        np.savetxt("data/damage_trap_{}_fitting.txt".format(name), n_trap_damaged)
     
 
 if __name__ == "__main__":
-    generate_fig_2_annealed_trap_fitting_data()
-    generate_fig_4_TDS_fitting_data()
-    generate_fig_5_damaged_trap_fitting_data()
\ No newline at end of file
+    # usage: python generate_data.py [submit|collect queue.sqlite]
+    # only the datasets whose inputs or code have changed are regenerated,
+    # here or, with submit, by the workers of a work queue on any number of
+    # hosts (python -m damage_core.work_queue work queue.sqlite), collect
+    # recording the datasets they have computed
+    pipeline = Pipeline("data/pipeline.json")
+    pipeline.add(
+        generate_fig_2_annealed_trap_fitting_data,
+        outputs=[
+            "data/annealed_defect_{}_densities.txt".format(i) for i in range(1, 4)
+        ],
+        code=[models_file, catalogue_file],
+    )
+    for job in fig_4_jobs():
+        pipeline.add(
+            run_TDS_case,
+            job,
+            outputs=[job["results_foldername"] + "last.csv"],
+            code=[TDS_sim_file, catalogue_file, profile_file],
+            name="TDS " + job["results_foldername"],
+        )
+    pipeline.add(
+        generate_fig_5_damaged_trap_fitting_data,
+        outputs=["data/damage_trap_D{}_fitting.txt".format(i) for i in range(1, 6)],
+        code=[models_file, catalogue_file],
+    )
+    if len(sys.argv) > 2 and sys.argv[1] == "collect":
+        collected = pipeline.collect(WorkQueue(sys.argv[2]))
+        print("{} datasets collected".format(len(collected)))
+    elif len(sys.argv) > 2 and sys.argv[1] == "submit":
+        pipeline.submit(WorkQueue(sys.argv[2]))
+    else:
+        pipeline.run()
\ No newline at end of file
@@ -1,67 +1,117 @@
 from scipy.interpolate import interp1d
 from scipy.optimize import minimize
+import hashlib
+import json
 import numpy as np
+import os
+import sys
 
 from TDS_sim import festim_sim, implantation_time, resting_time, atom_density_W
+from tds_basis import basis_code_files, nnls_initial_guess
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from damage_core.cached_loading import file_signature
+from damage_core.metrics import mean_absolute_error
 
-def mean_absolute_error(y1, y2, x=None, bounds=None, weight=None):
-    """computes the mean absolute error between y1 and y2
+# fidelity ladder: the first levels (coarser meshes, faster growing time
+# steps) are cheaper and only used far from the optimum, the last level is the
+# full fidelity of the original fits
+fidelity_levels = [
+    {"initial_number_cells": 100, "stepsize_change_ratio": 1.3},
+    {"initial_number_cells": 250, "stepsize_change_ratio": 1.2},
+    {"initial_number_cells": 500, "stepsize_change_ratio": 1.1},
+]
+
+
+def history_filename(reference_data, folder="data/optimisation_history/"):
+    """Names the history file of a reference spectrum and of the current
+    model, so that the evaluations of another reference or of a modified
+    model are never reused
 
     Args:
-        y1 (array_like): the first y data
-        y2 (array_like): the second y data
-        x (list, optional): the x data with same shape as y1, y2. Defaults to
-            None.
-        bounds (list, optional): x bounds for weighing the error based on
-            weight. Defaults to None.
-        weight (float or list of floats, optional): weight applied to the mean
-            value for x values in bounds. Defaults to None.
+        reference_data (numpy.array): the reference TDS
+        folder (str, optional): the folder of the history files. Defaults to
+            "data/optimisation_history/".
 
     Returns:
-        float: the mean absolute error between y1 and y2
+        str: the csv file
     """
-    # Check parameters
-    if y1.shape != y2.shape:
-        raise ValueError("y1 and y2 don't have the same shape")
-    if x is not None:
-        if x.shape != y1.shape:
-            raise ValueError("x doesn't have the same shape as y1 and y2")
-
-    # if (bounds, weight) != (None, None):
-    #     if None in [bounds, weights]:
-    #         raise ValueError("bounds was set without weight (or the opposite)")
-    #     if x is None:
-    #         raise ValueError("if bounds are set, x array is needed")
-
-    if bounds is None:
-        bounds = []
-    if weight is None:
-        weight = []
-
-    # create weights
-    coefficients = np.ones(y1.shape)
-
-    if isinstance(weight, list):
-        weights = weight
-    else:
-        weights = [weight]
-
-    for bound, w in zip(bounds, weights):
-        indexes = np.where((x > bound[0]) & (x <= bound[1]))
-        coefficients[indexes] = w
-
-    # compute difference
-    diff = np.abs(y1 - y2)
-    diff = diff * coefficients
-    err = diff.mean()
+    description = {
+        "reference": hashlib.sha256(
+            np.ascontiguousarray(reference_data, dtype=float).tobytes()
+        ).hexdigest(),
+        "fidelity_levels": fidelity_levels,
+        "code": {
+            os.path.basename(filename): file_signature(filename, "hash")
+            for filename in basis_code_files
+        },
+    }
+    key = hashlib.sha256(json.dumps(description, sort_keys=True).encode())
+    return folder + "history_{}.csv".format(key.hexdigest()[:16])
+
+
+def read_history(history_file):
+    """Reads the evaluations of previous optimisations
+
+    Args:
+        history_file (str): the csv file, one row per evaluation with the real
+            parameters, the fidelity level and the error
+
+    Returns:
+        numpy.array: the rows (empty if the file does not exist)
+    """
+    if history_file is None or not os.path.exists(history_file):
+        return np.empty((0, 0))
+    return np.atleast_2d(np.genfromtxt(history_file, delimiter=","))
 
-    return err
 
+def tds_desorption(res, T_ref):
+    """Interpolates the simulated desorption flux of the TDS phase at the
+    temperatures of the reference data
 
-def error(desorption_ref, T_ref, p, norms=None, restart_data=None):
+    Args:
+        res (list): the derived quantities returned by festim_sim, header
+            included
+        T_ref (numpy.array): the temperatures of the reference data (K)
+
+    Returns:
+        numpy.array: the desorption flux (m-2 s-1)
+    """
+    # find the indexes of the columns based on the column name
+    index_temperature = res[0].index("Average T volume 1")
+    index_flux_1 = res[0].index("Flux surface 1: solute")
+    index_flux_2 = res[0].index("Flux surface 2: solute")
+    res = np.array(res[1:])  # remove header
+    times = res[:, 0]
+    tds_indexes = np.where(times > implantation_time + resting_time)
+
+    # retrieve temperature and desorption flux
+    T = res[:, index_temperature][tds_indexes]
+    flux = -(res[:, index_flux_1] + res[:, index_flux_2])[tds_indexes]
+
+    # interpolate simulated tds
+    interp_tds = interp1d(T, flux, fill_value="extrapolate")
+    # match to reference data
+    return interp_tds(T_ref)
+
+
+def error(p, desorption_ref, T_ref, norms, level=-1, history_file=None):
     """
     Compute average absolute error between simulation and reference
+
+    Args:
+        p (list): the (normalised) parameters n1 to n5
+        desorption_ref (numpy.array): the reference desorption flux (m-2 s-1)
+        T_ref (numpy.array): the temperatures of the reference data (K)
+        norms (list of str): the norm of each parameter, "linear" or "log"
+        level (int, optional): the index of the fidelity level in
+            fidelity_levels. Defaults to -1 (full fidelity).
+        history_file (str, optional): if given, the evaluations are appended
+            to this csv file and points already evaluated at the same level
+            are not run again. Defaults to None.
+
+    Returns:
+        float: the error
     """
     print("-" * 40)
     global j
@@ -84,50 +134,38 @@ def error(desorption_ref, T_ref, p, norms=None, restart_data=None):
             raise ValueError("Unknown {} norm".format(norm))
 
     print("Real parameters are:")
-    print(
-        "[{:.4e}, {:.4e}, {:.4e}, {:.4e}]".format(
-            p_real[0], p_real[1], p_real[2], p_real[3]
-        )
-    )
+    print("[" + ", ".join("{:.4e}".format(prm) for prm in p_real) + "]")
 
     # if any parameter is negative, return a very high error
     # this is a way to artificially constrain Nelder-Mead
     if any([e < 0 for e in p_real]):
         return 1e30
 
-    if restart_data is not None:
+    level = range(len(fidelity_levels))[level]
+    history = read_history(history_file)
+    if len(history) > 0:
         # try to find point in database
-        index_sim = np.where(np.all(np.isclose(restart_data[:, :-1], p_real), axis=1))
+        index_sim = np.where(
+            np.all(np.isclose(history[:, :-2], p_real), axis=1)
+            & (history[:, -2] == level)
+        )
         if len(index_sim[0]) > 0:
-            err = restart_data[index_sim][0][-1]
+            err = history[index_sim][0][-1]
             return err
 
     # run FESTIM sim
+    fidelity = fidelity_levels[level]
+    print("Fidelity level {}: {}".format(level, fidelity))
     try:
-        res = festim_sim(*p_real, initial_number_cells=500)
+        res = festim_sim(*p_real, export_retention=False, **fidelity)
     except ValueError:
-        print("Re-running sim with 4000 cells")
-        res = festim_sim(*p_real, initial_number_cells=4000)
+        print("Re-running sim with 8 times more cells")
+        fidelity = dict(fidelity)
+        fidelity["initial_number_cells"] *= 8
+        res = festim_sim(*p_real, export_retention=False, **fidelity)
 
     # COMPUTE DIFFERENCE WITH REFERENCE
-
-    # find the indexes of the columns based on the column name
-    index_temperature = res[0].index("Average T volume 1")
-    index_flux_1 = res[0].index("Flux surface 1: solute")
-    index_flux_2 = res[0].index("Flux surface 2: solute")
-    res.pop(0)  # remove header
-    res = np.array(res)
-    times = res[:, 0]
-    tds_indexes = np.where(times > implantation_time + resting_time)
-
-    # retrieve temperature and desorption flux
-    T = res[:, index_temperature][tds_indexes]
-    flux = -(res[:, index_flux_1] + res[:, index_flux_2])[tds_indexes]
-
-    # interpolate simulated tds
-    interp_tds = interp1d(T, flux, fill_value="extrapolate")
-    # match to reference data
-    simulated_desorption = interp_tds(T_ref)
+    simulated_desorption = tds_desorption(res, T_ref)
 
     # compute error
 
@@ -149,84 +187,145 @@ def error(desorption_ref, T_ref, p, norms=None, restart_data=None):
 
     # print error
     print("Error: {:.2e}".format(err))
-    print("Absolute tolerance: {:.2e}".format(fatol))
-    print("Absolute tolerance: {:.2e}".format(xatol))
+
+    if history_file is not None:
+        folder = os.path.dirname(os.path.abspath(history_file))
+        os.makedirs(folder, exist_ok=True)
+        with open(history_file, "a") as f:
+            f.write(",".join("{:.17g}".format(v) for v in p_real + [level, err]))
+            f.write("\n")
 
     # RETURN ERROR
     return err
 
 
-def TDS_optimisation(initial_guess, reference_data, norms):
-    initial_guess = initial_guess
-    norms = norms
+def TDS_optimisation(
+    initial_guess,
+    reference_data,
+    norms,
+    fatol=1e-03,
+    xatol=1e-03,
+    levels=None,
+    history_file=None,
+    initial_step=None,
+):
+    """Fits the trap densities to a TDS spectrum with a sequence of
+    Nelder-Mead runs of increasing fidelity.
+
+    Each run starts from the final simplex of the previous one, and its
+    tolerances are loosened by a factor 10 per level below the full fidelity,
+    so that the coarse levels stop once they are too close to the optimum to
+    be trusted. As the final simplex of a level is evaluated again at the next
+    level, the mean difference between the errors of both levels on these
+    points measures the bias of the coarse errors. This offset is a
+    diagnostic only: errors of different levels are never compared, each
+    run ranking its simplex with the errors of its own level.
+
+    Args:
+        initial_guess (numpy.array): the initial (normalised) parameters
+        reference_data (numpy.array): the reference TDS, temperatures (K) in
+            the first column and desorption (D s-1) in the second
+        norms (list of str): the norm of each parameter, "linear" or "log"
+        fatol (float, optional): the absolute tolerance on the error at full
+            fidelity. Defaults to 1e-03.
+        xatol (float, optional): the absolute tolerance on the parameters at
+            full fidelity. Defaults to 1e-03.
+        levels (list of int, optional): the fidelity levels used. Defaults to
+            all the levels of fidelity_levels.
+        history_file (str, optional): the csv file of the evaluations, used to
+            restart an optimisation. Defaults to the file of the reference
+            and of the current model (see history_filename).
+        initial_step (float, optional): if given, the size of the initial
+            simplex along each parameter (normalised units), eg. small for a
+            good initial guess. Defaults to the 5% of scipy.
 
+    Returns:
+        scipy.optimize.OptimizeResult, list of float: the result of the full
+            fidelity run and the offset (fine minus coarse error) of each
+            promotion, for diagnostics
+    """
     data_ref = reference_data
     T_ref = data_ref[:, 0]
     # data in D/s, needs to convert to D/(m2 s)
     desorption_ref = data_ref[:, 1] / (12e-03 * 15e-03)
 
-    # LOAD EARLIER RESULTS FOR RESTART
-    data_earlier = None  # np.genfromtxt('simulations_results.csv', delimiter=',')
-
-    # tolerances
-    fatol = 1e-03
-    xatol = 1e-03
-
-    # recursive minimise function, useful for restart
-    def minimise_with_neldermead(ftol, xtol, initial_guess):
-        global fatol
-        global xatol
-        fatol = ftol
-        xatol = xtol
+    if levels is None:
+        levels = list(range(len(fidelity_levels)))
+    if history_file is None:
+        history_file = history_filename(reference_data)
+    print("History file: {}".format(history_file))
+
+    x = np.asarray(initial_guess, dtype=float)
+    simplex, simplex_errors = None, None
+    if initial_step is not None:
+        simplex = x + np.vstack([np.zeros(len(x)), initial_step * np.eye(len(x))])
+    offsets = []
+    for level in levels:
+        loosening = 10 ** (len(fidelity_levels) - 1 - level)
+        options = {"disp": True, "fatol": fatol * loosening, "xatol": xatol * loosening}
+        if simplex is not None:
+            options["initial_simplex"] = simplex
+        print("=" * 40)
+        print("Fidelity level {}: {}".format(level, fidelity_levels[level]))
         res = minimize(
             error,
-            initial_guess,
-            args=(norms, data_earlier),
+            x,
+            args=(desorption_ref, T_ref, norms, level, history_file),
             method="Nelder-Mead",
-            options={"disp": True, "fatol": ftol, "xatol": xtol},
+            options=options,
         )
-        print("Solution is: " + str(res.x))
-        goon = True
-        while goon:
-            a = input("Do you wish to restart ?")
-            if a == "no" or a == "No":
-                goon = False
-            elif a == "Yes" or a == "yes":
-                new_fatol = fatol
-                new_xatol = xatol
-                b = input("Choose fatol :")
-                if b != "":
-                    new_fatol = float(b)
-                c = input("Choose xatol :")
-                if c != "":
-                    new_xatol = float(c)
-                # FIXME I doubt that this will work with more that 2 parameters
-                initial_guess = np.array([res.x[0], res.x[1]])
-                minimise_with_neldermead(new_fatol, new_xatol, initial_guess)
-
-    # start optimising!
-    minimise_with_neldermead(fatol, xatol, initial_guess)
-
-
-# LOAD EARLIER RESULTS FOR RESTART
-data_earlier = None  # np.genfromtxt('simulations_results.csv', delimiter=',')
+
+        if simplex_errors is not None:
+            # the previous simplex has just been evaluated at this level, the
+            # errors are read from the history
+            errors = [
+                error(vertex, desorption_ref, T_ref, norms, level, history_file)
+                for vertex in simplex
+            ]
+            offsets.append(np.mean(np.array(errors) - simplex_errors))
+            print(
+                "Error offset of level {} against level {}: {:+.2e}".format(
+                    previous_level, level, offsets[-1]
+                )
+            )
+        x = res.x
+        simplex, simplex_errors = res.final_simplex
+        previous_level = level
+        print("Solution at level {} is: {}".format(level, res.x))
+
+    history = read_history(history_file)
+    if len(history) > 0:
+        for level in levels:
+            print(
+                "Level {}: {} evaluations".format(
+                    level, np.count_nonzero(history[:, -2] == level)
+                )
+            )
+    return res, offsets
+
 
 if __name__ == "__main__":
     # initialise counter j
     j = 0
 
-    # build initial guess
-    n1_initial = 4.9e25
-    n2_initial = 3.6e25
-    n3_initial = 2.8e25
-    n4_initial = 4e25
-    n5_initial = 1e25
-    initial_guess = np.array([n1_initial, n2_initial, n3_initial, n4_initial, n5_initial])
-
-    norms = ["linear", "linear", "linear", "linear"]
+    # the densities are optimised in log scale so that the tolerances are
+    # relative
+    norms = ["log", "log", "log", "log", "log"]
 
-    reference_data = np.genfromtxt("tds_data/0.5_dpa.csv", delimiter=",")
+    reference_data = np.genfromtxt(
+        "data/tds_data_schwartz_selinger/0.5_dpa.csv", delimiter=","
+    )
 
-    TDS_optimisation(
-        initial_guess=initial_guess, norms=norms, reference_data=reference_data
+    # build initial guess from the decomposition of the spectrum into the
+    # single trap spectra (computed once and cached)
+    initial_guess = nnls_initial_guess(reference_data)
+
+    # the initial simplex is kept close to the NNLS guess: each other vertex
+    # has one density 0.1 above it in log10, ie. 26% larger
+    res, offsets = TDS_optimisation(
+        initial_guess=initial_guess,
+        norms=norms,
+        reference_data=reference_data,
+        initial_step=0.1,
     )
+    print("Solution is: " + str(res.x))
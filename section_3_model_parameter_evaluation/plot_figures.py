@@ -1,9 +1,13 @@
 import numpy as np
-import csv
 import matplotlib.pyplot as plt
 from matplotlib import cm, rcParams
 from matplotlib.colors import LogNorm
 import shutil
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from damage_core import cached_loading
 
 rcParams['text.usetex']= True if shutil.which('latex') else False
 
@@ -19,13 +23,13 @@ def plot_fig_2_annealed_trap_fitting():
     annealing_time = 7200
 
     # read fitting data
-    annealed_defect_type_1_densities = np.genfromtxt(
+    annealed_defect_type_1_densities = cached_loading.genfromtxt(
         "data/annealed_defect_1_densities.txt"
     )
-    annealed_defect_type_2_densities = np.genfromtxt(
+    annealed_defect_type_2_densities = cached_loading.genfromtxt(
         "data/annealed_defect_2_densities.txt"
     )
-    annealed_defect_type_3_densities = np.genfromtxt(
+    annealed_defect_type_3_densities = cached_loading.genfromtxt(
         "data/annealed_defect_3_densities.txt"
     )
 
@@ -127,25 +131,19 @@ def plot_fig_4_TDS_data_fitted():
 
     for dpa in dpa_values:
         tds_data_file = "data/tds_data_schwartz_selinger/{}_dpa.csv".format(dpa)
-        tds_data = np.genfromtxt(tds_data_file, delimiter=",", dtype=float)
+        tds_data = cached_loading.genfromtxt(tds_data_file, delimiter=",", dtype=float)
         tds_data_T = tds_data[:, 0]
         tds_data_flux = tds_data[:, 1] / sample_area
         tds_T_and_flux.append([tds_data_T, tds_data_flux])
 
         results_folder = "data/damaged_sample_tds_fittings/"
         fitting_file = results_folder + "dpa_{}/last.csv".format(dpa)
-        T_sim = []
-        flux_1 = []
-        flux_2 = []
-        with open(fitting_file, "r") as csvfile:
-            plots = csv.reader(csvfile, delimiter=",")
-            for row in plots:
-                if "t(s)" not in row:
-                    if float(row[0]) >= implantation_time + resting_time * 0.75:
-                        T_sim.append(float(row[1]))
-                        flux_1.append(float(row[2]))
-                        flux_2.append(float(row[3]))
-        flux = -np.asarray(flux_1) - np.asarray(flux_2)
+        fitting = cached_loading.genfromtxt(fitting_file, delimiter=",", names=True)
+        tds_indexes = fitting["ts"] >= implantation_time + resting_time * 0.75
+        T_sim = fitting["Average_T_volume_1"][tds_indexes]
+        flux = -fitting["Flux_surface_1_solute"][tds_indexes] - fitting[
+            "Flux_surface_2_solute"
+        ][tds_indexes]
         fitting_data.append([T_sim, flux])
 
 
@@ -221,11 +219,11 @@ def plot_fig_5_damaged_trap_fitting():
     trap_D5_densities = [0, 2.0e23, 1.6e24, 6.0e24, 1.1e25, 1.4e25, 1.8e25, 2.0e25]
 
     # read fitting data
-    trap_D1_fitting = np.genfromtxt("data/damage_trap_D1_fitting.txt")
-    trap_D2_fitting = np.genfromtxt("data/damage_trap_D2_fitting.txt")
-    trap_D3_fitting = np.genfromtxt("data/damage_trap_D3_fitting.txt")
-    trap_D4_fitting = np.genfromtxt("data/damage_trap_D4_fitting.txt")
-    trap_D5_fitting = np.genfromtxt("data/damage_trap_D5_fitting.txt")
+    trap_D1_fitting = cached_loading.genfromtxt("data/damage_trap_D1_fitting.txt")
+    trap_D2_fitting = cached_loading.genfromtxt("data/damage_trap_D2_fitting.txt")
+    trap_D3_fitting = cached_loading.genfromtxt("data/damage_trap_D3_fitting.txt")
+    trap_D4_fitting = cached_loading.genfromtxt("data/damage_trap_D4_fitting.txt")
+    trap_D5_fitting = cached_loading.genfromtxt("data/damage_trap_D5_fitting.txt")
     dpa_x_values = np.linspace(0, 3, num=1000)
 
     # ##### plotting ##### #
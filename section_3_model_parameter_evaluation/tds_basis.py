@@ -0,0 +1,185 @@
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import json
+import numpy as np
+import os
+import sys
+from scipy.optimize import nnls
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from damage_core.cached_loading import file_signature
+
+folder = os.path.dirname(os.path.abspath(__file__))
+basis_code_files = [
+    os.path.join(folder, "TDS_sim.py"),
+    os.path.join(folder, "compute_profile_depth.py"),
+    os.path.join(folder, "..", "damage_core", "trap_catalogue.py"),
+    os.path.join(folder, "..", "damage_core", "damage_profile.py"),
+]
+# temperatures of the TDS ramp at which the basis spectra are stored (K)
+basis_T = np.linspace(300, 1000, num=701)
+
+
+def basis_run(densities, results_foldername, level=-1):
+    """Runs the TDS simulation with given damaged trap densities
+
+    Args:
+        densities (list of float): the densities n1 to n5 (m-3)
+        results_foldername (str): the results folder
+        level (int, optional): the fidelity level of optimisation_TDS.
+            Defaults to -1 (full fidelity).
+
+    Returns:
+        numpy.array: the desorption flux at basis_T (m-2 s-1)
+    """
+    # FESTIM is only imported by the processes running simulations
+    from optimisation_TDS import fidelity_levels, tds_desorption
+    from TDS_sim import festim_sim
+
+    res = festim_sim(
+        *densities,
+        results_foldername=results_foldername,
+        export_retention=False,
+        **fidelity_levels[level]
+    )
+    return tds_desorption(res, basis_T)
+
+
+def basis_key(unit_density, level):
+    description = {
+        "unit_density": unit_density,
+        "level": level,
+        "T": [basis_T[0], basis_T[-1], len(basis_T)],
+        "code": {
+            os.path.basename(filename): file_signature(filename, "hash")
+            for filename in basis_code_files
+        },
+    }
+    return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+
+def compute_basis(
+    filename="data/tds_basis/basis.npz",
+    unit_density=1e25,
+    level=-1,
+    max_workers=None,
+):
+    """Computes (or reads from the cache) the basis spectra: the spectrum of
+    the undamaged sample and the spectra with a single damaged trap at a unit
+    density. The cache is recomputed if the model or the arguments change.
+
+    Args:
+        filename (str, optional): the .npz cache. Defaults to
+            "data/tds_basis/basis.npz".
+        unit_density (float, optional): the density of the damaged trap of
+            each basis spectrum (m-3). Defaults to 1e25.
+        level (int, optional): the fidelity level of the simulations.
+            Defaults to -1 (full fidelity).
+        max_workers (int, optional): the number of processes. Defaults to the
+            number of CPUs.
+
+    Returns:
+        numpy.array, numpy.array: the temperatures (K) and the spectra (m-2
+            s-1), the undamaged one first then one per damaged trap
+    """
+    key = basis_key(unit_density, level)
+    if os.path.exists(filename):
+        with np.load(filename) as data:
+            if str(data["key"]) == key:
+                return data["T"], data["spectra"]
+
+    print("computing the TDS basis spectra")
+    runs = [[0, 0, 0, 0, 0]]
+    for i in range(5):
+        densities = [0, 0, 0, 0, 0]
+        densities[i] = unit_density
+        runs.append(densities)
+    results_folder = os.path.dirname(os.path.abspath(filename))
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(
+                basis_run,
+                densities,
+                os.path.join(results_folder, "basis_{}/".format(i)),
+                level,
+            )
+            for i, densities in enumerate(runs)
+        ]
+        spectra = np.array([future.result() for future in futures])
+
+    os.makedirs(results_folder, exist_ok=True)
+    np.savez(
+        filename, key=key, T=basis_T, spectra=spectra, unit_density=unit_density
+    )
+    return basis_T, spectra
+
+
+def nnls_densities(reference_data, basis, unit_density=1e25):
+    """Decomposes a reference spectrum into the basis spectra with a
+    non-negative least squares fit. The desorption of the damaged traps is
+    assumed proportional to their densities, which neglects the competition
+    between traps, so the result is a starting point for optimisation_TDS.
+
+    Args:
+        reference_data (numpy.array): the reference TDS, temperatures (K) in
+            the first column and desorption (D s-1) in the second
+        basis (tuple): the temperatures and spectra returned by compute_basis
+        unit_density (float, optional): the density of the basis spectra
+            (m-3). Defaults to 1e25.
+
+    Returns:
+        numpy.array, float: the densities n1 to n5 (m-3) and the mean
+            absolute error of the fit, normalised by the maximum of the
+            reference
+    """
+    T_ref = reference_data[:, 0]
+    # data in D/s, needs to convert to D/(m2 s)
+    desorption_ref = reference_data[:, 1] / (12e-03 * 15e-03)
+    T, spectra = basis
+    spectra = np.array([np.interp(T_ref, T, spectrum) for spectrum in spectra])
+
+    # the undamaged spectrum is always there, the damaged traps add to it
+    undamaged = spectra[0]
+    A = (spectra[1:] - undamaged).T / desorption_ref.max()
+    b = (desorption_ref - undamaged) / desorption_ref.max()
+    coefficients, _ = nnls(A, b)
+    err = np.abs(A @ coefficients - b).mean()
+    return coefficients * unit_density, err
+
+
+def nnls_initial_guess(reference_data, min_density=1e22, **kwargs):
+    """Builds the initial guess of optimisation_TDS (log10 of n1 to n5) from
+    the NNLS decomposition of a reference spectrum
+
+    Args:
+        reference_data (numpy.array): the reference TDS (see nnls_densities)
+        min_density (float, optional): the floor of the densities, the traps
+            absent from the decomposition being given this density (m-3).
+            Defaults to 1e22.
+        **kwargs: the arguments of compute_basis
+
+    Returns:
+        numpy.array: the initial guess
+    """
+    unit_density = kwargs.get("unit_density", 1e25)
+    basis = compute_basis(**kwargs)
+    densities, err = nnls_densities(reference_data, basis, unit_density)
+    print(
+        "NNLS densities: [{}], error {:.2e}".format(
+            ", ".join("{:.2e}".format(n) for n in densities), err
+        )
+    )
+    return np.log10(np.maximum(densities, min_density))
+
+
+if __name__ == "__main__":
+    basis = compute_basis()
+    data_folder = "data/tds_data_schwartz_selinger/"
+    for filename in sorted(os.listdir(data_folder)):
+        reference_data = np.genfromtxt(data_folder + filename, delimiter=",")
+        densities, err = nnls_densities(reference_data, basis)
+        print(
+            "{}: [{}], error {:.2e}".format(
+                filename, ", ".join("{:.2e}".format(n) for n in densities), err
+            )
+        )
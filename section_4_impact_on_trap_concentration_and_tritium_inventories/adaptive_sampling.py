@@ -0,0 +1,176 @@
+import numpy as np
+from scipy.interpolate import CloughTocher2DInterpolator
+from scipy.spatial import Delaunay
+
+
+def refinement_candidates(
+    T,
+    dpa,
+    log_inventory,
+    tolerance=0.05,
+    nb_candidates=10,
+    min_edge_length=0.04,
+    dpa_floor=1e-6,
+):
+    """Finds the (T, dpa) cases which would refine the sampling where the
+    log10(inventory) is poorly interpolated.
+
+    The cases are triangulated on the normalised (T, log10(dpa)) plane and the
+    midpoints of the edges are the candidates. The error indicator at a
+    midpoint is the difference between the linear and the cubic
+    (Clough-Tocher) interpolations of log10(inventory), which is large where
+    the curvature is (eg. around trap release temperatures). The edges from
+    an undamaged case to a damaged one are not refined, their midpoint being
+    at the arbitrary dpa_floor/dpa mean rather than at a physical damage
+    rate.
+
+    Args:
+        T (array_like): the temperatures of the cases (K)
+        dpa (array_like): the damage rates of the cases (dpa/fpy, 0 for
+            undamaged cases)
+        log_inventory (array_like): the log10 of the final inventories
+        tolerance (float, optional): the indicator (on log10(inventory))
+            below which an edge is not refined. Defaults to 0.05.
+        nb_candidates (int, optional): the maximum number of candidates.
+            Defaults to 10.
+        min_edge_length (float, optional): the edges shorter than this
+            (normalised) length are not refined. Defaults to 0.04.
+        dpa_floor (float, optional): the damage rate used in place of 0 on the
+            log10(dpa) axis. Defaults to 1e-6.
+
+    Returns:
+        numpy.array, numpy.array, numpy.array: the temperatures (K), damage
+            rates (dpa/fpy, 0 for undamaged cases) and error indicators of the
+            candidates, largest indicator first
+    """
+    dpa = np.asarray(dpa, dtype=float)
+    points = np.column_stack(
+        [np.asarray(T, dtype=float), np.log10(np.maximum(dpa, dpa_floor))]
+    )
+    log_inventory = np.asarray(log_inventory, dtype=float)
+    # failed cases are ignored
+    undamaged = dpa[np.isfinite(log_inventory)] == 0
+    points = points[np.isfinite(log_inventory)]
+    log_inventory = log_inventory[np.isfinite(log_inventory)]
+    lower = points.min(axis=0)
+    span = points.max(axis=0) - lower
+    scaled_points = (points - lower) / span
+
+    triangulation = Delaunay(scaled_points)
+    cubic = CloughTocher2DInterpolator(triangulation, log_inventory)
+    edges = set()
+    for simplex in triangulation.simplices:
+        for i in range(3):
+            a, b = sorted((simplex[i], simplex[(i + 1) % 3]))
+            edges.add((a, b))
+    edges = np.array(sorted(edges))
+
+    lengths = np.linalg.norm(
+        scaled_points[edges[:, 0]] - scaled_points[edges[:, 1]], axis=1
+    )
+    midpoints = scaled_points[edges].mean(axis=1)
+    linear = log_inventory[edges].mean(axis=1)
+    indicators = np.abs(cubic(midpoints) - linear)
+
+    selected = (
+        (indicators > tolerance)
+        & (lengths > min_edge_length)
+        & (undamaged[edges[:, 0]] == undamaged[edges[:, 1]])
+    )
+    order = np.argsort(indicators[selected])[::-1][:nb_candidates]
+    midpoints = midpoints[selected][order] * span + lower
+    # the midpoints of undamaged edges stay undamaged
+    on_floor = undamaged[edges[selected][order][:, 0]]
+    dpa = np.where(on_floor, 0, 10 ** midpoints[:, 1])
+    return midpoints[:, 0], dpa, indicators[selected][order]
+
+
+def interpolate_log_inventory(T, dpa, log_inventory, T_new, dpa_new, dpa_floor=1e-6):
+    """Interpolates log10(inventory) between (T, dpa) cases with the cubic
+    (Clough-Tocher) interpolation of refinement_candidates, eg. to plot an
+    adaptive sweep on a regular grid
+
+    Args:
+        T (array_like): the temperatures of the cases (K)
+        dpa (array_like): the damage rates of the cases (dpa/fpy, 0 for
+            undamaged cases)
+        log_inventory (array_like): the log10 of the final inventories, nan
+            for failed cases
+        T_new (array_like): the temperatures at which to interpolate (K)
+        dpa_new (array_like): the damage rates at which to interpolate
+            (dpa/fpy)
+        dpa_floor (float, optional): the damage rate used in place of 0 on the
+            log10(dpa) axis. Defaults to 1e-6.
+
+    Returns:
+        numpy.array: the interpolated log10(inventory), nan outside of the
+            cases
+    """
+    points = np.column_stack(
+        [
+            np.asarray(T, dtype=float),
+            np.log10(np.maximum(np.asarray(dpa, dtype=float), dpa_floor)),
+        ]
+    )
+    new_points = np.column_stack(
+        [
+            np.asarray(T_new, dtype=float),
+            np.log10(np.maximum(np.asarray(dpa_new, dtype=float), dpa_floor)),
+        ]
+    )
+    log_inventory = np.asarray(log_inventory, dtype=float)
+    points = points[np.isfinite(log_inventory)]
+    log_inventory = log_inventory[np.isfinite(log_inventory)]
+    lower = points.min(axis=0)
+    span = points.max(axis=0) - lower
+    cubic = CloughTocher2DInterpolator((points - lower) / span, log_inventory)
+    return cubic((new_points - lower) / span)
+
+
+def adaptive_sweep(run, T_values, dpa_values, nb_iterations=20, **kwargs):
+    """Runs an initial (T, dpa) grid and refines it where the interpolated
+    log10(inventory) is inaccurate, until no edge needs refinement
+
+    Args:
+        run (callable): runs a list of (T, dpa) cases, called as
+            run(T, dpa), and returns their final inventories (nan for failed
+            cases)
+        T_values (array_like): the temperatures of the initial grid (K)
+        dpa_values (array_like): the damage rates of the initial grid
+            (dpa/fpy, 0 for undamaged cases)
+        nb_iterations (int, optional): the maximum number of refinements.
+            Defaults to 20.
+        **kwargs: the arguments of refinement_candidates
+
+    Returns:
+        numpy.array, numpy.array, numpy.array: the temperatures (K), damage
+            rates (dpa/fpy) and final inventories of all the cases run
+    """
+    T, dpa = np.meshgrid(T_values, dpa_values, indexing="ij")
+    T, dpa = T.ravel(), dpa.ravel()
+    inventories = np.asarray(run(T, dpa), dtype=float)
+    for iteration in range(nb_iterations):
+        T_new, dpa_new, indicators = refinement_candidates(
+            T, dpa, np.log10(inventories), **kwargs
+        )
+        if len(T_new) == 0:
+            break
+        print(
+            "refinement {}: {} new cases, max indicator {:.2e}".format(
+                iteration + 1, len(T_new), indicators[0]
+            )
+        )
+        T = np.concatenate([T, T_new])
+        dpa = np.concatenate([dpa, dpa_new])
+        inventories = np.concatenate(
+            [inventories, np.asarray(run(T_new, dpa_new), dtype=float)]
+        )
+    return T, dpa, inventories
+
+
+if __name__ == "__main__":
+    from generate_data import generate_fig_8_inventory_variataion
+
+    # the figure 8 sweep starts from a coarse grid refined with
+    # refinement_candidates
+    generate_fig_8_inventory_variataion()
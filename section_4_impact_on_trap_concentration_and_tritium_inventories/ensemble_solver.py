@@ -0,0 +1,250 @@
+import numpy as np
+import os
+import sys
+from scipy.linalg import solve_banded
+
+from screening import (
+    D_0,
+    E_D,
+    fpy,
+    implantation_flux,
+    implantation_depth,
+    sample_thickness,
+)
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from damage_core.constants import k_B
+from damage_core.results_store import ResultsStore
+from damage_core.trap_catalogue import tungsten_traps
+
+
+class EnsembleModel:
+    """Finite difference version of the section 4 model (festim_model)
+    advancing N (dpa, T) cases together.
+
+    All the cases share the mesh and the time steps. With backward Euler, the
+    trapped concentrations are eliminated pointwise so that each Newton
+    iteration solves a single banded system for the mobile concentrations of
+    all the cases, the tridiagonal blocks of the cases being stacked along
+    the diagonal. The trap densities follow the analytical solution of the
+    trap creation model.
+
+    With the default 1000 cells, the final (1 fpy) inventories of the 50
+    undamaged cases of figure 8 differ from the FESTIM results by 0.03% to
+    0.08% (0.07% at 814 K). There are no FESTIM results of the damaged cases
+    to compare to.
+
+    Args:
+        dpa (array_like): the damage rates of the cases (dpa/fpy)
+        T (array_like): the temperatures of the cases (K)
+        cells (int, optional): the number of cells of the mesh. Defaults to
+            1000.
+    """
+
+    def __init__(self, dpa, T, cells=1000):
+        dpa, T = np.broadcast_arrays(
+            np.atleast_1d(np.asarray(dpa, dtype=float)),
+            np.atleast_1d(np.asarray(T, dtype=float)),
+        )
+        self.dpa = dpa
+        self.T = T
+        self.x = np.linspace(0, sample_thickness, num=cells + 1)
+        self.h = self.x[1] - self.x[0]
+        # trapezoidal integration weights
+        self.weights = np.full(len(self.x), self.h)
+        self.weights[[0, -1]] /= 2
+
+        # axes: (case, trap, node)
+        self.D = D_0 * np.exp(-E_D / k_B / T)[:, np.newaxis]
+        self.c_s = implantation_flux * implantation_depth / self.D
+        self.k = tungsten_traps.trapping_rate(T)[:, :, np.newaxis]
+        self.p = tungsten_traps.detrapping_rate(T)[:, :, np.newaxis]
+
+    def trap_densities(self, t):
+        return tungsten_traps.densities(t, self.dpa / fpy, self.T)[:, :, np.newaxis]
+
+    def trapped(self, c, c_t_old, n, dt):
+        """Backward Euler solution of the trapping equations for a given
+        mobile concentration, and its derivative with respect to c"""
+        c = c[:, np.newaxis, :]
+        denominator = 1 + dt * (self.k * c + self.p)
+        c_t = (c_t_old + dt * self.k * c * n) / denominator
+        dc_t = dt * self.k * (n - c_t) / denominator
+        return c_t, dc_t
+
+    def newton_step(self, c, c_old, c_t_old, n, dt):
+        """Computes the Newton increment of the mobile concentrations
+
+        Returns:
+            numpy.array, numpy.array: the increment and the trapped
+                concentrations at c
+        """
+        c_t, dc_t = self.trapped(c, c_t_old, n, dt)
+        diffusion = self.D / self.h**2
+
+        laplacian = np.zeros_like(c)
+        laplacian[:, 1:-1] = c[:, :-2] - 2 * c[:, 1:-1] + c[:, 2:]
+        # no flux at the rear surface
+        laplacian[:, -1] = 2 * (c[:, -2] - c[:, -1])
+        residual = c - c_old + (c_t - c_t_old).sum(axis=1) - dt * diffusion * laplacian
+
+        diagonal = 1 + dc_t.sum(axis=1) + 2 * dt * diffusion
+        upper = np.zeros_like(c)
+        upper[:, :-1] = -dt * diffusion
+        lower = np.zeros_like(c)
+        lower[:, 1:] = -dt * diffusion
+        lower[:, -1] *= 2
+        # Dirichlet condition at the implanted surface
+        residual[:, 0] = c[:, 0] - self.c_s[:, 0]
+        diagonal[:, 0] = 1
+        upper[:, 0] = 0
+
+        bands = np.zeros((3, c.size))
+        bands[0, 1:] = upper.ravel()[:-1]
+        bands[1] = diagonal.ravel()
+        bands[2, :-1] = lower.ravel()[1:]
+        increment = solve_banded((1, 1), bands, -residual.ravel())
+        return increment.reshape(c.shape), c_t
+
+    def run(
+        self,
+        total_time,
+        export_times=None,
+        initial_stepsize=0.1,
+        stepsize_change_ratio=1.01,
+        dt_min=1e-3,
+        rtol=1e-8,
+        maximum_iterations=30,
+    ):
+        """Runs all the cases from the initial (empty) state
+
+        Args:
+            total_time (float): the simulated time (s)
+            export_times (array_like, optional): the times at which the
+                inventories are recorded (s), the final time being always
+                included. Defaults to 200 log-spaced times from 0.1 s.
+            initial_stepsize (float, optional): the initial stepsize (s).
+                Defaults to 0.1.
+            stepsize_change_ratio (float, optional): the stepsize is
+                multiplied by this ratio after a quick convergence and divided
+                by it after a slow one. Defaults to 1.01.
+            dt_min (float, optional): the minimum stepsize (s). Defaults to
+                1e-3.
+            rtol (float, optional): the Newton tolerance on the increment
+                relative to the surface concentration. Defaults to 1e-8.
+            maximum_iterations (int, optional): the maximum number of Newton
+                iterations. Defaults to 30.
+
+        Returns:
+            list of dict: for each case, the series "ts",
+                "Total_solute_volume_1", "Total_retention_volume_1" and
+                "Total_<i>_volume_1" for each trap i, as in the FESTIM derived
+                quantities
+        """
+        if export_times is None:
+            export_times = np.geomspace(1e-1, total_time, num=200)
+        export_times = np.union1d(export_times, [total_time])
+        export_times = export_times[export_times <= total_time]
+
+        nb_cases = len(self.T)
+        c = np.zeros((nb_cases, len(self.x)))
+        c[:, 0] = self.c_s[:, 0]
+        c_t = np.zeros((nb_cases, len(tungsten_traps), len(self.x)))
+        records = []
+
+        t = 0
+        dt = initial_stepsize
+        next_export = 0
+        while next_export < len(export_times):
+            # do not step over the export times
+            step = min(dt, export_times[next_export] - t)
+            n = self.trap_densities(t + step)
+            c_new = c.copy()
+            for iteration in range(maximum_iterations):
+                increment, c_t_new = self.newton_step(c_new, c, c_t, n, step)
+                c_new += increment
+                error = np.abs(increment).max(axis=1) / self.c_s[:, 0]
+                if np.all(np.isfinite(error)) and error.max() < rtol:
+                    break
+            else:
+                dt /= 2
+                if dt < dt_min:
+                    raise RuntimeError("stepsize below dt_min at t = {}".format(t))
+                continue
+
+            c_t_new, _ = self.trapped(c_new, c_t, n, step)
+            c, c_t = c_new, c_t_new
+            t += step
+            if iteration < 5:
+                dt *= stepsize_change_ratio
+            else:
+                dt /= stepsize_change_ratio
+
+            if np.isclose(t, export_times[next_export], rtol=1e-12, atol=0):
+                t = export_times[next_export]
+                solute = c @ self.weights
+                traps = c_t @ self.weights
+                records.append((t, solute, traps))
+                next_export += 1
+
+        ts = np.array([record[0] for record in records])
+        solute = np.array([record[1] for record in records])
+        traps = np.array([record[2] for record in records])
+        results = []
+        for i in range(nb_cases):
+            series = {
+                "ts": ts,
+                "Total_solute_volume_1": solute[:, i],
+                "Total_retention_volume_1": solute[:, i] + traps[:, i].sum(axis=-1),
+            }
+            for j in range(len(tungsten_traps)):
+                series["Total_{}_volume_1".format(j + 1)] = traps[:, i, j]
+            results.append(series)
+        return results
+
+
+def ensemble_sim(dpa, T, total_time, cells=1000, store=None, **kwargs):
+    """Runs the (dpa, T) cases with an EnsembleModel and adds them to a store
+
+    Args:
+        dpa (array_like): the damage rates of the cases (dpa/fpy)
+        T (array_like): the temperatures of the cases (K)
+        total_time (float): the simulated time (s)
+        cells (int, optional): the number of cells. Defaults to 1000.
+        store (ResultsStore, optional): if given, the cases are appended to
+            the store. Defaults to None.
+        **kwargs: the arguments of EnsembleModel.run
+
+    Returns:
+        list of dict: the series of the cases (see EnsembleModel.run)
+    """
+    model = EnsembleModel(dpa, T, cells=cells)
+    results = model.run(total_time, **kwargs)
+    if store is not None:
+        store.append(
+            [
+                {
+                    "dpa": dpa_value,
+                    "T": T_value,
+                    "total_time": total_time,
+                    "cells": cells,
+                    "series": series,
+                }
+                for dpa_value, T_value, series in zip(model.dpa, model.T, results)
+            ]
+        )
+    return results
+
+
+if __name__ == "__main__":
+    # grid of figure 8 (with the undamaged cases)
+    dpa_values = np.concatenate([[0], np.geomspace(1e-05, 1e02, 8)])
+    T_values = np.linspace(600, 1300, 50)
+    T, dpa = np.meshgrid(T_values, dpa_values, indexing="ij")
+    ensemble_sim(
+        dpa.ravel(),
+        T.ravel(),
+        total_time=3600 * 24 * 365,
+        cells=1000,
+        store=ResultsStore("data/ensemble_model_results.h5"),
+    )
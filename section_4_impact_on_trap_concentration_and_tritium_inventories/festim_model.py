@@ -1,41 +1,847 @@
 import festim as F
-import numpy as np 
+import fenics as f
+import numpy as np
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from damage_core.export_schedule import ExportSchedule
+from damage_core.run_manifest import RunManifest
+from damage_core.trap_catalogue import tungsten_traps
 
 # diffusion parameters
 # hydrogen holtzner mulitplied by factor sqrt(3) for T
 D_0 = 2.06e-7 * (3 ** 0.5)
 E_D = 0.28
 
-# damaged trap parameters
-# defect type I
-A_0_1 = 6.1838e-03
-E_A_1 = 0.24
 
-trap_D1_K = 9.0e26
-trap_D1_n_max = 6.9e25
-trap_D2_K = 4.2e26
-trap_D2_n_max = 7.0e25
+class Simulation(F.Simulation):
+    """F.Simulation calling extra hooks before and after every time step
+
+    Args:
+        post_processing_hooks (list of callable, optional): functions called
+            with the simulation as only argument after the FESTIM exports have
+            been written. Defaults to None.
+        pre_step_hooks (list of callable, optional): functions called with
+            the simulation as only argument before each time step. Defaults
+            to None.
+    """
+
+    def __init__(
+        self, *args, post_processing_hooks=None, pre_step_hooks=None, **kwargs
+    ):
+        super().__init__(*args, **kwargs)
+        if post_processing_hooks is None:
+            post_processing_hooks = []
+        if pre_step_hooks is None:
+            pre_step_hooks = []
+        self.post_processing_hooks = post_processing_hooks
+        self.pre_step_hooks = pre_step_hooks
+
+    def iterate(self):
+        for hook in self.pre_step_hooks:
+            hook(self)
+        super().iterate()
+
+    def run_post_processing(self):
+        super().run_post_processing()
+        for hook in self.post_processing_hooks:
+            hook(self)
+
+
+class ProfileExport:
+    """Exports vertex-ordered 1D profiles of fields to a compressed .npz file,
+    replacing the ParaView "Plot over line" step on XDMF files.
+
+    The file contains the array "x" (m), the array "t" (s) of export times
+    and, for each field, an array of shape (len(t), len(x)).
+
+    Args:
+        filename (str): the .npz file
+        fields (list of str, optional): the fields to export (eg. "solute",
+            "retention", "1"). Defaults to ["retention"].
+        times (list of float, optional): the export times (s). If None, only
+            the final state is exported. Defaults to None.
+    """
+
+    def __init__(self, filename, fields=None, times=None):
+        if fields is None:
+            fields = ["retention"]
+        if times is None:
+            times = []
+        self.filename = filename
+        self.fields = fields
+        self.times = sorted(times)
+        self.next_index = 0
+        self.exported_times = []
+        self.profiles = {field: [] for field in self.fields}
+        self.x = None
+        self.V = None
+
+    def is_export(self, t, final_time):
+        """Checks if profiles have to be exported at t and marks all the export
+        times reached as done
+
+        Args:
+            t (float): the current time (s)
+            final_time (float): the final time of the simulation (s)
+
+        Returns:
+            bool: True if profiles have to be exported
+        """
+        due = False
+        while self.next_index < len(self.times) and (
+            t >= self.times[self.next_index]
+            or np.isclose(t, self.times[self.next_index], atol=0)
+        ):
+            self.next_index += 1
+            due = True
+        return due or self.is_final(t, final_time)
+
+    def is_final(self, t, final_time):
+        return t >= final_time or np.isclose(t, final_time, atol=0)
+
+    def __call__(self, simulation):
+        final_time = simulation.settings.final_time
+        if not self.is_export(simulation.t, final_time):
+            return
+        for field in self.fields:
+            self.profiles[field].append(self.vertex_values(simulation, field))
+        self.exported_times.append(simulation.t)
+        if self.is_final(simulation.t, final_time):
+            self.write()
+
+    def vertex_values(self, simulation, field):
+        """Computes the values of a field at the vertices, sorted by x"""
+        mesh = simulation.mesh.mesh
+        if self.V is None:
+            self.V = f.FunctionSpace(mesh, "CG", 1)
+            self.order = np.argsort(mesh.coordinates()[:, 0])
+            self.x = mesh.coordinates()[:, 0][self.order]
+        function = f.project(simulation.label_to_function[field], self.V)
+        return function.compute_vertex_values(mesh)[self.order]
+
+    def write(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.filename)), exist_ok=True)
+        arrays = {field: np.array(values) for field, values in self.profiles.items()}
+        np.savez_compressed(
+            self.filename, x=self.x, t=np.array(self.exported_times), **arrays
+        )
+
+
+class FieldExport(ProfileExport):
+    """Exports fields at the times of an ExportSchedule to chunked and
+    compressed HDF5 datasets (one chunk per snapshot), with an XDMF file
+    describing them so that they can be opened in ParaView.
+
+    The HDF5 file contains the dataset "x" (m), the resizable dataset "t" (s),
+    for each field a resizable dataset of shape (len(t), len(x)) and the
+    "geometry" and "topology" of the mesh for the XDMF file.
+    Snapshots are appended as they are computed.
+
+    Args:
+        filename (str): the .h5 file, the XDMF file having the same name with
+            the .xdmf extension
+        schedule (ExportSchedule): the export times
+        fields (list of str, optional): the fields to export. Defaults to
+            ["retention"].
+        dtype (str, optional): the storage type of the fields, eg. "float32"
+            to halve the file size. Defaults to "float64".
+    """
+
+    def __init__(self, filename, schedule, fields=None, dtype="float64"):
+        super().__init__(filename, fields=fields)
+        self.schedule = schedule
+        self.schedule.reset()
+        self.dtype = dtype
+        self.nb_snapshots = 0
+
+    def __call__(self, simulation):
+        if not self.schedule.is_scheduled(
+            simulation.t, simulation.settings.final_time
+        ):
+            return
+        import h5py
+
+        values = {
+            field: self.vertex_values(simulation, field) for field in self.fields
+        }
+        mode = "a" if self.nb_snapshots > 0 else "w"
+        if mode == "w":
+            folder = os.path.dirname(os.path.abspath(self.filename))
+            os.makedirs(folder, exist_ok=True)
+        with h5py.File(self.filename, mode) as h5_file:
+            if mode == "w":
+                h5_file.create_dataset("x", data=self.x)
+                # mesh of the XDMF file
+                geometry = np.zeros((len(self.x), 3))
+                geometry[:, 0] = self.x
+                h5_file.create_dataset("geometry", data=geometry)
+                vertices = np.arange(len(self.x))
+                topology = np.column_stack([vertices[:-1], vertices[1:]])
+                h5_file.create_dataset("topology", data=topology)
+                h5_file.create_dataset(
+                    "t", shape=(0,), maxshape=(None,), dtype="float64"
+                )
+                for field in self.fields:
+                    h5_file.create_dataset(
+                        field,
+                        shape=(0, len(self.x)),
+                        maxshape=(None, len(self.x)),
+                        chunks=(1, len(self.x)),
+                        dtype=self.dtype,
+                        compression="gzip",
+                        shuffle=True,
+                    )
+            h5_file["t"].resize((self.nb_snapshots + 1,))
+            h5_file["t"][-1] = simulation.t
+            for field in self.fields:
+                h5_file[field].resize((self.nb_snapshots + 1, len(self.x)))
+                h5_file[field][-1] = values[field]
+        self.nb_snapshots += 1
+        self.exported_times.append(simulation.t)
+        self.write_xdmf()
+
+    def write_xdmf(self):
+        """Writes the XDMF file (1D polyline mesh and one grid per snapshot)
+        pointing to the HDF5 datasets"""
+        h5_name = os.path.basename(self.filename)
+        nb_vertices = len(self.x)
+        precision = 4 if self.dtype == "float32" else 8
+        grids = []
+        for i, t in enumerate(self.exported_times):
+            attributes = "".join(
+                ATTRIBUTE_XDMF.format(
+                    field=field,
+                    i=i,
+                    nb_snapshots=self.nb_snapshots,
+                    nb_vertices=nb_vertices,
+                    precision=precision,
+                    h5_name=h5_name,
+                )
+                for field in self.fields
+            )
+            grids.append(
+                GRID_XDMF.format(
+                    t=t,
+                    nb_vertices=nb_vertices,
+                    nb_cells=nb_vertices - 1,
+                    h5_name=h5_name,
+                    attributes=attributes,
+                )
+            )
+        xdmf_filename = os.path.splitext(self.filename)[0] + ".xdmf"
+        with open(xdmf_filename, "w") as xdmf_file:
+            xdmf_file.write(DOCUMENT_XDMF.format(grids="".join(grids)))
+
+
+DOCUMENT_XDMF = """<?xml version="1.0"?>
+<Xdmf Version="3.0">
+  <Domain>
+    <Grid Name="TimeSeries" GridType="Collection" CollectionType="Temporal">
+{grids}    </Grid>
+  </Domain>
+</Xdmf>
+"""
+
+GRID_XDMF = """      <Grid Name="mesh" GridType="Uniform">
+        <Time Value="{t:.17g}"/>
+        <Topology TopologyType="Polyline" NodesPerElement="2" NumberOfElements="{nb_cells}">
+          <DataItem Format="HDF" Dimensions="{nb_cells} 2" NumberType="Int">{h5_name}:/topology</DataItem>
+        </Topology>
+        <Geometry GeometryType="XYZ">
+          <DataItem Format="HDF" Dimensions="{nb_vertices} 3" Precision="8">{h5_name}:/geometry</DataItem>
+        </Geometry>
+{attributes}      </Grid>
+"""
+
+ATTRIBUTE_XDMF = """        <Attribute Name="{field}" AttributeType="Scalar" Center="Node">
+          <DataItem ItemType="HyperSlab" Dimensions="1 {nb_vertices}">
+            <DataItem Dimensions="3 2" Format="XML">{i} 0 1 1 1 {nb_vertices}</DataItem>
+            <DataItem Format="HDF" Dimensions="{nb_snapshots} {nb_vertices}" Precision="{precision}">{h5_name}:/{field}</DataItem>
+          </DataItem>
+        </Attribute>
+"""
+
 
-# defect type II
-A_0_2 = 6.1838e-03
-E_A_2 = 0.30
+class ScheduledDerivedQuantities(F.DerivedQuantities):
+    """F.DerivedQuantities recorded following an ExportSchedule instead of at
+    every time step
 
-trap_D3_K = 2.5e26
-trap_D3_n_max = 6.0e25
-trap_D4_K = 5.0e26
-trap_D4_n_max = 4.7e25
+    Args:
+        schedule (ExportSchedule): the export schedule. If None, the derived
+            quantities are recorded at every time step.
+        **kwargs: the arguments of F.DerivedQuantities
 
-# defect type III
-A_0_3 = 0
-E_A_3 = 1
+    Attributes:
+        final_time (float): the final time of the simulation (s), at which a
+            row is always recorded. If None, the final time of the schedule is
+            used.
+    """
 
-trap_D5_K = 1.0e26
-trap_D5_n_max = 2.0e25
+    def __init__(self, schedule, **kwargs):
+        super().__init__(**kwargs)
+        self.schedule = schedule
+        self.final_time = None
+        if self.schedule is not None:
+            self.schedule.reset()
 
-# general trap parameters
-k_0 = 5.22e-17
-p_0 = 1e13
-trap_1_density = 2e22
+    def clear(self):
+        """Forgets the computed rows, eg. before running another case"""
+        del self.data[1:]
+        self.t = []
+        for quantity in self.derived_quantities:
+            quantity.data = []
+            quantity.t = []
+
+    def compute(self, t):
+        if self.schedule is None:
+            super().compute(t)
+            return
+        scheduled = self.schedule.is_scheduled(t, self.final_time)
+        if not scheduled and self.schedule.rtol is None:
+            # nothing is computed between scheduled times
+            return
+        super().compute(t)
+        values = self.data[-1][1:]
+        if scheduled or self.schedule.has_changed(values):
+            self.schedule.record(values)
+        else:
+            # the row is dropped from the quantities as well as from the csv
+            self.data.pop()
+            self.t.pop()
+            for quantity in self.derived_quantities:
+                quantity.data.pop()
+                quantity.t.pop()
+
+
+class ExactNeutronInducedTraps(F.Traps):
+    """F.Traps advancing the densities of the neutron induced traps with the
+    exact solution of their ODE instead of a Newton solve per trap.
+
+    With T constant over a time step, dn/dt = phi K (1 - n/n_max) - A n is
+    linear and pointwise: with a = phi K and b = phi K/n_max + A,
+    n(t + dt) = n(t) + (a - b n(t)) (1 - exp(-b dt))/b
+    which is computed at once for all the DOFs and traps.
+
+    As in the Newton solve of FESTIM, the densities are advanced after the
+    concentrations, with the current stepsize and the temperature of the
+    time step (T.T, updated from the CaseTemperature expression at the start
+    of the step).
+
+    All the extrinsic traps have to be F.NeutronInducedTrap.
+    """
+
+    def define_variational_problem_extrinsic_traps(self, dx, dt, T):
+        super().define_variational_problem_extrinsic_traps(dx, dt, T)
+        self.dt = dt
+        self.temperature = T
+
+    def solve_extrinsic_traps(self):
+        traps = [trap for trap in self.traps if isinstance(trap, F.ExtrinsicTrapBase)]
+        if len(traps) == 0:
+            return
+        for trap in traps:
+            if not isinstance(trap, F.NeutronInducedTrap):
+                raise TypeError(
+                    "ExactNeutronInducedTraps only supports F.NeutronInducedTrap"
+                )
+        V = traps[0].density[0].function_space()
+        # the temperature of the time step, not the value it was compiled with
+        T = f.interpolate(self.temperature.T, V).vector().get_local()
+        dt = float(self.dt.value)
+
+        def parameter(name):
+            return np.array([[float(getattr(trap, name))] for trap in traps])
+
+        phi, K, n_max = parameter("phi"), parameter("K"), parameter("n_max")
+        A = parameter("A_0") * np.exp(-parameter("E_A") / F.k_B / T)
+        a = phi * K
+        b = phi * K / n_max + A
+        # (1 - exp(-b dt))/b, tending to dt when b tends to 0
+        safe_b = np.where(b > 0, b, 1)
+        factor = np.where(b > 0, -np.expm1(-b * dt) / safe_b, dt)
+
+        n = np.array(
+            [trap.density_previous_solution.vector().get_local() for trap in traps]
+        )
+        n += (a - b * n) * factor
+        for trap, values in zip(traps, n):
+            trap.density[0].vector().set_local(values)
+            trap.density[0].vector().apply("insert")
+
+
+class PulseStepsize(F.Stepsize):
+    """F.Stepsize restarting from edge_stepsize after each edge of a
+    scenario. The steps land exactly on the edges and the stepsize then grows
+    by plateau_change_ratio per converged step over the plateau.
+
+    The edges are not milestones of F.Stepsize, whose next_milestone is a
+    linear scan: only the next edge, found by bisection, limits the step.
+
+    Args:
+        *args, **kwargs: the arguments of F.Stepsize
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.edges = np.array([])
+        self.edge_stepsize = None
+        self.plateau_change_ratio = 1.2
+
+    def adapt(self, t, nb_it, converged):
+        super().adapt(t, nb_it, converged)
+        if self.edge_stepsize is None or len(self.edges) == 0:
+            return
+        # the edges at or before t (up to round-off)
+        i = np.searchsorted(self.edges, t * (1 + 1e-12), side="right")
+        if converged:
+            if i > 0 and np.isclose(t, self.edges[i - 1], rtol=1e-12, atol=0):
+                self.value.assign(self.edge_stepsize)
+            elif nb_it < 5:
+                # the growth of F.Stepsize is replaced by plateau_change_ratio
+                ratio = self.adaptive_stepsize["stepsize_change_ratio"]
+                self.value.assign(
+                    float(self.value) / ratio * self.plateau_change_ratio
+                )
+        value = float(self.value)
+        if i < len(self.edges):
+            value = min(value, self.edges[i] - t)
+        next_milestone = self.next_milestone(t)
+        if next_milestone is not None and not np.isclose(t, next_milestone):
+            value = min(value, next_milestone - t)
+        self.value.assign(value)
+
+
+class ScenarioUpdate:
+    """Pre-step hook setting the damage rate and the temperature of a
+    FestimModel to the values of a Scenario at the middle of the coming step
+
+    Args:
+        model (FestimModel): the model
+        scenario (Scenario): the scenario
+    """
+
+    def __init__(self, model, scenario):
+        self.model = model
+        self.scenario = scenario
+
+    def __call__(self, simulation):
+        t = simulation.t + float(simulation.dt.value) / 2
+        self.model.update_case(
+            self.scenario.damage_rate(t), self.scenario.temperature(t)
+        )
+
+
+class CycleAcceleration:
+    """Pre-step hook accelerating periodic scenarios: after
+    nb_resolved_cycles resolved cycles, the fields jump over nb_skipped_cycles
+    cycles, extrapolated with their change over the last resolved cycle. This
+    assumes that the slow evolution from one cycle to the next is close to
+    linear over nb_skipped_cycles cycles.
+
+    Args:
+        model (FestimModel): the model
+        period (float): the period of the scenario (s)
+        nb_resolved_cycles (int, optional): the number of cycles resolved
+            between two jumps. Defaults to 2.
+        nb_skipped_cycles (int, optional): the number of cycles skipped at
+            each jump. Defaults to 10.
+    """
+
+    def __init__(self, model, period, nb_resolved_cycles=2, nb_skipped_cycles=10):
+        if period is None:
+            raise ValueError("cycle acceleration needs a periodic scenario")
+        self.model = model
+        self.period = period
+        self.nb_resolved_cycles = nb_resolved_cycles
+        self.nb_skipped_cycles = nb_skipped_cycles
+        self.states = []
+        self.last_cycle = None
+        self.nb_skipped_total = 0
+
+    def __call__(self, simulation):
+        t = simulation.t
+        cycle = int(round(t / self.period))
+        if cycle == self.last_cycle or not np.isclose(
+            t, cycle * self.period, rtol=1e-9, atol=0
+        ):
+            return
+        self.last_cycle = cycle
+        self.states.append(self.model.state())
+        if len(self.states) <= self.nb_resolved_cycles:
+            return
+
+        # at least one cycle is resolved before the final time
+        remaining = int((simulation.settings.final_time - t) // self.period) - 1
+        nb_skipped = min(self.nb_skipped_cycles, remaining)
+        if nb_skipped > 0:
+            state = [
+                np.maximum(new + nb_skipped * (new - old), 0)
+                for new, old in zip(self.states[-1], self.states[-2])
+            ]
+            self.model.set_state(state)
+            simulation.t = t + nb_skipped * self.period
+            self.last_cycle = cycle + nb_skipped
+            self.nb_skipped_total += nb_skipped
+        self.states = [self.model.state()]
+
+
+class CaseTemperature(F.Temperature):
+    """Uniform F.Temperature whose value is the parameter T_case of the fenics
+    Expression, so that it can be changed without recompiling the forms.
+
+    F.Temperature.update re-interpolates the expression at every time step:
+    the value of a case has to be set in the expression (see set_value), the
+    temperature functions being otherwise overwritten at the first step.
+
+    Args:
+        value (float): the temperature in K
+    """
+
+    def create_functions(self, mesh):
+        V = f.FunctionSpace(mesh.mesh, "CG", 1)
+        self.T = f.Function(V, name="T")
+        self.T_n = f.Function(V, name="T_n")
+        self.expression = f.Expression(
+            "T_case", T_case=float(self.value), t=0, degree=0
+        )
+        self.set_value(self.value)
+
+    def set_value(self, value):
+        """Sets the temperature of the expression and of the functions
+
+        Args:
+            value (float): the temperature in K
+        """
+        self.value = value
+        self.expression.T_case = float(value)
+        self.T.vector()[:] = value
+        self.T_n.vector()[:] = value
+
+
+class FestimModel:
+    """Model of a 2 mm tungsten sample exposed to tritium implantation and
+    neutron damage, built and compiled once and run for several (dpa, T)
+    cases.
+
+    The damage rate is a fenics Constant shared by the neutron induced traps
+    and the temperature is a parameter of the CaseTemperature expression, so
+    that changing the case does not rebuild the variational forms and FFC does
+    not recompile them. The fields are reset to zero before each run.
+
+    Args:
+        cells (int, optional): the number of cells in the mesh. Defaults to
+            1000.
+        export_retention_field (bool, optional): if True, the retention field
+            is exported to XDMF at every time step. Defaults to False.
+        results_folder_name (str, optional): the results folder used until the
+            first run. Defaults to "Results/".
+        exact_trap_update (bool, optional): if True, the densities of the
+            neutron induced traps are advanced with ExactNeutronInducedTraps
+            instead of being solved with Newton. Defaults to False.
+    """
+
+    def __init__(
+        self,
+        cells=1000,
+        export_retention_field=False,
+        results_folder_name="Results/",
+        exact_trap_update=False,
+    ):
+        self.cells = cells
+        self.export_retention_field = export_retention_field
+        self.phi = f.Constant(0.0)
+        self.initial_stepsize = 0.1
+
+        my_model = Simulation(log_level=40)
+
+        # define materials
+        tungsten = F.Material(D_0=D_0, E_D=E_D, id=1)
+        my_model.materials = F.Materials([tungsten])
+
+        # define traps
+        defined_absolute_tolerance = 1e07
+        defined_relative_tolerance = 1e-01
+        defined_maximum_iterations = 10
+
+        intrinsic_traps = tungsten_traps[tungsten_traps.K == 0]
+        damage_traps = tungsten_traps[tungsten_traps.K > 0]
+        traps = []
+        for i in range(len(intrinsic_traps)):
+            trap = F.Trap(
+                k_0=intrinsic_traps.k_0[i],
+                E_k=intrinsic_traps.E_k[i],
+                p_0=intrinsic_traps.p_0[i],
+                E_p=intrinsic_traps.E_p[i],
+                density=intrinsic_traps.density[i],
+                materials=tungsten,
+            )
+            traps.append(trap)
+        self.damage_traps = []
+        for i in range(len(damage_traps)):
+            trap = F.NeutronInducedTrap(
+                k_0=damage_traps.k_0[i],
+                E_k=damage_traps.E_k[i],
+                p_0=damage_traps.p_0[i],
+                E_p=damage_traps.E_p[i],
+                A_0=damage_traps.A_0[i],
+                E_A=damage_traps.E_A[i],
+                phi=0.0,
+                K=damage_traps.K[i],
+                n_max=damage_traps.n_max[i],
+                materials=tungsten,
+                absolute_tolerance=defined_absolute_tolerance,
+                relative_tolerance=defined_relative_tolerance,
+                maximum_iterations=defined_maximum_iterations,
+            )
+            # all the damage traps share the same updatable damage rate
+            trap.phi = self.phi
+            self.damage_traps.append(trap)
+
+        if exact_trap_update:
+            my_model.traps = ExactNeutronInducedTraps(traps + self.damage_traps)
+        else:
+            my_model.traps = F.Traps(traps + self.damage_traps)
+
+        vertices = np.linspace(0, 2e-03, num=cells)
+        my_model.mesh = F.MeshFromVertices(vertices)
+
+        # define temperature
+        my_model.T = CaseTemperature(value=761)
+
+        # define boundary conditions
+        my_model.boundary_conditions = [
+            F.ImplantationDirichlet(
+                surfaces=1,
+                phi=1e20,
+                R_p=3e-09,
+                D_0=D_0,
+                E_D=E_D,
+            ),
+        ]
+
+        # define exports
+        self.derived_quantities = ScheduledDerivedQuantities(
+            None, filename=results_folder_name + "derived_quantities.csv"
+        )
+        self.derived_quantities.derived_quantities = [
+            F.TotalVolume("solute", volume=1),
+            F.TotalVolume("retention", volume=1),
+            F.TotalVolume("1", volume=1),
+            F.TotalVolume("2", volume=1),
+            F.TotalVolume("3", volume=1),
+            F.TotalVolume("4", volume=1),
+            F.TotalVolume("5", volume=1),
+            F.TotalVolume("6", volume=1),
+        ]
+        exports = [self.derived_quantities]
+        self.retention_export = None
+        if export_retention_field:
+            self.retention_export = F.XDMFExport(
+                "retention",
+                label="retention",
+                folder=results_folder_name,
+                checkpoint=False,
+                mode=1,
+            )
+            exports.insert(0, self.retention_export)
+        my_model.exports = F.Exports(exports)
+
+        # define settings
+        my_model.dt = PulseStepsize(
+            initial_value=self.initial_stepsize,
+            stepsize_change_ratio=1.01,
+            dt_min=1e-1,
+        )
+        my_model.dt.edge_stepsize = self.initial_stepsize
+        my_model.settings = F.Settings(
+            transient=True,
+            final_time=100,
+            absolute_tolerance=1e10,
+            relative_tolerance=1e-10,
+            maximum_iterations=30,
+        )
+
+        # the forms are built (and compiled) here only
+        my_model.initialise()
+        self.simulation = my_model
+
+    def set_case(self, dpa, T):
+        """Updates the damage rate and the temperature in place
+
+        Args:
+            dpa (float): the damage rate in dpa/fpy
+            T (float): the temperature in K
+        """
+        fpy = 3600 * 24 * 365.25
+        self.phi.assign(dpa / fpy)
+        self.simulation.T.set_value(T)
+
+    def update_case(self, dpa, T):
+        """Changes the damage rate and the temperature from the coming time
+        step on, the temperature functions being updated by FESTIM at the
+        start of the step (T_n keeping the temperature of the previous step)
+
+        Args:
+            dpa (float): the damage rate in dpa/fpy
+            T (float): the temperature in K
+        """
+        fpy = 3600 * 24 * 365.25
+        self.phi.assign(dpa / fpy)
+        self.simulation.T.value = T
+        self.simulation.T.expression.T_case = float(T)
+
+    def state(self):
+        """Copies the concentration and trap density fields
+
+        Returns:
+            list of numpy.array: the DOF values of the concentrations and of
+                the damage trap densities
+        """
+        problem = self.simulation.h_transport_problem
+        return [problem.u.vector().get_local()] + [
+            trap.density[0].vector().get_local() for trap in self.damage_traps
+        ]
+
+    def set_state(self, state):
+        """Sets the current and previous concentration and trap density
+        fields
+
+        Args:
+            state (list of numpy.array): see FestimModel.state()
+        """
+        problem = self.simulation.h_transport_problem
+        problem.u.vector()[:] = state[0]
+        problem.u_n.vector()[:] = state[0]
+        for trap, values in zip(self.damage_traps, state[1:]):
+            trap.density[0].vector()[:] = values
+            trap.density_previous_solution.vector()[:] = values
+
+    def reset(self):
+        """Resets the time, the stepsize and the concentration and trap
+        density fields to their initial (zero) values"""
+        self.simulation.t = 0
+        self.simulation.dt.value.assign(self.initial_stepsize)
+        problem = self.simulation.h_transport_problem
+        problem.u.vector()[:] = 0
+        problem.u_n.vector()[:] = 0
+        for trap in self.damage_traps:
+            trap.density[0].vector()[:] = 0
+            trap.density_previous_solution.vector()[:] = 0
+
+    def run(
+        self,
+        dpa,
+        T,
+        results_folder_name="Results/",
+        total_time=100,
+        profile_fields=None,
+        profile_times=None,
+        export_schedule=None,
+        field_fields=None,
+        field_schedule=None,
+        field_dtype="float64",
+        scenario=None,
+        nb_skipped_cycles=0,
+        nb_resolved_cycles=2,
+    ):
+        """Runs a case from the initial state
+
+        Args:
+            dpa (float): the damage rate in dpa/fpy
+            T (float): the temperature in K
+            results_folder_name (str, optional): the results folder location.
+                Defaults to "Results/".
+            total_time (float, optional): the simulated time in s. Defaults to
+                100.
+            profile_fields (list of str, optional): see festim_sim. Defaults
+                to None.
+            profile_times (list of float, optional): see festim_sim. Defaults
+                to None.
+            export_schedule (ExportSchedule, optional): see festim_sim.
+                Defaults to None.
+            field_fields (list of str, optional): the fields exported to
+                fields.h5 in the results folder following field_schedule (see
+                FieldExport). Defaults to None.
+            field_schedule (ExportSchedule, optional): the export times of
+                the fields. Defaults to None.
+            field_dtype (str, optional): the storage type of the fields.
+                Defaults to "float64".
+            scenario (Scenario, optional): if given, the damage rate and the
+                temperature follow the scenario instead of dpa and T. Defaults
+                to None.
+            nb_skipped_cycles (int, optional): the number of cycles of a
+                periodic scenario skipped by CycleAcceleration, 0 to resolve
+                all the cycles. Defaults to 0.
+            nb_resolved_cycles (int, optional): the number of cycles resolved
+                between two jumps of CycleAcceleration. Defaults to 2.
+        """
+        if scenario is not None:
+            dpa, T = scenario.damage_rate(0), scenario.temperature(0)
+        self.set_case(dpa, T)
+        self.reset()
+
+        hooks = []
+        if profile_fields is not None:
+            hooks.append(
+                ProfileExport(
+                    filename=results_folder_name + "profiles.npz",
+                    fields=profile_fields,
+                    times=profile_times,
+                )
+            )
+        if field_fields is not None:
+            hooks.append(
+                FieldExport(
+                    filename=results_folder_name + "fields.h5",
+                    schedule=field_schedule,
+                    fields=field_fields,
+                    dtype=field_dtype,
+                )
+            )
+        self.simulation.post_processing_hooks = hooks
+        if profile_times is None:
+            profile_times = []
+        milestones = list(profile_times)
+
+        pre_step_hooks = []
+        self.simulation.dt.edges = np.array([])
+        if scenario is not None:
+            if nb_skipped_cycles > 0:
+                pre_step_hooks.append(
+                    CycleAcceleration(
+                        self,
+                        scenario.period,
+                        nb_resolved_cycles=nb_resolved_cycles,
+                        nb_skipped_cycles=nb_skipped_cycles,
+                    )
+                )
+            pre_step_hooks.append(ScenarioUpdate(self, scenario))
+            # the steps land on the edges of the scenario (see PulseStepsize)
+            self.simulation.dt.edges = scenario.edges(total_time)
+        self.simulation.pre_step_hooks = pre_step_hooks
+        self.simulation.dt.milestones = sorted(milestones)
+        self.simulation.settings.final_time = total_time
+
+        # redirect the exports to the results folder of the case
+        self.derived_quantities.filename = (
+            results_folder_name + "derived_quantities.csv"
+        )
+        self.derived_quantities.clear()
+        self.derived_quantities.final_time = total_time
+        self.derived_quantities.schedule = export_schedule
+        if export_schedule is not None:
+            export_schedule.reset()
+        if self.retention_export is not None:
+            self.retention_export.folder = results_folder_name
+            self.retention_export.define_xdmf_file()
+
+        self.simulation.run()
+
+
+# models already compiled, by (cells, XDMF export, exact_trap_update)
+compiled_models = {}
 
 
 def festim_sim(
@@ -45,179 +851,100 @@ def festim_sim(
     total_time=100,
     cells=1000,
     export_retention_field=False,
+    profile_fields=None,
+    profile_times=None,
+    export_schedule=None,
+    reuse_model=False,
+    exact_trap_update=False,
+    field_schedule=None,
+    field_dtype="float64",
+    scenario=None,
+    nb_skipped_cycles=0,
 ):
-    my_model = F.Simulation(log_level=40)
-
-    # define materials
-    tungsten = F.Material(D_0=D_0, E_D=E_D, id=1)
-    my_model.materials = F.Materials([tungsten])
-
-    # define traps
-    fpy = 3600 * 24 * 365.25
-    defined_absolute_tolerance = 1e07
-    defined_relative_tolerance = 1e-01
-    defined_maximum_iterations = 10
-
-    trap_W_1 = F.Trap(
-        k_0=k_0,
-        E_k=E_D,
-        p_0=p_0,
-        E_p=1.0,
-        density=2e22,
-        materials=tungsten,
-    )
-    trap_W_damage_1 = F.NeutronInducedTrap(
-        k_0=k_0,
-        E_k=E_D,
-        p_0=p_0,
-        E_p=1.15,
-        A_0=A_0_1,
-        E_A=E_A_1,
-        phi=dpa / fpy,
-        K=trap_D1_K,
-        n_max=trap_D1_n_max,
-        materials=tungsten,
-        absolute_tolerance=defined_absolute_tolerance,
-        relative_tolerance=defined_relative_tolerance,
-        maximum_iterations=defined_maximum_iterations,
-    )
-    trap_W_damage_2 = F.NeutronInducedTrap(
-        k_0=k_0,
-        E_k=E_D,
-        p_0=p_0,
-        E_p=1.35,
-        A_0=A_0_1,
-        E_A=E_A_1,
-        phi=dpa / fpy,
-        K=trap_D2_K,
-        n_max=trap_D2_n_max,
-        materials=tungsten,
-        absolute_tolerance=defined_absolute_tolerance,
-        relative_tolerance=defined_relative_tolerance,
-        maximum_iterations=defined_maximum_iterations,
-    )
-    trap_W_damage_3 = F.NeutronInducedTrap(
-        k_0=k_0,
-        E_k=E_D,
-        p_0=p_0,
-        E_p=1.65,
-        A_0=A_0_2,
-        E_A=E_A_2,
-        phi=dpa / fpy,
-        K=trap_D3_K,
-        n_max=trap_D3_n_max,
-        materials=tungsten,
-        absolute_tolerance=defined_absolute_tolerance,
-        relative_tolerance=defined_relative_tolerance,
-        maximum_iterations=defined_maximum_iterations,
-    )
-    trap_W_damage_4 = F.NeutronInducedTrap(
-        k_0=k_0,
-        E_k=E_D,
-        p_0=p_0,
-        E_p=1.85,
-        A_0=A_0_2,
-        E_A=E_A_2,
-        phi=dpa / fpy,
-        K=trap_D4_K,
-        n_max=trap_D4_n_max,
-        materials=tungsten,
-        absolute_tolerance=defined_absolute_tolerance,
-        relative_tolerance=defined_relative_tolerance,
-        maximum_iterations=defined_maximum_iterations,
-    )
-    trap_W_damage_5 = F.NeutronInducedTrap(
-        k_0=k_0,
-        E_k=E_D,
-        p_0=p_0,
-        E_p=2.05,
-        A_0=A_0_3,
-        E_A=E_A_3,
-        phi=dpa / fpy,
-        K=trap_D5_K,
-        n_max=trap_D5_n_max,
-        materials=tungsten,
-        absolute_tolerance=defined_absolute_tolerance,
-        relative_tolerance=defined_relative_tolerance,
-        maximum_iterations=defined_maximum_iterations,
-    )
+    """Runs the FESTIM simulation of a 2 mm tungsten sample exposed to
+    tritium implantation and neutron damage
 
-    my_model.traps = F.Traps(
-        [
-            trap_W_1,
-            trap_W_damage_1,
-            trap_W_damage_2,
-            trap_W_damage_3,
-            trap_W_damage_4,
-            trap_W_damage_5,
-        ]
-    )
-
-    vertices = np.linspace(0, 2e-03, num=cells)
-    my_model.mesh = F.MeshFromVertices(vertices)
-
-    # define temperature
-    my_model.T = F.Temperature(value=T)
-
-    # define boundary conditions
-    my_model.boundary_conditions = [
-        F.ImplantationDirichlet(
-            surfaces=1,
-            phi=1e20,
-            R_p=3e-09,
-            D_0=D_0,
-            E_D=E_D,
-        ),
-    ]
-
-    # define exports
-    results_folder = results_folder_name
-    my_derived_quantities = F.DerivedQuantities(
-        filename=results_folder + "derived_quantities.csv"
+    Args:
+        dpa (float): the damage rate in dpa/fpy
+        T (float): the temperature in K
+        results_folder_name (str): the results folder location
+        total_time (float): the simulated time in s
+        cells (int): the number of cells in the mesh
+        export_retention_field (bool): if True, the retention field is exported
+            to XDMF at every time step, or to fields.h5 at the times of
+            field_schedule if given
+        profile_fields (list of str, optional): if given, the 1D profiles of
+            these fields are exported to profiles.npz in the results folder.
+            Defaults to None.
+        profile_times (list of float, optional): the times at which profiles
+            are exported, the final time being always included. Defaults to
+            None.
+        export_schedule (ExportSchedule, optional): the times at which the
+            derived quantities are recorded. If None, they are recorded at
+            every time step. Defaults to None.
+        reuse_model (bool, optional): if True, the FestimModel compiled by a
+            previous call with the same cells, export_retention_field and
+            exact_trap_update is reused instead of building a new one.
+            Defaults to False.
+        exact_trap_update (bool, optional): if True, the densities of the
+            neutron induced traps are advanced with their exact per-step
+            solution (see ExactNeutronInducedTraps). Defaults to False.
+        field_schedule (ExportSchedule, optional): if given, the retention
+            field is only exported at these times, to chunked and compressed
+            HDF5 datasets (see FieldExport). Defaults to None.
+        field_dtype (str, optional): the storage type of the exported fields
+            with field_schedule, eg. "float32". Defaults to "float64".
+        scenario (Scenario, optional): if given, the pulsed or tabulated
+            history of the damage rate and temperature, dpa and T being
+            ignored. Defaults to None.
+        nb_skipped_cycles (int, optional): if larger than 0, the cycles of a
+            periodic scenario are accelerated by CycleAcceleration, skipping
+            this number of cycles every 2 resolved cycles. Defaults to 0.
+    """
+    inputs = dict(
+        dpa=dpa,
+        T=T,
+        total_time=total_time,
+        cells=cells,
+        export_retention_field=export_retention_field,
+        exact_trap_update=exact_trap_update,
     )
-    my_derived_quantities.derived_quantities = [
-        F.TotalVolume("solute", volume=1),
-        F.TotalVolume("retention", volume=1),
-        F.TotalVolume("1", volume=1),
-        F.TotalVolume("2", volume=1),
-        F.TotalVolume("3", volume=1),
-        F.TotalVolume("4", volume=1),
-        F.TotalVolume("5", volume=1),
-        F.TotalVolume("6", volume=1),
-    ]
-
-   
-    if export_retention_field:
-        my_model.exports = F.Exports(
-            [
-                F.XDMFExport(
-                    "retention",
-                    label="retention",
-                    folder=results_folder,
-                    checkpoint=False,
-                    mode=1,
-                ),
-                my_derived_quantities,
-            ]
+    if scenario is not None:
+        inputs["scenario"] = scenario.description()
+        inputs["nb_skipped_cycles"] = nb_skipped_cycles
+        dpa = scenario.damage_rate(0)
+        T = scenario.temperature(0)
+    xdmf_export = export_retention_field and field_schedule is None
+    field_fields = None
+    if export_retention_field and field_schedule is not None:
+        field_fields = ["retention"]
+    # the run is described in manifest.json
+    with RunManifest(results_folder_name + "manifest.json", inputs) as manifest:
+        key = (cells, xdmf_export, exact_trap_update)
+        manifest.data["reused_model"] = reuse_model and key in compiled_models
+        if manifest.data["reused_model"]:
+            model = compiled_models[key]
+        else:
+            model = FestimModel(
+                cells=cells,
+                export_retention_field=xdmf_export,
+                results_folder_name=results_folder_name,
+                exact_trap_update=exact_trap_update,
+            )
+            if reuse_model:
+                compiled_models[key] = model
+        manifest.watch_simulation(model.simulation)
+        model.run(
+            dpa,
+            T,
+            results_folder_name=results_folder_name,
+            total_time=total_time,
+            profile_fields=profile_fields,
+            profile_times=profile_times,
+            export_schedule=export_schedule,
+            field_fields=field_fields,
+            field_schedule=field_schedule,
+            field_dtype=field_dtype,
+            scenario=scenario,
+            nb_skipped_cycles=nb_skipped_cycles,
         )
-    else:
-        my_model.exports = F.Exports([my_derived_quantities])
-    
-
-    # define settings
-    my_model.dt = F.Stepsize(
-        initial_value=0.1,
-        stepsize_change_ratio=1.01,
-        dt_min=1e-1,
-    )
-    my_model.settings = F.Settings(
-        transient=True,
-        final_time=total_time,
-        absolute_tolerance=1e10,
-        relative_tolerance=1e-10,
-        maximum_iterations=30,
-    )
-
-    # vrun simulation
-    my_model.initialise()
-    my_model.run()
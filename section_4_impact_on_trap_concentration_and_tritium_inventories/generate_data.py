@@ -1,124 +1,384 @@
-from festim_model import festim_sim
 import numpy as np
-import festim as F
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from adaptive_sampling import refinement_candidates
+from damage_core.cell_cache import CellCache
+from damage_core.constants import k_B
+from damage_core.export_schedule import ExportSchedule
+from damage_core.job_scheduling import CostModel, run_jobs
+from damage_core.pipeline import Pipeline
+from damage_core.results_store import ResultsStore, read_derived_quantities
+from damage_core.work_queue import WorkQueue
 
 # common values
-k_B = F.k_B  # eV K-1
 fpy = 3600 * 24 * 365
 day = 3600 * 24
 
-def generate_fig_7_inventory_transient_and_distribution():
-    
+# derived quantities of the 1 fpy runs are recorded on a log-spaced time grid
+fpy_export_schedule = ExportSchedule.log_spaced(fpy, nb_times=200)
+# and the retention field at fewer times, in single precision
+fpy_field_schedule = ExportSchedule.log_spaced(fpy, nb_times=20)
+
+results_store = ResultsStore("data/festim_model_results.h5")
+# number of cells found by mesh_convergence.py
+cell_cache = CellCache("data/mesh_convergence_cells.json")
+# simulations already run with the same inputs and model are skipped
+pipeline = Pipeline("data/pipeline.json")
+folder = os.path.dirname(os.path.abspath(__file__))
+model_files = [
+    os.path.join(folder, "festim_model.py"),
+    os.path.join(folder, "..", "damage_core", "trap_catalogue.py"),
+]
+
+
+def run_case(
+    dpa,
+    T,
+    results_folder_name,
+    total_time,
+    cells,
+    store=None,
+    cell_cache=None,
+    **kwargs
+):
+    """Runs festim_sim, increasing the number of cells by 50% (up to 15 times)
+    if the simulation fails, and adds the results to the store. The compiled
+    models are reused from one case to the next.
+
+    Args:
+        dpa (float): the damage rate in dpa/fpy
+        T (float): the temperature in K
+        results_folder_name (str): the results folder location
+        total_time (float): the simulated time in s
+        cells (int): the initial number of cells
+        store (ResultsStore, optional): if given, the derived quantities are
+            appended to the store with the exact values of dpa and T.
+            Defaults to None.
+        cell_cache (CellCache, optional): if it has converged meshes around
+            (T, dpa), the initial number of cells is taken from it instead of
+            cells. Defaults to None.
+        **kwargs: other arguments of festim_sim
+
+    Returns:
+        int: the number of cells of the successful run, None if all the runs
+            failed
+    """
+    # FESTIM is only imported by the processes running simulations
+    from festim_model import festim_sim
+
+    n = cells
+    if cell_cache is not None and cell_cache.lookup(T, dpa) is not None:
+        n = cell_cache.lookup(T, dpa)
+    for _ in range(15):
+        try:
+            print("running case T = {:.0f}, dpa = {:.1e}, n = {}".format(T, dpa, n))
+            festim_sim(
+                dpa=dpa,
+                T=T,
+                results_folder_name=results_folder_name,
+                total_time=total_time,
+                cells=n,
+                reuse_model=True,
+                **kwargs
+            )
+            break
+        except Exception as e:
+            n *= 1.5
+            n = int(n)
+            print("increasing n to {}".format(n))
+    else:
+        print("case T = {:.0f}, dpa = {:.1e} failed".format(T, dpa))
+        return None
+
+    if store is not None:
+        series = read_derived_quantities(results_folder_name + "derived_quantities.csv")
+        store.append(
+            [
+                {
+                    "dpa": dpa,
+                    "T": T,
+                    "total_time": total_time,
+                    "cells": n,
+                    "series": series,
+                }
+            ]
+        )
+    return n
+
+
+def add_case(job):
+    """Adds a run_case job to the pipeline
+
+    Args:
+        job (dict): the arguments of run_case
+
+    Returns:
+        str: the hash of the pipeline node
+    """
+    return pipeline.add(
+        run_case,
+        job,
+        outputs=[job["results_folder_name"] + "derived_quantities.csv"],
+        code=model_files,
+        parallel=True,
+        name="case T = {:.0f}, dpa = {:.1e}, {:.0f} s".format(
+            job["T"], job["dpa"], job["total_time"]
+        ),
+    )
+
+
+def fig_7_jobs():
+    """Arguments of run_case for the cases of figure 7. The full power year
+    cases are the T = 700 K cases of figure 8.
+
+    Returns:
+        list of dict: the arguments of run_case
+    """
     dpa_values = np.geomspace(1e-05, 1e02, 8)
     T = 700
-    
-    for dpa in dpa_values:
-        n = 1000 # starting value
-        for _ in range(15):
-            try:
-                print("running case T = {:.0f}, dpa = {:.1e}, n = {}".format(T, dpa, n))
-                
-                my_folder_name = "data/festim_model_results/dpa={:.1e}/T={:.0f}/".format(dpa, T)
-                
-                festim_sim(
-                    dpa=dpa,
-                    T=T,
-                    results_folder_name=my_folder_name,
-                    total_time=fpy,
-                    cells=n,
-                    export_retention_field=False
-                )
-                break
-            except Exception as e:
-                n *= 1.5
-                n = int(n)
-                print("increasing n to {}".format(n))
+
+    jobs = [fig_8_job(dpa, T) for dpa in dpa_values]
     # undamaged case
-    festim_sim(
-        dpa=0,
-        T=T,
-        results_folder_name="data/festim_model_results/dpa=0.0e+00/T={:.0f}/".format(T),
-        total_time=fpy,
-        cells=1000,
-        export_retention_field=True
-    )
-    
+    jobs.append(fig_8_job(0, T))
+
     # profiles
     for dpa in dpa_values:
-        n = 5000 # starting value
-        for _ in range(15):
-            try:
-                print("running case dpa = {:.1e}, n = {}".format(dpa, n))
-                
-                my_folder_name = "data/profiles/data/dpa={:.1e}/".format(dpa)
-                
-                festim_sim(
-                    dpa=dpa,
-                    T=700,
-                    results_folder_name=my_folder_name,
-                    total_time=day,
-                    cells=n,
-                    export_retention_field=True
-                )
-                break
-            except Exception as e:
-                n *= 1.5
-                n = int(n)
-                print("increasing n to {}".format(n))
-    
+        jobs.append(
+            dict(
+                dpa=dpa,
+                T=700,
+                results_folder_name="data/profiles/dpa={:.1e}/".format(dpa),
+                total_time=day,
+                cells=5000,
+                profile_fields=["retention"],
+            )
+        )
+
     # undamaged case
-    festim_sim(
-        dpa=0,
-        T=700,
-        results_folder_name="data/festim_model_results/dpa=0.0e+00/T={:.0f}/".format(T),
-        total_time=day,
-        cells=1000,
-        export_retention_field=True
+    jobs.append(
+        dict(
+            dpa=0,
+            T=700,
+            results_folder_name="data/profiles/dpa=0.0e+00/",
+            total_time=day,
+            cells=1000,
+            profile_fields=["retention"],
+        )
     )
+    return jobs
 
 
-def generate_fig_8_inventory_variataion():
-    
-    dpa_values = np.geomspace(1e-05, 1e02, 8)
-    T_values = np.linspace(600, 1300, 50)
+def generate_fig_7_inventory_transient_and_distribution(max_workers=None, queue=None):
+    """Runs the cases of figure 7
 
-    for T in T_values:    
-        for dpa in dpa_values:
-            n = 5000 # starting value
-            for _ in range(15):
-                try:
-                    print("running case T = {:.0f}, dpa = {:.1e}, n = {}".format(T, dpa, n))
-                    
-                    my_folder_name = "data/festim_model_results/dpa={:.1e}/T={:.0f}/".format(dpa, T)
-                    
-                    festim_sim(
-                        dpa=dpa,
-                        T=T,
-                        results_folder_name=my_folder_name,
-                        total_time=fpy,
-                        cells=n,
-                        export_retention_field=True
-                    )
-                    break
-                except Exception as e:
-                    n *= 1.5
-                    n = int(n)
-                    print("increasing n to {}".format(n))
+    Args:
+        max_workers (int, optional): the number of processes. Defaults to the
+            number of CPUs.
+        queue (WorkQueue, optional): if given, the cases are submitted to the
+            queue instead (see run_pipeline). Defaults to None.
+    """
+    for job in fig_7_jobs():
+        add_case(job)
+    run_pipeline(max_workers, queue)
+
+
+def fig_8_job(dpa, T):
+    """Arguments of run_case for a case of figure 8
+
+    Args:
+        dpa (float): the damage rate in dpa/fpy
+        T (float): the temperature in K
 
+    Returns:
+        dict: the arguments of run_case
+    """
+    if dpa == 0:
         # undamaged case
-        print("running case T = {:.0f}, dpa = 0.0e+00".format(T))
-        my_folder_name = "data/festim_model_results/dpa=0.0e+00/T={:.0f}/".format(T)
-        festim_sim(
+        return dict(
             dpa=0,
             T=T,
-            results_folder_name=my_folder_name,
+            results_folder_name="data/festim_model_results/dpa=0.0e+00/T={:.0f}/".format(T),
             total_time=fpy,
+            export_schedule=fpy_export_schedule,
             cells=1000,
-            export_retention_field=False
+            store=results_store,
+            cell_cache=cell_cache,
+            export_retention_field=True,
+            field_schedule=fpy_field_schedule,
+            field_dtype="float32",
         )
+    return dict(
+        dpa=dpa,
+        T=T,
+        results_folder_name="data/festim_model_results/dpa={:.1e}/T={:.0f}/".format(dpa, T),
+        total_time=fpy,
+        export_schedule=fpy_export_schedule,
+        cells=5000,
+        store=results_store,
+        cell_cache=cell_cache,
+        export_retention_field=True,
+        field_schedule=fpy_field_schedule,
+        field_dtype="float32",
+    )
+
+
+def fig_8_jobs():
+    """Arguments of run_case for the coarse initial grid of figure 8, refined
+    by fig_8_adaptive_jobs. The T = 700 K cases are the full power year cases
+    of figure 7.
+
+    Returns:
+        list of dict: the arguments of run_case
+    """
+    dpa_values = np.geomspace(1e-05, 1e02, 8)
+    T_values = np.linspace(600, 1300, 8)
+
+    jobs = []
+    for T in T_values:
+        for dpa in dpa_values:
+            jobs.append(fig_8_job(dpa, T))
+
+        # undamaged case
+        jobs.append(fig_8_job(0, T))
+    return jobs
+
+
+def fig_8_inventories(jobs):
+    """Reads the final inventories of cases of figure 8 from the results
+    store
+
+    Args:
+        jobs (list of dict): the arguments of run_case of the cases
+
+    Returns:
+        numpy.array: the final inventories (m-2), nan for the cases which
+            are not in the store
+    """
+    inventories = np.full(len(jobs), np.nan)
+    if not results_store.exists():
+        return inventories
+    cases, final_inventories = results_store.final("Total_retention_volume_1")
+    for i, job in enumerate(jobs):
+        match = (
+            np.isclose(cases["dpa"], job["dpa"], rtol=1e-3, atol=0)
+            & np.isclose(cases["T"], job["T"], rtol=1e-3, atol=0)
+            & (cases["total_time"] == fpy)
+        )
+        if np.any(match):
+            inventories[i] = final_inventories[match][-1]
+    return inventories
+
+
+def fig_8_adaptive_jobs(nb_iterations=20, **kwargs):
+    """Arguments of run_case for the cases of figure 8: the coarse grid of
+    fig_8_jobs refined where log10(inventory) is poorly interpolated (see
+    adaptive_sampling.refinement_candidates).
+
+    The refinement is replayed from the results store, so that it is the
+    same on every call and across hosts. It stops at the first refinement
+    whose cases have not all been run yet: these cases are the last ones
+    returned. The cases which failed for good (recorded as failed in the
+    pipeline) are ignored by the refinement.
+
+    Args:
+        nb_iterations (int, optional): the maximum number of refinements.
+            Defaults to 20.
+        **kwargs: the arguments of refinement_candidates
+
+    Returns:
+        list of dict: the arguments of run_case
+    """
+    jobs = fig_8_jobs()
+    for iteration in range(nb_iterations):
+        inventories = fig_8_inventories(jobs)
+        failed = pipeline.failures()
+        not_run = [
+            np.isnan(inventory) and add_case(job) not in failed
+            for job, inventory in zip(jobs, inventories)
+        ]
+        if any(not_run):
+            break
+        T_new, dpa_new, indicators = refinement_candidates(
+            [job["T"] for job in jobs],
+            [job["dpa"] for job in jobs],
+            np.log10(inventories),
+            **kwargs
+        )
+        if len(T_new) == 0:
+            break
+        print(
+            "figure 8 refinement {}: {} new cases, max indicator {:.2e}".format(
+                iteration + 1, len(T_new), indicators[0]
+            )
+        )
+        jobs += [fig_8_job(dpa, T) for T, dpa in zip(T_new, dpa_new)]
+    return jobs
+
+
+def generate_fig_8_inventory_variataion(max_workers=None, queue=None):
+    """Runs the cases of figure 8 on a process pool, the longest predicted
+    cases first, refining the coarse initial grid until the inventory is well
+    interpolated (see fig_8_adaptive_jobs)
+
+    Args:
+        max_workers (int, optional): the number of processes. Defaults to the
+            number of CPUs.
+        queue (WorkQueue, optional): if given, the cases are submitted to the
+            queue instead (see run_pipeline). Only the next refinement is
+            submitted: submit again once the workers are done. Defaults to
+            None.
+    """
+    nb_jobs = 0
+    while True:
+        jobs = fig_8_adaptive_jobs()
+        for job in jobs:
+            add_case(job)
+        run_pipeline(max_workers, queue)
+        # no more refinement, or a case has not been run
+        if queue is not None or len(jobs) == nb_jobs:
+            break
+        nb_jobs = len(jobs)
+
+
+def run_pipeline(max_workers=None, queue=None):
+    """Runs the stale cases of the pipeline on a process pool, or submits
+    them to a work queue drained by workers on any number of hosts sharing
+    the filesystem:
+
+        python generate_data.py submit data/queue.sqlite
+        python -m damage_core.work_queue work data/queue.sqlite  # each host
+        python generate_data.py collect data/queue.sqlite
+
+    The workers append the results to the results store (see run_case) and
+    collect records the completed cases in the pipeline. The refinements of
+    figure 8 are submitted one at a time: submit again once the workers are
+    done, until nothing is submitted.
+
+    Args:
+        max_workers (int, optional): the number of processes. Defaults to the
+            number of CPUs.
+        queue (WorkQueue, optional): the queue. Defaults to None.
+    """
+    if queue is not None:
+        pipeline.submit(queue)
+        return
+    cost_model = CostModel("data/festim_model_costs.json")
+    pipeline.run(cost_model=cost_model, max_workers=max_workers)
+
 
-    
-    
 if __name__ == "__main__":
-    generate_fig_7_inventory_transient_and_distribution()
-    generate_fig_8_inventory_variataion()
\ No newline at end of file
+    # usage: python generate_data.py [submit|collect queue.sqlite]
+    # the cases shared by figures 7 and 8 are run once
+    for job in fig_7_jobs():
+        add_case(job)
+    if len(sys.argv) > 2 and sys.argv[1] == "collect":
+        for job in fig_8_adaptive_jobs():
+            add_case(job)
+        collected = pipeline.collect(WorkQueue(sys.argv[2]))
+        print("{} cases collected".format(len(collected)))
+    elif len(sys.argv) > 2 and sys.argv[1] == "submit":
+        generate_fig_8_inventory_variataion(queue=WorkQueue(sys.argv[2]))
+    else:
+        generate_fig_8_inventory_variataion()
@@ -0,0 +1,310 @@
+import json
+import numpy as np
+import os
+import sys
+import time
+
+from generate_data import day, fpy, fpy_export_schedule
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from damage_core.results_store import read_derived_quantities
+
+# the committed results used as reference: the undamaged 1 fpy inventories of
+# figure 8 and the 24 h retention profiles at 700 K of figure 7
+golden_folder = "data/"
+inventory_T_values = np.linspace(600, 1300, 50)[[0, 7, 21, 49]]
+profile_dpa_values = [0, 1e-03, 1e02]
+
+# tolerances on the final inventory (relative) and on the profiles (maximum
+# difference relative to the maximum of the golden profile)
+inventory_rtol = 1e-02
+profile_rtol = 5e-02
+
+
+def golden_cases():
+    """Lists the golden cases with their reference results
+
+    Returns:
+        list of dict: the cases, with the keys "name", "dpa", "T",
+            "total_time", "cells" (the number of cells of the original runs),
+            "kind" ("inventory" or "profile") and "golden" (the derived
+            quantities or the x values (m) and retention (m-3) of the profile)
+    """
+    cases = []
+    for T in inventory_T_values:
+        filename = golden_folder + "festim_model_results/dpa=0.0e+00/T={:.0f}/derived_quantities.csv".format(T)
+        cases.append(
+            {
+                "name": "inventory dpa=0.0e+00 T={:.0f}".format(T),
+                "dpa": 0,
+                "T": T,
+                "total_time": fpy,
+                "cells": 1000,
+                "kind": "inventory",
+                "golden": read_derived_quantities(filename),
+            }
+        )
+    for dpa in profile_dpa_values:
+        filename = golden_folder + "profiles/retention_profile_dpa={:.1e}.csv".format(dpa)
+        data = np.genfromtxt(filename, delimiter=",", names=True)
+        cases.append(
+            {
+                "name": "profile dpa={:.1e} T=700".format(dpa),
+                "dpa": dpa,
+                "T": 700,
+                "total_time": day,
+                "cells": 1000 if dpa == 0 else 5000,
+                "kind": "profile",
+                "golden": {"x": data["arc_length"], "retention": data["retention"]},
+            }
+        )
+    return cases
+
+
+def festim_strategy(cell_factor=1, **kwargs):
+    """Creates a strategy running festim_sim case by case
+
+    Args:
+        cell_factor (float, optional): the factor applied to the number of
+            cells of the original runs. Defaults to 1.
+        **kwargs: other arguments of festim_sim (eg. exact_trap_update)
+
+    Returns:
+        callable: the strategy
+    """
+
+    def run(cases, results_folder):
+        from festim_model import festim_sim
+
+        results = []
+        for case in cases:
+            folder = results_folder + "dpa={:.1e}/T={:.0f}/".format(
+                case["dpa"], case["T"]
+            )
+            start = time.perf_counter()
+            if case["kind"] == "inventory":
+                festim_sim(
+                    dpa=case["dpa"],
+                    T=case["T"],
+                    results_folder_name=folder,
+                    total_time=case["total_time"],
+                    cells=int(case["cells"] * cell_factor),
+                    export_schedule=fpy_export_schedule,
+                    **kwargs
+                )
+            else:
+                festim_sim(
+                    dpa=case["dpa"],
+                    T=case["T"],
+                    results_folder_name=folder,
+                    total_time=case["total_time"],
+                    cells=int(case["cells"] * cell_factor),
+                    profile_fields=["retention"],
+                    **kwargs
+                )
+            wall_time = time.perf_counter() - start
+            result = {
+                "wall_time": wall_time,
+                "series": read_derived_quantities(folder + "derived_quantities.csv"),
+            }
+            if case["kind"] == "profile":
+                with np.load(folder + "profiles.npz") as data:
+                    result["x"] = data["x"]
+                    result["retention"] = data["retention"][-1]
+            results.append(result)
+        return results
+
+    return run
+
+
+def ensemble_strategy(cells=1000, **kwargs):
+    """Creates a strategy running all the cases of the same duration together
+    with the finite difference EnsembleModel (no profiles)
+
+    Args:
+        cells (int, optional): the number of cells. Defaults to 1000.
+        **kwargs: other arguments of EnsembleModel.run
+
+    Returns:
+        callable: the strategy
+    """
+
+    def run(cases, results_folder):
+        from ensemble_solver import ensemble_sim
+
+        results = [None] * len(cases)
+        for total_time in sorted(set(case["total_time"] for case in cases)):
+            indexes = [i for i, case in enumerate(cases) if case["total_time"] == total_time]
+            start = time.perf_counter()
+            series = ensemble_sim(
+                [cases[i]["dpa"] for i in indexes],
+                [cases[i]["T"] for i in indexes],
+                total_time,
+                cells=cells,
+                **kwargs
+            )
+            # the cost of the batch is shared by its cases
+            wall_time = (time.perf_counter() - start) / len(indexes)
+            for i, case_series in zip(indexes, series):
+                results[i] = {"wall_time": wall_time, "series": case_series}
+        return results
+
+    return run
+
+
+# the first strategy is the reference of the speedups
+strategies = {
+    "festim": festim_strategy(),
+    "festim_exact_trap_update": festim_strategy(exact_trap_update=True),
+    "festim_half_cells": festim_strategy(cell_factor=0.5),
+    "ensemble": ensemble_strategy(),
+}
+
+
+def compare(case, result):
+    """Compares the result of a strategy to the golden result of a case
+
+    Args:
+        case (dict): the case (see golden_cases)
+        result (dict): the result of the strategy
+
+    Returns:
+        dict: the errors ("inventory_error" for the inventory cases, the
+            final inventory relative error, "series_error" the maximum
+            relative error on the retention over the golden times from 1 s,
+            "profile_error" for the profile cases) and "status" ("passed",
+            "failed", or "skipped" if the strategy gives no profile)
+    """
+    errors = {}
+    if case["kind"] == "profile" and "retention" not in result:
+        return {"status": "skipped"}
+    if case["kind"] == "inventory":
+        golden = case["golden"]
+        series = result["series"]
+        final = series["Total_retention_volume_1"][-1]
+        golden_final = golden["Total_retention_volume_1"][-1]
+        errors["inventory_error"] = abs(final - golden_final) / abs(golden_final)
+        # the time steps differ, the series are compared in log time
+        times = golden["ts"][(golden["ts"] >= 1) & (golden["ts"] <= series["ts"][-1])]
+        retention = np.interp(
+            np.log(times), np.log(series["ts"]), series["Total_retention_volume_1"]
+        )
+        golden_retention = np.interp(
+            np.log(times), np.log(golden["ts"]), golden["Total_retention_volume_1"]
+        )
+        errors["series_error"] = np.max(
+            np.abs(retention - golden_retention) / np.abs(golden_retention)
+        )
+        passed = errors["inventory_error"] <= inventory_rtol
+    else:
+        golden = case["golden"]
+        retention = np.interp(golden["x"], result["x"], result["retention"])
+        errors["profile_error"] = np.max(
+            np.abs(retention - golden["retention"])
+        ) / np.max(np.abs(golden["retention"]))
+        passed = errors["profile_error"] <= profile_rtol
+    errors = {key: float(value) for key, value in errors.items()}
+    errors["status"] = "passed" if passed else "failed"
+    return errors
+
+
+def regression(
+    names=None, cases=None, results_folder="data/golden_regression/", report_file=None
+):
+    """Runs strategies on the golden cases and compares their results to the
+    golden ones
+
+    Args:
+        names (list of str, optional): the strategies to run (keys of
+            strategies). Defaults to all the strategies.
+        cases (list of dict, optional): the cases. Defaults to golden_cases().
+        results_folder (str, optional): the folder of the results of the
+            strategies (the golden results are not overwritten). Defaults to
+            "data/golden_regression/".
+        report_file (str, optional): if given, the report is written to this
+            JSON file. Defaults to None.
+
+    Returns:
+        list of dict: one row per strategy and case with the wall time, the
+            speedup over the reference strategy, the errors and "status" (see
+            compare)
+    """
+    if names is None:
+        names = list(strategies)
+    if cases is None:
+        cases = golden_cases()
+    reference_times = {}
+    rows = []
+    for name in names:
+        print("running strategy {}".format(name))
+        try:
+            results = strategies[name](cases, results_folder + name + "/")
+        except Exception as e:
+            print("strategy {} failed: {}".format(name, e))
+            for case in cases:
+                rows.append({"strategy": name, "case": case["name"], "status": "failed"})
+            continue
+        for case, result in zip(cases, results):
+            row = {
+                "strategy": name,
+                "case": case["name"],
+                "wall_time": result["wall_time"],
+            }
+            if name == names[0]:
+                reference_times[case["name"]] = result["wall_time"]
+            if case["name"] in reference_times:
+                row["speedup"] = reference_times[case["name"]] / result["wall_time"]
+            row.update(compare(case, result))
+            rows.append(row)
+
+    if report_file is not None:
+        folder = os.path.dirname(os.path.abspath(report_file))
+        os.makedirs(folder, exist_ok=True)
+        with open(report_file, "w") as f:
+            json.dump(rows, f, indent=1)
+    return rows
+
+
+def report(rows):
+    """Formats the rows of regression as a text table
+
+    Args:
+        rows (list of dict): the rows returned by regression
+
+    Returns:
+        str: the table
+    """
+    lines = [
+        "{:<26} {:<28} {:>9} {:>8} {:>10} {:>10} {:>10}  {}".format(
+            "strategy", "case", "time (s)", "speedup", "inventory", "series", "profile", ""
+        )
+    ]
+
+    def value(row, key, fmt):
+        return fmt.format(row[key]) if key in row else "-"
+
+    for row in rows:
+        lines.append(
+            "{:<26} {:<28} {:>9} {:>8} {:>10} {:>10} {:>10}  {}".format(
+                row["strategy"],
+                row["case"],
+                value(row, "wall_time", "{:.1f}"),
+                value(row, "speedup", "{:.2f}"),
+                value(row, "inventory_error", "{:.1e}"),
+                value(row, "series_error", "{:.1e}"),
+                value(row, "profile_error", "{:.1e}"),
+                {"passed": "ok", "failed": "FAILED", "skipped": "skipped"}[
+                    row["status"]
+                ],
+            )
+        )
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    # usage: python golden_regression.py [strategy ...]
+    # exits with 1 if a strategy does not reproduce the golden results
+    names = sys.argv[1:] if len(sys.argv) > 1 else None
+    rows = regression(names, report_file="data/golden_regression/report.json")
+    print(report(rows))
+    sys.exit(0 if all(row["status"] != "failed" for row in rows) else 1)
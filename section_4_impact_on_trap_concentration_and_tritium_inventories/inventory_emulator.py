@@ -0,0 +1,297 @@
+import numpy as np
+import os
+import sys
+from scipy.interpolate import LinearNDInterpolator, interp1d
+from scipy.spatial import Delaunay
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from damage_core.results_store import read_derived_quantities
+
+
+class InventoryEmulator:
+    """Instant estimate of the tritium inventory, linearly interpolated in
+    log10(inventory) over (T, log10(dpa), log10(t)) from simulation results.
+
+    The axes are normalised before the Delaunay triangulation and the axes on
+    which all the training points have the same value (eg. a sweep at a single
+    temperature) are dropped.
+
+    Args:
+        cases (list of dict): the training cases, with keys "dpa" (dpa/fpy),
+            "T" (K), "t" (s, array) and "inventory" (m-2, array)
+        nb_times (int, optional): the number of log-spaced times at which each
+            case is sampled. Defaults to 50.
+        dpa_floor (float, optional): the damage rate used in place of 0 (the
+            undamaged cases) on the log10(dpa) axis. Defaults to 1e-6.
+    """
+
+    def __init__(self, cases, nb_times=50, dpa_floor=1e-6):
+        self.dpa_floor = dpa_floor
+        self.cases = cases
+        points = []
+        values = []
+        for case in cases:
+            t = np.asarray(case["t"])
+            inventory = np.asarray(case["inventory"])
+            keep = (t > 0) & (inventory > 0)
+            log_t = np.log10(t[keep])
+            log_inventory = np.log10(inventory[keep])
+            sampled_log_t = np.linspace(log_t[0], log_t[-1], num=nb_times)
+            points.append(
+                np.column_stack(
+                    [
+                        np.full(nb_times, case["T"]),
+                        np.full(nb_times, self.log_dpa(case["dpa"])),
+                        sampled_log_t,
+                    ]
+                )
+            )
+            values.append(np.interp(sampled_log_t, log_t, log_inventory))
+        points = np.concatenate(points)
+        values = np.concatenate(values)
+
+        self.lower = points.min(axis=0)
+        self.span = points.max(axis=0) - self.lower
+        self.active = self.span > 0
+        self.span[~self.active] = 1
+        scaled_points = self.scale(points)[:, self.active]
+
+        if self.active.sum() == 1:
+            order = np.argsort(scaled_points[:, 0])
+            self.interpolator = interp1d(
+                scaled_points[order, 0],
+                values[order],
+                bounds_error=False,
+                fill_value=np.nan,
+            )
+            self.triangulation = None
+        else:
+            self.triangulation = Delaunay(scaled_points)
+            self.interpolator = LinearNDInterpolator(self.triangulation, values)
+
+    @classmethod
+    def from_store(
+        cls, store, total_time=None, column="Total_retention_volume_1", **kwargs
+    ):
+        """Creates an emulator from the cases of a ResultsStore
+
+        Args:
+            store (ResultsStore): the results store
+            total_time (float, optional): only the cases with this simulated
+                time are used. If None, all the cases are used. Defaults to
+                None.
+            column (str, optional): the inventory column. Defaults to
+                "Total_retention_volume_1".
+            **kwargs: other arguments of InventoryEmulator
+
+        Returns:
+            InventoryEmulator: the emulator
+        """
+        parameters = store.cases()
+        cases = []
+        for i in range(len(parameters["offset"])):
+            if total_time is not None and parameters["total_time"][i] != total_time:
+                continue
+            key = {name: parameters[name][i] for name in store.key}
+            series = store.series(columns=["ts", column], **key)
+            cases.append(
+                {
+                    "dpa": key["dpa"],
+                    "T": key["T"],
+                    "t": series["ts"],
+                    "inventory": series[column],
+                }
+            )
+        return cls(cases, **kwargs)
+
+    @classmethod
+    def from_results_folder(
+        cls,
+        results_folder="data/festim_model_results/",
+        column="Total_retention_volume_1",
+        **kwargs
+    ):
+        """Creates an emulator from a results folder organised as
+        results_folder/dpa={:.1e}/T={:.0f}/derived_quantities.csv
+
+        Args:
+            results_folder (str, optional): the results folder. Defaults to
+                "data/festim_model_results/".
+            column (str, optional): the inventory column. Defaults to
+                "Total_retention_volume_1".
+            **kwargs: other arguments of InventoryEmulator
+
+        Returns:
+            InventoryEmulator: the emulator
+        """
+        cases = []
+        for dpa_folder in sorted(os.listdir(results_folder)):
+            if not dpa_folder.startswith("dpa="):
+                continue
+            for T_folder in sorted(
+                os.listdir(os.path.join(results_folder, dpa_folder))
+            ):
+                data_file = os.path.join(
+                    results_folder, dpa_folder, T_folder, "derived_quantities.csv"
+                )
+                if not T_folder.startswith("T=") or not os.path.exists(data_file):
+                    continue
+                data = read_derived_quantities(data_file)
+                cases.append(
+                    {
+                        "dpa": float(dpa_folder[len("dpa=") :]),
+                        "T": float(T_folder[len("T=") :]),
+                        "t": data["ts"],
+                        "inventory": data[column],
+                    }
+                )
+        return cls(cases, **kwargs)
+
+    def log_dpa(self, dpa):
+        return np.log10(np.maximum(dpa, self.dpa_floor))
+
+    def scale(self, points):
+        return (points - self.lower) / self.span
+
+    def __call__(self, T, dpa, t):
+        """Estimates the inventory (vectorised over the arguments, which are
+        broadcast together)
+
+        Args:
+            T (float or array_like): the temperature (K)
+            dpa (float or array_like): the damage rate (dpa/fpy)
+            t (float or array_like): the time (s)
+
+        Returns:
+            numpy.array, numpy.array: the inventories (m-2, nan outside of the
+                training hull) and a boolean array, False where the query is
+                outside of the training hull
+        """
+        T, dpa, t = np.broadcast_arrays(
+            np.asarray(T, dtype=float),
+            np.asarray(dpa, dtype=float),
+            np.asarray(t, dtype=float),
+        )
+        points = np.column_stack(
+            [T.ravel(), self.log_dpa(dpa.ravel()), np.log10(t.ravel())]
+        )
+        scaled_points = self.scale(points)
+
+        # queries have to match the axes without spread exactly
+        inside = np.all(
+            np.isclose(scaled_points[:, ~self.active], 0, atol=1e-9), axis=1
+        )
+        scaled_points = scaled_points[:, self.active]
+        if self.triangulation is None:
+            log_inventory = self.interpolator(scaled_points[:, 0])
+            inside &= ~np.isnan(log_inventory)
+        else:
+            inside &= self.triangulation.find_simplex(scaled_points) >= 0
+            log_inventory = self.interpolator(scaled_points)
+        inventory = np.where(inside, 10**log_inventory, np.nan)
+        return inventory.reshape(T.shape), inside.reshape(T.shape)
+
+    def leave_one_out_errors(self, t=None):
+        """Computes, for each training case, the error on its log10 inventory
+        at time t when it is interpolated from the other cases (on the
+        (T, log10(dpa)) plane)
+
+        Args:
+            t (float, optional): the time (s). If None, the shortest final time
+                of the cases is used. Defaults to None.
+
+        Returns:
+            numpy.array, numpy.array: the (T, log10(dpa)) points of the cases
+                and the absolute errors on log10(inventory) (nan for the cases
+                on the hull)
+        """
+        if t is None:
+            t = min(case["t"][-1] for case in self.cases)
+        points = np.array(
+            [[case["T"], self.log_dpa(case["dpa"])] for case in self.cases]
+        )
+        values = np.array(
+            [
+                np.interp(np.log10(t), np.log10(case["t"]), np.log10(case["inventory"]))
+                for case in self.cases
+            ]
+        )
+        active = self.active[:2]
+        scaled_points = self.scale(np.column_stack([points, np.zeros(len(points))]))
+        scaled_points = scaled_points[:, :2][:, active]
+
+        errors = np.full(len(points), np.nan)
+        for i in range(len(points)):
+            others = np.arange(len(points)) != i
+            if active.sum() == 1:
+                interpolator = interp1d(
+                    scaled_points[others, 0],
+                    values[others],
+                    bounds_error=False,
+                    fill_value=np.nan,
+                )
+                estimate = interpolator(scaled_points[i, 0])
+            elif active.sum() == 2:
+                interpolator = LinearNDInterpolator(
+                    scaled_points[others], values[others]
+                )
+                estimate = interpolator(scaled_points[i : i + 1])[0]
+            else:
+                continue
+            errors[i] = np.abs(estimate - values[i])
+        return points, errors
+
+    def suggest_simulations(self, nb_simulations=10, t=None):
+        """Suggests the (T, dpa) cases which would reduce the interpolation
+        error the most: midpoints between neighbouring training cases, ranked
+        by the leave-one-out errors of the two cases. As in
+        adaptive_sampling.refinement_candidates, the edges from an undamaged
+        case to a damaged one are left out, their midpoint being at the
+        arbitrary dpa_floor/dpa mean rather than at a physical damage rate.
+
+        Args:
+            nb_simulations (int, optional): the number of suggested cases.
+                Defaults to 10.
+            t (float, optional): the time (s) at which the errors are
+                evaluated. See leave_one_out_errors. Defaults to None.
+
+        Returns:
+            numpy.array, numpy.array: the temperatures (K) and damage rates
+                (dpa/fpy, 0 for undamaged cases) of the suggested cases
+        """
+        points, errors = self.leave_one_out_errors(t)
+        errors = np.nan_to_num(errors, nan=0.0)
+        active = self.active[:2]
+        scaled_points = (points - self.lower[:2]) / self.span[:2]
+
+        # neighbouring cases
+        if active.sum() == 1:
+            axis = np.where(active)[0][0]
+            order = np.argsort(scaled_points[:, axis])
+            edges = np.column_stack([order[:-1], order[1:]])
+        else:
+            triangulation = Delaunay(scaled_points)
+            edges = set()
+            for simplex in triangulation.simplices:
+                for i in range(3):
+                    a, b = sorted((simplex[i], simplex[(i + 1) % 3]))
+                    edges.add((a, b))
+            edges = np.array(sorted(edges))
+
+        undamaged = points[:, 1] <= np.log10(self.dpa_floor)
+        edges = edges[undamaged[edges[:, 0]] == undamaged[edges[:, 1]]]
+
+        scores = errors[edges].max(axis=1)
+        best = np.argsort(scores)[::-1][:nb_simulations]
+        midpoints = points[edges[best]].mean(axis=1)
+        log_dpa = midpoints[:, 1]
+        dpa = np.where(log_dpa <= np.log10(self.dpa_floor), 0, 10**log_dpa)
+        return midpoints[:, 0], dpa
+
+
+if __name__ == "__main__":
+    emulator = InventoryEmulator.from_results_folder()
+    T, dpa = emulator.suggest_simulations()
+    print("Suggested simulations:")
+    for T_value, dpa_value in zip(T, dpa):
+        print("T = {:.0f} K, dpa = {:.1e} dpa/fpy".format(T_value, dpa_value))
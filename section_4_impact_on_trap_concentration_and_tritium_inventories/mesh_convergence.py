@@ -0,0 +1,130 @@
+import numpy as np
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from damage_core.cell_cache import CellCache
+from damage_core.export_schedule import ExportSchedule
+from damage_core.job_scheduling import run_jobs
+from damage_core.results_store import read_derived_quantities
+
+
+def final_inventory(dpa, T, cells, total_time, results_folder_name, **kwargs):
+    """Runs festim_sim and reads the final inventory
+
+    Args:
+        dpa (float): the damage rate in dpa/fpy
+        T (float): the temperature in K
+        cells (int): the number of cells
+        total_time (float): the simulated time in s
+        results_folder_name (str): the results folder location
+        **kwargs: other arguments of festim_sim
+
+    Returns:
+        float: the final inventory (m-2), nan if the simulation failed
+    """
+    from festim_model import festim_sim
+
+    try:
+        festim_sim(
+            dpa=dpa,
+            T=T,
+            results_folder_name=results_folder_name,
+            total_time=total_time,
+            cells=cells,
+            **kwargs
+        )
+    except Exception as e:
+        print("case T = {:.0f}, dpa = {:.1e}, n = {} failed".format(T, dpa, cells))
+        return np.nan
+    data = read_derived_quantities(results_folder_name + "derived_quantities.csv")
+    return data["Total_retention_volume_1"][-1]
+
+
+def mesh_convergence(
+    dpa,
+    T,
+    total_time,
+    cells_values=None,
+    rtol=0.01,
+    results_folder="data/mesh_convergence/",
+    cell_cache=None,
+    max_workers=None,
+    **kwargs
+):
+    """Runs a case with several meshes in parallel and finds the smallest
+    mesh whose final inventory, and those of all the finer meshes, match the
+    finest one within rtol
+
+    Args:
+        dpa (float): the damage rate in dpa/fpy
+        T (float): the temperature in K
+        total_time (float): the simulated time in s
+        cells_values (list of int, optional): the numbers of cells, in
+            increasing order. Defaults to 1000 x 1.5^k for k = 0..5.
+        rtol (float, optional): the relative tolerance on the final
+            inventory. Defaults to 0.01.
+        results_folder (str, optional): the results folder. Defaults to
+            "data/mesh_convergence/".
+        cell_cache (CellCache, optional): if given, the number of cells found
+            is cached. Defaults to None.
+        max_workers (int, optional): the number of processes. Defaults to the
+            number of CPUs.
+        **kwargs: other arguments of festim_sim
+
+    Returns:
+        int, numpy.array: the number of cells (None if the case has not
+            converged) and the final inventories of all the meshes (nan for
+            the failed runs)
+    """
+    if cells_values is None:
+        cells_values = [int(1000 * 1.5**k) for k in range(6)]
+    jobs = [
+        dict(
+            dpa=dpa,
+            T=T,
+            cells=cells,
+            total_time=total_time,
+            results_folder_name=results_folder
+            + "dpa={:.1e}/T={:.0f}/cells={}/".format(dpa, T, cells),
+            **kwargs
+        )
+        for cells in cells_values
+    ]
+    inventories = np.array(run_jobs(final_inventory, jobs, max_workers=max_workers))
+    succeeded = np.isfinite(inventories)
+    if not succeeded.any():
+        print("case T = {:.0f}, dpa = {:.1e}: all the meshes failed".format(T, dpa))
+        return None, inventories
+
+    reference_index = np.where(succeeded)[0][-1]
+    reference = inventories[reference_index]
+    chosen_index = reference_index
+    for i in range(reference_index - 1, -1, -1):
+        if not succeeded[i] or abs(inventories[i] - reference) > rtol * abs(reference):
+            break
+        chosen_index = i
+    if chosen_index == reference_index:
+        print("case T = {:.0f}, dpa = {:.1e}: not converged".format(T, dpa))
+        return None, inventories
+
+    cells = cells_values[chosen_index]
+    print("case T = {:.0f}, dpa = {:.1e}: n = {}".format(T, dpa, cells))
+    if cell_cache is not None:
+        cell_cache.add(T, dpa, cells)
+    return cells, inventories
+
+
+if __name__ == "__main__":
+    fpy = 3600 * 24 * 365
+    # one study per (T, dpa) region of figure 8
+    cell_cache = CellCache("data/mesh_convergence_cells.json")
+    for T in np.linspace(600, 1300, 8):
+        for dpa in np.concatenate([[0], np.geomspace(1e-05, 1e02, 8)]):
+            mesh_convergence(
+                dpa,
+                T,
+                total_time=fpy,
+                cell_cache=cell_cache,
+                export_schedule=ExportSchedule.log_spaced(fpy, nb_times=20),
+            )
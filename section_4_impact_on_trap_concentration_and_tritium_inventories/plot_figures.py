@@ -3,67 +3,26 @@ from matplotlib import cm, rcParams
 import shutil
 from matplotlib.colors import LogNorm
 import numpy as np
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from adaptive_sampling import interpolate_log_inventory
+from damage_core import cached_loading
+from damage_core.results_store import ResultsStore
+from damage_core.trap_catalogue import tungsten_traps
 
 rcParams['text.usetex']= True if shutil.which('latex') else False
 
 
 def plot_fig_6_trap_density_variation():
-    k_B = 8.617e-5  # eV/K
-    traps_properties = {
-        "D1": {
-            "A_0": 6.18e-3,
-            "E_A": 0.24,
-            "n_max": 6.8e25,
-            "K": 1.9e28,
-        },
-        "D2": {
-            "A_0": 6.18e-3,
-            "E_A": 0.24,
-            "n_max": 6.2e25,
-            "K": 8.0e27,
-        },
-        "D3": {
-            "A_0": 6.18e-3,
-            "E_A": 0.30,
-            "n_max": 5.3e25,
-            "K": 3.5e27,
-        },
-        "D4": {
-            "A_0": 6.18e-3,
-            "E_A": 0.30,
-            "n_max": 4.9e25,
-            "K": 7.0e27,
-        },
-        "D5": {
-            "A_0": 0,
-            "E_A": 0,
-            "n_max": 2.0e25,
-            "K": 1.2e26,
-        },
-    }
-    def A(T, A_0, E_A):
-        return A_0 * np.exp(-E_A / k_B / T)
-    def n(t, K, damage_rate, n_max, A):
-        tau = (
-            damage_rate * K / n_max + A
-        ) ** -1  # characteristic time for trap creation/annealing
-        n_infinity = (A / (damage_rate * K) + 1 / n_max) ** -1  # equilibrium density
-        return n_infinity * (1 - np.exp(-t / tau))
-    n_max = 6.8e25
-    K = 4e27
+    # traps created by damage, same parameters as the FESTIM model
+    damage_traps = tungsten_traps[tungsten_traps.K > 0]
     one_fpy = 1 * 365 * 24 * 3600
     colours = ["tab:blue", "tab:red"]
     for T, colour in zip([295, 800], colours):
         damage_rate_range = np.logspace(-3, 3) / one_fpy
-        densities = 0
-        for trap in traps_properties.values():
-            A_0 = trap["A_0"]
-            E_A = trap["E_A"]
-            n_max = trap["n_max"]
-            K = trap["K"]
-            A_trap = A(T, A_0, E_A)
-            densities_trap = n(one_fpy, K, damage_rate_range, n_max, A_trap)
-            densities = densities + densities_trap
+        densities = damage_traps.densities(one_fpy, damage_rate_range, T).sum(axis=-1)
         plt.loglog(
             damage_rate_range * one_fpy, densities, label="{} K".format(T), color=colour
         )
@@ -82,6 +41,31 @@ def plot_fig_6_trap_density_variation():
     # ax2.set_xlabel("Damage (dpa)")
 
 
+def load_retention_profile(dpa, results_folder="data/profiles/"):
+    """Reads the final retention profile of a 24 h case at 700 K
+
+    The profiles.npz file written by festim_model.festim_sim is used if it
+    exists, otherwise the profile is read from the ParaView "Plot over line"
+    csv file.
+
+    Args:
+        dpa (float): the damage rate in dpa/fpy
+        results_folder (str, optional): the profiles folder. Defaults to
+            "data/profiles/".
+
+    Returns:
+        numpy.array, numpy.array: the x values (m) and the retention (T m-3)
+    """
+    profile_file = results_folder + "dpa={:.1e}/profiles.npz".format(dpa)
+    if os.path.exists(profile_file):
+        with np.load(profile_file) as data:
+            return data["x"], data["retention"][-1]
+
+    data_file = results_folder + "retention_profile_dpa={:.1e}.csv".format(dpa)
+    data = cached_loading.genfromtxt(data_file, delimiter=",", names=True)
+    return data["arc_length"], data["retention"]
+
+
 def plot_fig_7_inventory_transient_and_distribution():
     dpa_values = np.geomspace(1e-05, 1e02, num=8)
 
@@ -98,14 +82,14 @@ def plot_fig_7_inventory_transient_and_distribution():
     results_folder = "data/festim_model_results/"
     for dpa, colour in zip(dpa_values, colours):
         data_file = results_folder + "dpa={:.1e}/T=700/derived_quantities.csv".format(dpa)
-        data = np.genfromtxt(data_file, delimiter=",", names=True)
+        data = cached_loading.genfromtxt(data_file, delimiter=",", names=True)
         inv_per_dpa = data["Total_retention_volume_1"]
         times = data["ts"]
         axs[0].plot(times, inv_per_dpa, color=colour)
 
     # standard case
     standard_file = results_folder + "dpa=0.0e+00/T=700/derived_quantities.csv"
-    data = np.genfromtxt(standard_file, delimiter=",", names=True)
+    data = cached_loading.genfromtxt(standard_file, delimiter=",", names=True)
     inv_per_dpa = data["Total_retention_volume_1"]
     times = data["ts"]
     axs[0].plot(times, inv_per_dpa, color="black", label=r"undamaged")
@@ -125,27 +109,13 @@ def plot_fig_7_inventory_transient_and_distribution():
     axs[0].spines["right"].set_visible(False)
 
     # ##### retention profile ##### #
-    results_folder = "data/profiles/"
-    data_file = results_folder + "retention_profile_dpa=1.0e+02.csv"
-    x_data = np.genfromtxt(data_file, delimiter=",", names=True)
-    x_values = x_data["arc_length"]
-    x_plot = x_values * 1000
-
-    inventories = []
-    for dpa in dpa_values:
-        data_file = results_folder + "retention_profile_dpa={:.1e}.csv".format(dpa)
-        data = np.genfromtxt(data_file, delimiter=",", names=True)
-        inv = data["retention"]
-        inventories.append(inv)
-
-    for inv, dpa, colour in zip(inventories, dpa_values, colours):
-        axs[1].plot(x_plot, inv, color=colour)
+    for dpa, colour in zip(dpa_values, colours):
+        x, inv = load_retention_profile(dpa)
+        axs[1].plot(x * 1000, inv, color=colour)
 
     # standard case
-    standard_file = results_folder + "retention_profile_dpa=0.0e+00.csv"
-    data = np.genfromtxt(standard_file, delimiter=",", names=True)
-    inv = data["retention"]
-    axs[1].plot(x_plot, inv, color="black")
+    x, inv = load_retention_profile(0)
+    axs[1].plot(x * 1000, inv, color="black")
 
     axs[1].set_xlabel(r"x (mm)")
     axs[1].set_ylabel(r"T retention (T m$^{-3}$)")
@@ -162,27 +132,53 @@ def plot_fig_7_inventory_transient_and_distribution():
 def plot_fig_8_inventory_variation():
     temperature_values = np.linspace(600, 1300, 50)
     dpa_values = np.geomspace(1e-05, 1e02, 8)
+    fpy = 3600 * 24 * 365
 
     inventories = []
     inventories_no_damage = []
 
+    store = ResultsStore("data/festim_model_results.h5")
+    if store.exists():
+        # one read of the final inventories of all the cases
+        cases, final_inventories = store.final("Total_retention_volume_1")
+
+        fpy_cases = cases["total_time"] == fpy
+
+        # the tolerance allows cases ingested from rounded folder names
+        def final_inventory(dpa, T):
+            match = (
+                np.isclose(cases["dpa"], dpa, rtol=1e-3, atol=0)
+                & np.isclose(cases["T"], T, rtol=1e-3, atol=0)
+                & fpy_cases
+            )
+            if np.any(match):
+                return final_inventories[match][-1]
+            # the adaptive sweep does not run the whole grid
+            log_inventory = interpolate_log_inventory(
+                cases["T"][fpy_cases],
+                cases["dpa"][fpy_cases],
+                np.log10(final_inventories[fpy_cases]),
+                [T],
+                [dpa],
+            )
+            return 10 ** log_inventory[0]
+
+    else:
+
+        def final_inventory(dpa, T):
+            data_file = "data/festim_model_results/dpa={:.1e}/T={:.0f}/derived_quantities.csv".format(dpa, T)
+            data = cached_loading.genfromtxt(data_file, delimiter=",", names=True)
+            return data["Total_retention_volume_1"][-1]
+
     for dpa in dpa_values:
         inventory_per_dpa = []
         for T in temperature_values:
-            data_file = "data/festim_model_results/dpa={:.1e}/T={:.0f}/derived_quantities.csv".format(dpa, T)
-            data = np.genfromtxt(data_file, delimiter=",", names=True)
-            
-            inventory = data["Total_retention_volume_1"][-1]
-            inventory_per_dpa.append(inventory)
+            inventory_per_dpa.append(final_inventory(dpa, T))
         inventories.append(inventory_per_dpa)
 
     # undamaged values
     for T in temperature_values:
-        data_file = "data/festim_model_results/dpa=0.0e+00/T={:.0f}/derived_quantities.csv".format(T)
-        data = np.genfromtxt(data_file, delimiter=",", names=True)
-        
-        inventory = data["Total_retention_volume_1"][-1]
-        inventories_no_damage.append(inventory)
+        inventories_no_damage.append(final_inventory(0, T))
         
     inventories = np.array(inventories)
     inventories_no_damage = np.array(inventories_no_damage)
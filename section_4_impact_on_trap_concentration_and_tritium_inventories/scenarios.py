@@ -0,0 +1,91 @@
+import numpy as np
+
+
+class Scenario:
+    """Piecewise constant history of the temperature and damage rate, eg.
+    burn and dwell pulses of a reactor, optionally repeated periodically.
+
+    Args:
+        times (array_like): the start times of the plateaus (s), the first one
+            being 0
+        T (array_like): the temperature of each plateau (K)
+        dpa (array_like): the damage rate of each plateau (dpa/fpy)
+        period (float, optional): if given, the history is repeated with this
+            period (s), which has to be larger than the last start time.
+            Defaults to None.
+    """
+
+    def __init__(self, times, T, dpa, period=None):
+        self.times = np.asarray(times, dtype=float)
+        self.T = np.asarray(T, dtype=float)
+        self.dpa = np.asarray(dpa, dtype=float)
+        self.period = period
+        if self.times[0] != 0 or np.any(np.diff(self.times) <= 0):
+            raise ValueError("times have to start at 0 and be increasing")
+        if not len(self.times) == len(self.T) == len(self.dpa):
+            raise ValueError("times, T and dpa have to be of the same length")
+        if period is not None and period <= self.times[-1]:
+            raise ValueError("period has to be larger than the last time")
+
+    @classmethod
+    def pulsed(cls, burn_time, dwell_time, T_burn, T_dwell, dpa_burn, dpa_dwell=0):
+        """Creates a periodic scenario of burn and dwell phases
+
+        Args:
+            burn_time (float): the duration of the burn phases (s)
+            dwell_time (float): the duration of the dwell phases (s)
+            T_burn (float): the temperature during the burn phases (K)
+            T_dwell (float): the temperature during the dwell phases (K)
+            dpa_burn (float): the damage rate during the burn phases
+                (dpa/fpy)
+            dpa_dwell (float, optional): the damage rate during the dwell
+                phases (dpa/fpy). Defaults to 0.
+
+        Returns:
+            Scenario: the scenario
+        """
+        return cls(
+            times=[0, burn_time],
+            T=[T_burn, T_dwell],
+            dpa=[dpa_burn, dpa_dwell],
+            period=burn_time + dwell_time,
+        )
+
+    def plateau(self, t):
+        """Finds the plateau of times t (vectorised)"""
+        t = np.asarray(t, dtype=float)
+        if self.period is not None:
+            t = np.mod(t, self.period)
+        return np.searchsorted(self.times, t, side="right") - 1
+
+    def temperature(self, t):
+        return self.T[self.plateau(t)]
+
+    def damage_rate(self, t):
+        return self.dpa[self.plateau(t)]
+
+    def edges(self, final_time):
+        """Computes the times at which the temperature or damage rate may
+        jump, up to final_time
+
+        Args:
+            final_time (float): the final time (s)
+
+        Returns:
+            numpy.array: the edges (s), cycle starts included
+        """
+        if self.period is None:
+            edges = self.times[1:]
+        else:
+            nb_cycles = int(np.ceil(final_time / self.period))
+            starts = np.arange(nb_cycles + 1)[:, np.newaxis] * self.period
+            edges = (starts + self.times).ravel()[1:]
+        return edges[edges < final_time]
+
+    def description(self):
+        return {
+            "times": self.times.tolist(),
+            "T": self.T.tolist(),
+            "dpa": self.dpa.tolist(),
+            "period": self.period,
+        }